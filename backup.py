@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+零拷贝备份 - 备份目录里的文件尽量不复制数据
+依次尝试：reflink（写时复制，Linux FICLONE / macOS clonefile）→ 硬链接 → 普通复制
+
+重命名只改变备份目录里的目录项，不修改文件内容，所以硬链接和原文件共用数据也是安全的；
+每次重命名都会记录到备份目录下的 .rename_journal.jsonl，可以据此核对或还原文件名。
+
+环境变量 BACKUP_MODE：auto（默认）/ reflink / hardlink / copy
+"""
+import errno
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+
+BACKUP_MODES = ("auto", "reflink", "hardlink", "copy")
+JOURNAL_NAME = ".rename_journal.jsonl"
+
+# <linux/fs.h>: #define FICLONE _IOW(0x94, 9, int)
+_FICLONE = 0x40049409
+
+# 这些错误说明当前文件系统 / 平台不支持该方式，之后的文件不再尝试
+_UNSUPPORTED_ERRNOS = {errno.EXDEV, errno.EPERM, errno.EINVAL, errno.ENOTTY, errno.EOPNOTSUPP, errno.ENOSYS,
+                       getattr(errno, "ENOTSUP", errno.EOPNOTSUPP)}
+
+
+def load_backup_mode(value=None):
+    """读取备份方式，参数优先，其次环境变量 BACKUP_MODE，非法值按 auto 处理"""
+    mode = (value or os.environ.get("BACKUP_MODE") or "auto").lower()
+    return mode if mode in BACKUP_MODES else "auto"
+
+
+def _reflink_linux(src, dst):
+    import fcntl
+
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+        except OSError:
+            fdst.close()
+            os.unlink(dst)
+            raise
+
+
+_clonefile = None
+
+
+def _reflink_macos(src, dst):
+    global _clonefile
+    if _clonefile is None:
+        import ctypes
+        libc = ctypes.CDLL("libc.dylib", use_errno=True)
+        _clonefile = libc.clonefile
+        _clonefile.argtypes = [ctypes.c_char_p, ctypes.c_char_p, ctypes.c_int]
+    if _clonefile(os.fsencode(src), os.fsencode(dst), 0) != 0:
+        import ctypes
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err), src)
+
+
+def reflink(src, dst):
+    """写时复制克隆文件；平台或文件系统不支持时抛出 OSError"""
+    if sys.platform.startswith("linux"):
+        _reflink_linux(src, dst)
+    elif sys.platform == "darwin":
+        _reflink_macos(src, dst)
+    else:
+        raise OSError(errno.EOPNOTSUPP, "当前平台不支持 reflink", src)
+    shutil.copystat(src, dst)
+
+
+class FileCloner:
+    """
+    按 reflink → 硬链接 → 复制 的顺序备份单个文件。
+    某种方式因不支持而失败后，后续文件直接跳过它（同一目录的文件在同一个文件系统上）。
+    """
+
+    def __init__(self, mode=None):
+        self.mode = load_backup_mode(mode)
+        if self.mode == "auto":
+            self.methods = ["reflink", "hardlink", "copy"]
+        elif self.mode == "copy":
+            self.methods = ["copy"]
+        else:
+            self.methods = [self.mode, "copy"]
+        self.counts = {name: 0 for name in ("reflink", "hardlink", "copy")}
+        self.bytes_total = 0
+        self.bytes_copied = 0
+        self._lock = threading.Lock()
+
+    def clone(self, src, dst):
+        """
+        :return: 实际使用的方式：reflink / hardlink / copy。
+        """
+        size = os.path.getsize(src)
+        for method in list(self.methods):
+            if method == "copy":
+                shutil.copy2(src, dst)
+                break
+            try:
+                if method == "reflink":
+                    reflink(src, dst)
+                else:
+                    os.link(src, dst)
+                break
+            except OSError as e:
+                if e.errno in _UNSUPPORTED_ERRNOS or e.errno is None:
+                    with self._lock:
+                        if method in self.methods:
+                            self.methods.remove(method)
+                    continue
+                raise
+        with self._lock:
+            self.counts[method] += 1
+            self.bytes_total += size
+            if method == "copy":
+                self.bytes_copied += size
+        return method
+
+    def stats(self):
+        return {
+            "mode": self.mode,
+            "methods": {name: count for name, count in self.counts.items() if count},
+            "bytes_total": self.bytes_total,
+            "bytes_copied": self.bytes_copied,
+        }
+
+
+class RenameJournal:
+    """
+    备份目录下的重命名日志（JSON Lines）：第一行记录备份来源和方式，之后每行一次重命名。
+    """
+
+    def __init__(self, bak_dir):
+        self.path = os.path.join(bak_dir, JOURNAL_NAME)
+        self._lock = threading.Lock()
+
+    def write(self, event, **data):
+        record = {"event": event, "time": time.strftime("%Y-%m-%d %H:%M:%S"), **data}
+        with self._lock, open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def record_rename(self, old_name, new_name):
+        self.write("rename", old=old_name, new=new_name)
+
+
+def is_journal(filename):
+    return filename == JOURNAL_NAME
@@ -5,10 +5,15 @@
 """
 import os
 import base64
-import requests
 from typing import Optional, Dict, List
 from PIL import Image
 import io
+from http_session import get_session, request_timeout
+from image_prep import encode_image
+from token_cache import TokenCache
+
+# access token 无效 / 过期的错误码，遇到时重新获取 token 后重试一次
+TOKEN_ERROR_CODES = (110, 111)
 
 
 class BaiduOcrExtractor:
@@ -26,14 +31,22 @@ class BaiduOcrExtractor:
         """
         self.api_key = api_key
         self.secret_key = secret_key
-        self.access_token = None
-
-        # 获取access_token
-        self._get_access_token()
+        # 复用 keep-alive 连接，超时和重试见 http_session
+        self.session = get_session("baidu")
+        self.timeout = request_timeout()
+        # access token 缓存在磁盘上，多个进程共享，按 expires_in 提前刷新
+        self.token_cache = TokenCache("baidu", api_key, self._get_access_token)
+
+        # 获取access_token（已缓存时不发请求）
+        self.token_cache.get()
         print(f"   ✅ 百度OCR初始化成功\n")
 
+    @property
+    def access_token(self):
+        return self.token_cache.get()
+
     def _get_access_token(self):
-        """获取百度API Access Token"""
+        """获取百度API Access Token，返回 (token, expires_in)"""
         url = "https://aip.baidubce.com/oauth/2.0/token"
         params = {
             "grant_type": "client_credentials",
@@ -41,18 +54,34 @@ class BaiduOcrExtractor:
             "client_secret": self.secret_key
         }
 
-        response = requests.post(url, params=params)
+        response = self.session.post(url, params=params, timeout=self.timeout)
         result = response.json()
 
         if "access_token" in result:
-            self.access_token = result["access_token"]
+            # 百度的 token 有效期为 30 天，缺少 expires_in 时按此计算
+            return result["access_token"], result.get("expires_in", 30 * 24 * 3600)
         else:
             raise Exception(f"获取Access Token失败: {result}")
 
-    def _image_to_base64(self, image_path: str) -> str:
-        """将图片转换为base64编码"""
-        with open(image_path, 'rb') as f:
-            image_data = f.read()
+    def _post(self, url: str, params: Dict) -> Dict:
+        """
+        带 access token 调用识别接口。
+        token 无效 / 过期（错误码 110 / 111）时标记失效、重新获取后重试一次。
+        """
+        headers = {"Content-Type": "application/x-www-form-urlencoded"}
+        for attempt in range(2):
+            token = self.token_cache.get()
+            response = self.session.post(url, headers=headers, data={**params, "access_token": token},
+                                         timeout=self.timeout)
+            result = response.json()
+            if result.get("error_code") in TOKEN_ERROR_CODES and attempt == 0:
+                self.token_cache.invalidate(token)
+                continue
+            return result
+
+    def _image_to_base64(self, image) -> str:
+        """将图片（路径、已编码的字节或 PIL 图像）转换为base64编码"""
+        image_data, _ = encode_image(image)
         return base64.b64encode(image_data).decode('utf-8')
 
     def extract_vat_invoice(self, image_path: str) -> Dict:
@@ -62,23 +91,17 @@ class BaiduOcrExtractor:
         :param image_path: 图片路径（支持JPG/PNG/PDF）
         :return: 发票信息字典
         """
-        if not self.access_token:
-            raise Exception("Access Token未初始化")
-
         url = f"https://aip.baidubce.com/rest/2.0/ocr/v1/vat_invoice"
-        headers = {"Content-Type": "application/x-www-form-urlencoded"}
 
         # 转换图片
         img_base64 = self._image_to_base64(image_path)
 
         # 调用API
         params = {
-            "access_token": self.access_token,
             "image": img_base64
         }
 
-        response = requests.post(url, headers=headers, data=params)
-        result = response.json()
+        result = self._post(url, params)
 
         if "error_code" in result:
             raise Exception(f"百度OCR错误: {result.get('error_msg')}")
@@ -109,24 +132,18 @@ class BaiduOcrExtractor:
         :param image_path: 图片路径
         :return: 识别的完整文本
         """
-        if not self.access_token:
-            raise Exception("Access Token未初始化")
-
         url = "https://aip.baidubce.com/rest/2.0/ocr/v1/receipt"
-        headers = {"Content-Type": "application/x-www-form-urlencoded"}
 
         # 转换图片
         img_base64 = self._image_to_base64(image_path)
 
         # 调用API
         params = {
-            "access_token": self.access_token,
             "image": img_base64,
             "return_seal_image": "false"  # 不返回印章图片
         }
 
-        response = requests.post(url, headers=headers, data=params)
-        result = response.json()
+        result = self._post(url, params)
 
         if "error_code" in result:
             raise Exception(f"百度OCR错误: {result.get('error_msg')}")
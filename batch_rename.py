@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+无界面批量重命名 - 适合在服务器上定时运行
+与图形界面使用同一套提取流程，并输出包含单文件耗时和吞吐量的运行报告
+
+使用方法:
+    python3 batch_rename.py <目录> --fields 销方名称,开票日期,合计 --report run.json
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+
+from backup import BACKUP_MODES
+from rename_pipeline import END, backup_folder, run_rename_job
+
+DEFAULT_FIELDS = "销方名称,开票日期,合计"
+
+
+class ConsoleTextArea:
+    """把 text_area 的输出打印到终端"""
+
+    def insert(self, index, text):
+        sys.stdout.write(text)
+
+    def see(self, index):
+        sys.stdout.flush()
+
+
+def write_report(report_path, summary, tasks):
+    """
+    写运行报告，根据后缀选择格式。
+    .json：包含汇总和逐文件记录；.csv：每个文件一行，汇总另存为同名的 .summary.json。
+
+    :param report_path: 报告路径（.json 或 .csv）。
+    :param summary: run_rename_job 返回的汇总字典。
+    :param tasks: run_rename_job 返回的 FileTask 列表。
+    """
+    records = [task.to_record() for task in tasks]
+    if report_path.lower().endswith('.csv'):
+        with open(report_path, 'w', newline='', encoding='utf-8-sig') as f:
+            writer = csv.DictWriter(f, fieldnames=list(records[0].keys()) if records else ["filename"])
+            writer.writeheader()
+            writer.writerows(records)
+        with open(os.path.splitext(report_path)[0] + '.summary.json', 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+    else:
+        with open(report_path, 'w', encoding='utf-8') as f:
+            json.dump({"summary": summary, "files": records}, f, ensure_ascii=False, indent=2)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="批量发票重命名（无界面）")
+    parser.add_argument("folder", help="待处理的发票目录")
+    parser.add_argument("--fields", default=DEFAULT_FIELDS, help=f"重命名字段，逗号分隔（默认：{DEFAULT_FIELDS}）")
+    parser.add_argument("--split", default="_", help="文件名分隔符（默认：_）")
+    parser.add_argument("--text-workers", type=int, help="文本提取并发数")
+    parser.add_argument("--ocr-workers", type=int, help="OCR 并发数")
+    parser.add_argument("--ai-workers", type=int, help="AI 提取并发数")
+    parser.add_argument("--ai-batch", type=int, help="批量 AI 模式每批的发票数（默认 1，逐张调用）")
+    parser.add_argument("--max-pages", type=int, help="每个 PDF 最多读取的页数（默认不限制，字段齐全后会提前停止）")
+    parser.add_argument("--model", default=os.environ.get("MODEL_NAME", 'moonshot-v1-8k'), help="AI 模型名称")
+    parser.add_argument("--backup-mode", choices=BACKUP_MODES,
+                        help="备份方式（默认 auto：reflink → 硬链接 → 复制，也可用环境变量 BACKUP_MODE）")
+    parser.add_argument("--no-cache", action="store_true", help="不使用提取结果缓存，全部重新提取")
+    parser.add_argument("--report", help="运行报告路径（.json 或 .csv）")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    from invoice_rename_config import fields as field_options
+
+    fields = [f.strip() for f in args.fields.split(",") if f.strip()]
+    known = {f["key"] for f in field_options}
+    unknown = [f for f in fields if f not in known]
+    if unknown:
+        print(f"❌ 未知字段: {', '.join(unknown)}（可选：{', '.join(sorted(known))}）")
+        return 2
+    if not os.path.isdir(args.folder):
+        print(f"❌ 目录不存在: {args.folder}")
+        return 2
+
+    from warmup import Warmup
+
+    concurrency = {"text": args.text_workers, "ocr": args.ocr_workers, "ai": args.ai_workers}
+    text_area = ConsoleTextArea()
+    text_area.insert(END, f"开始处理目录：{args.folder}\n")
+
+    started_at = time.strftime("%Y-%m-%d %H:%M:%S")
+    # 备份期间在后台加载 AI 客户端和 OCR 模型
+    warmup = Warmup(args.model).start()
+    bak_dir, backup_stats = backup_folder(text_area, args.folder, args.backup_mode)
+    ai_extractor = warmup.ai_extractor(args.model)
+    summary, tasks = run_rename_job(text_area, bak_dir, fields, args.split, ai_extractor, warmup.ocr_factory(),
+                                    concurrency, use_cache=not args.no_cache, ai_batch_size=args.ai_batch,
+                                    max_pages=args.max_pages)
+    summary = {"folder": os.path.abspath(args.folder), "started_at": started_at, "model": args.model,
+               "backup": backup_stats, **summary}
+
+    print(f"\n\n全部处理完成。共处理{summary['total']}个文件，成功重命名{summary['success']}个，"
+          f"其中文件名冲突{summary['conflicts']}个。")
+    print(f"耗时 {summary['elapsed_sec']} 秒，吞吐量 {summary['files_per_sec']} 个/秒，"
+          f"各阶段结果：{summary['tiers']}，文本层探测：{summary['routes']}")
+    escalation = summary["ocr_escalation"]
+    if escalation["files"]:
+        print(f"OCR {escalation['files']} 个文件 / {escalation['pages']} 页，"
+              f"其中 {escalation['escalated_files']} 个文件（{escalation['escalated_pages']} 页）升级到高分辨率重新识别")
+    for name, breaker in summary["circuit_breakers"].items():
+        if breaker["opens"] or breaker["state"] != "closed":
+            print(f"熔断器 {name}：当前{breaker['state']}，熔断 {breaker['opens']} 次，"
+                  f"快速失败 {breaker['rejected']} 次")
+
+    if args.report:
+        write_report(args.report, summary, tasks)
+        print(f"📄 运行报告已保存: {args.report}")
+
+    return 0 if summary["failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
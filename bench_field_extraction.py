@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+字段提取微基准 - 对比改造前后 extract_fields_from_text 的单张发票耗时
+语料：consolidated_receipts 目录下所有 PDF 的文本 + 一张标准增值税电子发票样例文本
+
+使用方法:
+    python3 bench_field_extraction.py [语料目录] > bench_output.txt
+"""
+import os
+import re
+import sys
+import time
+
+import pdfplumber
+
+from rename_function import extract_fields_from_text
+
+ALL_FIELDS = ["发票号码", "开票日期", "购方名称", "购方税号", "销方名称", "销方税号",
+              "合计", "总税额", "价税合计", "价税合计大写", "开票人"]
+DEFAULT_FIELDS = ["销方名称", "开票日期", "合计"]
+
+SAMPLE_FAPIAO = """电子发票（普通发票） 发票号码：25117000000321326035
+开票日期：2025年02月27日
+购 名称：武汉东湖学院 销 名称：中国移动通信集团湖北有限公司武汉分公司
+买 售
+方 统一社会信用代码/纳税人识别号：52420000123406283N 方 统一社会信用代码/纳税人识别号：91420100717918134N
+项目名称 规格型号 单 位 数 量 单 价 金 额 税率/征收率 税 额
+*信息技术服务*云服务费 套 1 94.34 94.34 6% 5.66
+合 计 ¥94.34 ¥5.66
+价税合计（大写） 壹佰元整 （小写）¥100.00
+开票人：王丽丽
+"""
+
+
+def legacy_extract_fields_from_text(text, fields):
+    """改造前的实现：每个字段各自 re.search / re.findall 一遍全文，仅用于对比"""
+    results = {}
+
+    # 这里text已经是合并空白后的完整字符串
+    # 先合并多余空白
+    text = re.sub(r'\s+', ' ', text)
+
+    # 1. 统一提取所有“统一社会信用代码/纳税人识别号”后的号码（按顺序）
+    tax_numbers = re.findall(r"统一社会信用代码/纳税人识别号[：:]\s*([\w\d]+)", text)
+    buy_tax_number = tax_numbers[0] if len(tax_numbers) > 0 else ""
+    sell_tax_number = tax_numbers[1] if len(tax_numbers) > 1 else ""
+    if "购方税号" in fields:
+        results["购方税号"] = buy_tax_number
+    if "销方税号" in fields:
+        results["销方税号"] = sell_tax_number
+
+    # 2. 购方名称 + 销方名称 （一行内）
+    m = re.search(r"购\s*名称[：:]\s*(.*?)\s+销\s*名称[：:]\s*(.*?)\s", text)
+    if m:
+        if "购方名称" in fields:
+            results["购方名称"] = m.group(1).strip()
+        if "销方名称" in fields:
+            results["销方名称"] = m.group(2).strip()
+
+    # 3. 发票号码
+    m = re.search(r"发票号码[：:]\s*([\d\w]+)", text)
+    if "发票号码" in fields:
+        results["发票号码"] = m.group(1).strip() if m else ""
+
+    # 4. 开票日期
+    m = re.search(r"开票日期[：:]\s*([\d年月日\-]+)", text)
+    if "开票日期" in fields:
+        results["开票日期"] = m.group(1).strip() if m else ""
+
+    # 5. 合计金额
+    m = re.search(r"合\s*计\s*¥?([\d\.]+)", text)
+    if "合计" in fields:
+        results["合计"] = m.group(1).strip() if m else ""
+
+    # 如果没有明确字段“总税额”，你可以尝试匹配合计行后紧跟的数字，或者暂时置空
+    m = re.search(r"合\s*计.*?¥?([\d\.]+)\s*\*?\s*¥?([\d\.]+)", text)
+    if m and "总税额" in fields:
+        # 如果匹配到两组金额，则第二组是总税额
+        results["总税额"] = m.group(2).strip()
+
+    # 6. 价税合计（数字，小写）
+    m = re.search(r"价税合计.*（小写）¥([\d\.]+)", text, re.DOTALL)
+    if "价税合计" in fields:
+        results["价税合计"] = m.group(1).strip() if m else ""
+
+    # 7. 价税合计（大写）
+    m = re.search(r"价税合计（大写）\s*([\S]+)", text)
+    if "价税合计大写" in fields:
+        results["价税合计大写"] = m.group(1).strip() if m else ""
+
+    # 8. 开票人
+    m = re.search(r"开票人[:：]\s*([\S]+)", text)
+    if "开票人" in fields:
+        results["开票人"] = m.group(1).strip() if m else ""
+
+    return results
+
+
+def load_corpus(folder):
+    """读取语料目录下全部 PDF 的文本（只读一次，不计入基准耗时）"""
+    texts = [("sample_fapiao", SAMPLE_FAPIAO)]
+    for name in sorted(os.listdir(folder)):
+        if not name.lower().endswith('.pdf'):
+            continue
+        try:
+            with pdfplumber.open(os.path.join(folder, name)) as pdf:
+                text = "\n".join(page.extract_text() or "" for page in pdf.pages)
+        except Exception as e:
+            print(f"  ⚠️ 跳过 {name}: {e}")
+            continue
+        if text.strip():
+            texts.append((name, text))
+    return texts
+
+
+def bench(func, texts, fields, repeat):
+    """返回单张发票的平均耗时（微秒），取 repeat 轮中最快的一轮"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _, text in texts:
+            func(text, fields)
+        best = min(best, time.perf_counter() - start)
+    return best / len(texts) * 1e6
+
+
+def main():
+    folder = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                "consolidated_receipts")
+    print(f"📂 语料目录: {folder}")
+    texts = load_corpus(folder)
+    total_chars = sum(len(text) for _, text in texts)
+    print(f"📄 共 {len(texts)} 份文本，平均 {total_chars // len(texts)} 字符\n")
+
+    # 先确认两种实现的结果完全一致
+    for name, text in texts:
+        for fields in (ALL_FIELDS, DEFAULT_FIELDS):
+            if legacy_extract_fields_from_text(text, fields) != extract_fields_from_text(text, fields):
+                print(f"❌ 结果不一致: {name} {fields}")
+                return 1
+
+    print(f"{'字段':<12}{'改造前(μs/张)':>16}{'改造后(μs/张)':>16}{'加速比':>10}")
+    print("=" * 54)
+    for label, fields in (("全部字段", ALL_FIELDS), ("默认3个字段", DEFAULT_FIELDS)):
+        re.purge()  # 清掉 re 模块的内部缓存，让改造前的实现按真实情况付出查缓存/编译的开销
+        before = bench(legacy_extract_fields_from_text, texts, fields, repeat=20)
+        after = bench(extract_fields_from_text, texts, fields, repeat=20)
+        print(f"{label:<12}{before:>16.1f}{after:>16.1f}{before / after:>9.2f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
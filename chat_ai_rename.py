@@ -1,13 +1,18 @@
+import asyncio
+import hashlib
+import json
 import os
-import random
 import time
-from typing import Optional, Dict
+from typing import Optional, Dict, List
 
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_openai import ChatOpenAI
-from openai import RateLimitError
 from pydantic import BaseModel, Field
 
+from circuit_breaker import OPEN, get_breaker, is_provider_error
+from extraction_cache import LlmResponseMemo, cache_enabled_by_env
+from ocr_result import OcrLine, OcrResult
+from parse_pool import POOL_ERRORS, ParseTimeoutError, load_parse_limits, process_rss
+from rate_limit import RateLimiter, estimate_tokens, retry_after_seconds
+
 
 # --- 1. 定义 Pydantic 输出模型 ---
 # 这个模型定义了我们希望从发票中提取的所有信息结构
@@ -26,6 +31,44 @@ class InvoiceInfo(BaseModel):
     preparer: Optional[str] = Field(default=None, description="开票人姓名（如：王丽丽）")
 
 
+SYSTEM_PROMPT = (
+    "你是一个专业的发票信息提取算法。请仅从用户提供的发票文本中提取相关信息，"
+    "并填充到预定义的JSON结构中。如果某个字段的值在文本中找不到，请不要编造，"
+    "让该字段的值为null。"
+    "如果遇到 下面这样的"
+    "'名称：武汉东湖学院"
+    " 名称：中国移动通信集团湖北有限公司武汉分公司"
+    " 一社会信用代码/纳税人识别号：52420000123406283N"
+    " 一社会信用代码/纳税人识别号：91420100717918134N'"
+    "切记 购方税号 和 销方税号是按照 单位名称顺序对应"
+    "即：武汉东湖学院-52420000123406283N"
+)
+
+
+class BatchInvoiceInfo(InvoiceInfo):
+    """批量模式下的一项，带上对应发票的 index"""
+    index: int = Field(description="这一项对应的输入发票的 index（<invoice index=N> 中的 N）")
+
+
+class InvoiceBatch(BaseModel):
+    """批量模式下多张发票的提取结果"""
+    invoices: List[BatchInvoiceInfo] = Field(default_factory=list, description="按输入 index 顺序排列的发票信息，每张发票对应一项，数量与输入相同")
+
+
+BATCH_SYSTEM_PROMPT = (
+    SYSTEM_PROMPT
+    + "本次用户会一次提供多张发票，每张发票用 <invoice index=N> 和 </invoice> 包裹。"
+    "请按 index 从小到大的顺序，为每张发票各返回一项，每一项的 index 填对应发票的 N，"
+    "返回的项数必须与发票张数完全相同，不同发票之间的信息不要混用。"
+)
+
+
+def _schema_version(*parts) -> str:
+    """根据输出结构和提示词生成版本号，任何一项改动都会让旧的记忆化结果失效"""
+    raw = json.dumps(InvoiceInfo.model_json_schema(), sort_keys=True, ensure_ascii=False) + "".join(parts)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()[:12]
+
+
 # --- 2. 创建封装类 ---
 class InvoiceExtractor:
     """
@@ -50,7 +93,11 @@ class InvoiceExtractor:
             self,
             model_name: str = 'moonshot-v1-8k',
             api_key: str = None,
-            temperature: float = 0.0
+            temperature: float = 0.0,
+            use_memo: bool = True,
+            rate_limiter: Optional[RateLimiter] = None,
+            output_token_budget: int = 300,
+            breaker=None
         ):
         """
         初始化提取器。
@@ -58,27 +105,29 @@ class InvoiceExtractor:
         :param model_name: 要使用的模型名称，例如 'moonshot-v1-8k' 或 'deepseek-chat'。
         :param api_key: OpenAI API Key。如果为 None，将从环境变量 OPENAI_API_KEY 读取。
         :param temperature: 模型的温度参数。
+        :param use_memo: 是否记忆化 AI 响应（相同文本不重复请求）；环境变量 EXTRACTION_CACHE=0 时也会关闭。
+        :param rate_limiter: 限流器，默认按环境变量 LLM_RPM / LLM_TPM 创建；多个提取器可共用一个。
+        :param output_token_budget: 每次调用预计的输出 token 数，用于 TPM 预算。
+        :param breaker: 熔断器，默认按模型名共享（见 circuit_breaker.get_breaker）。
         """
         # 设置 API Key（如果提供了的话）
         if api_key:
             os.environ["OPENAI_API_KEY"] = api_key
 
+        # langchain / openai 导入较慢，放到第一次创建提取器时再导入
+        from langchain_core.prompts import ChatPromptTemplate
+        from langchain_openai import ChatOpenAI
+
         # 初始化模型和提示
+        self.model_name = model_name
+        self.rate_limiter = rate_limiter or RateLimiter.from_env()
+        self.output_token_budget = output_token_budget
+        # 服务商连续失败时熔断：直接返回空结果，不再逐个文件重试、等待
+        self.breaker = breaker or get_breaker(model_name)
         self.model = ChatOpenAI(model_name=model_name, temperature=temperature)
 
         self.prompt = ChatPromptTemplate.from_messages([
-            ("system",
-             "你是一个专业的发票信息提取算法。请仅从用户提供的发票文本中提取相关信息，"
-             "并填充到预定义的JSON结构中。如果某个字段的值在文本中找不到，请不要编造，"
-             "让该字段的值为null。"
-             "如果遇到 下面这样的"
-             "'名称：武汉东湖学院"
-             " 名称：中国移动通信集团湖北有限公司武汉分公司"
-             " 一社会信用代码/纳税人识别号：52420000123406283N"
-             " 一社会信用代码/纳税人识别号：91420100717918134N'"
-             "切记 购方税号 和 销方税号是按照 单位名称顺序对应"
-             "即：武汉东湖学院-52420000123406283N"
-             ),
+            ("system", SYSTEM_PROMPT),
             ("human", "{invoice_text}")
         ])
 
@@ -87,6 +136,22 @@ class InvoiceExtractor:
         # 对于 moonshot 和 deepseek，通常需要这样做。
         self.extraction_chain = self.prompt | self.model.with_structured_output(InvoiceInfo, method="function_calling")
 
+        # 批量模式：一次调用提取多张发票
+        self.batch_prompt = ChatPromptTemplate.from_messages([
+            ("system", BATCH_SYSTEM_PROMPT),
+            ("human", "共 {count} 张发票：\n\n{invoice_texts}")
+        ])
+        self.batch_chain = self.batch_prompt | self.model.with_structured_output(InvoiceBatch, method="function_calling")
+
+        # 记忆化：进程内 LRU + SQLite 持久化，键包含模型名和输出结构版本
+        self.memo = None
+        if use_memo and cache_enabled_by_env():
+            self.memo = LlmResponseMemo(model_name, _schema_version(SYSTEM_PROMPT, str(temperature)))
+
+    # 429 重试参数：优先使用响应头里的 Retry-After，没有时才按指数退避等待
+    max_retries = 3
+    initial_wait = 60
+
     def extract(self, invoice_text: str) -> Dict[str, Optional[str]]:
         """
         从给定的发票文本中提取信息，包含自动重试逻辑。
@@ -94,36 +159,222 @@ class InvoiceExtractor:
         :param invoice_text: 发票的完整原始文本。
         :return: 一个字典，包含提取的字段和值。如果字段未找到，值为 None。
         """
-        max_retries = 3
-        initial_wait = 60  # 首次重试等待2秒
-        retries = 0
-        wait_time = initial_wait
+        if self.memo is not None:
+            cached = self.memo.get(invoice_text)
+            if cached is not None:
+                return cached
+
+        extracted_info = self._invoke_with_retry(
+            self.extraction_chain, {"invoice_text": invoice_text}, self._estimate_tokens(invoice_text))
+        if extracted_info is None:
+            return self._empty_result()
+        return self._remember(invoice_text, extracted_info)
+
+    async def aextract(self, invoice_text: str) -> Dict[str, Optional[str]]:
+        """
+        extract 的异步版本：限流等待和 429 重试都不阻塞事件循环。
 
-        while retries <= max_retries:
-            try:
-                # 尝试调用API
-                extracted_info: InvoiceInfo = self.extraction_chain.invoke({"invoice_text": invoice_text})
-                return extracted_info.model_dump()
+        :param invoice_text: 发票的完整原始文本。
+        :return: 与 extract 相同的字典。
+        """
+        if self.memo is not None:
+            cached = self.memo.get(invoice_text)
+            if cached is not None:
+                return cached
+
+        extracted_info = await self._ainvoke_with_retry(
+            self.extraction_chain, {"invoice_text": invoice_text}, self._estimate_tokens(invoice_text))
+        if extracted_info is None:
+            return self._empty_result()
+        return self._remember(invoice_text, extracted_info)
+
+    async def aextract_many(self, invoice_texts: List[str], concurrency: int = 8) -> List[Dict[str, Optional[str]]]:
+        """
+        并发提取多张发票，实际速率由限流器控制，结果顺序与输入一致。
 
-            except RateLimitError as e:
-                # 专门捕获速率限制错误
-                retries += 1
-                if retries > max_retries:
-                    print(f"❌ 达到最大重试次数 {max_retries}，放弃重试。最终错误：{e}")
-                    # --- 修复点：使用 .keys() 获取字段名 ---
-                    return {key: None for key in InvoiceInfo.model_fields.keys()}
+        :param invoice_texts: 发票文本列表。
+        :param concurrency: 同时进行中的请求数上限。
+        :return: 与输入一一对应的结果字典列表。
+        """
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+
+        async def run(text):
+            async with semaphore:
+                return await self.aextract(text)
 
-                print(f"⚠️ API 速率限制 (429)，将在 {wait_time} 秒后进行第 {retries} 次重试...")
-                time.sleep(wait_time)
-                wait_time *= 1.5  # 指数退避：下次等待时间翻倍 (2s, 4s, 8s...)
+        return await asyncio.gather(*(run(text) for text in invoice_texts))
 
+    def extract_batch(
+            self,
+            invoice_texts: List[str],
+            max_batch_tokens: int = 6000,
+            max_batch_size: int = 10
+        ) -> List[Dict[str, Optional[str]]]:
+        """
+        批量模式：把多张发票打包进一次结构化输出调用，省去重复的系统提示和往返。
+        按估算的 token 数自适应分批；每一项按回显的 index 对应到输入，某一批解析失败
+        （数量不符、index 对不上或某一项不合法）时对半拆分重试，
+        拆到只剩一张时退回单张提取。
+
+        :param invoice_texts: 发票文本列表。
+        :param max_batch_tokens: 每批输入 + 预计输出的 token 上限，应小于模型上下文长度。
+        :param max_batch_size: 每批最多包含的发票数。
+        :return: 与输入一一对应的结果字典列表。
+        """
+        results: List[Optional[Dict[str, Optional[str]]]] = [None] * len(invoice_texts)
+        pending = []
+        for i, text in enumerate(invoice_texts):
+            cached = self.memo.get(text) if self.memo is not None else None
+            if cached is not None:
+                results[i] = cached
+            else:
+                pending.append(i)
+
+        # 按顺序贪心装箱：加入下一张会超出 token 或数量上限时另起一批
+        budget = max_batch_tokens - estimate_tokens(BATCH_SYSTEM_PROMPT)
+        batch, batch_tokens = [], 0
+        for i in pending:
+            cost = estimate_tokens(invoice_texts[i]) + self.output_token_budget
+            if batch and (batch_tokens + cost > budget or len(batch) >= max_batch_size):
+                self._extract_packed(batch, invoice_texts, results)
+                batch, batch_tokens = [], 0
+            batch.append(i)
+            batch_tokens += cost
+        if batch:
+            self._extract_packed(batch, invoice_texts, results)
+        return results
+
+    def _extract_packed(self, indices: List[int], invoice_texts: List[str], results: list):
+        if len(indices) == 1:
+            results[indices[0]] = self.extract(invoice_texts[indices[0]])
+            return
+
+        packed = "\n\n".join(
+            f"<invoice index={n}>\n{invoice_texts[i]}\n</invoice>" for n, i in enumerate(indices, 1))
+        tokens = estimate_tokens(BATCH_SYSTEM_PROMPT) + estimate_tokens(packed) + self.output_token_budget * len(indices)
+        extracted = self._invoke_with_retry(self.batch_chain, {"invoice_texts": packed, "count": len(indices)}, tokens)
+
+        if extracted is None and self.breaker.state == OPEN:
+            # 已熔断：拆分重试也只会被拒绝，整批直接返回空结果
+            for i in indices:
+                results[i] = self._empty_result()
+            return
+
+        # 按每一项回显的 index 对应到输入，index 缺失、重复或越界时不能确定对应关系，整批都不采用也不记忆化
+        by_index = {} if extracted is None else {info.index: info for info in extracted.invoices}
+        if (extracted is None or len(extracted.invoices) != len(indices)
+                or set(by_index) != set(range(1, len(indices) + 1))):
+            got = "失败" if extracted is None else f"返回{len(extracted.invoices)}项，index 为{sorted(by_index)}"
+            print(f"⚠️ 批量提取{len(indices)}张发票{got}，拆分后重试...")
+            middle = len(indices) // 2
+            self._extract_packed(indices[:middle], invoice_texts, results)
+            self._extract_packed(indices[middle:], invoice_texts, results)
+            return
+
+        for n, i in enumerate(indices, 1):
+            results[i] = self._remember(invoice_texts[i], by_index[n])
+
+    def _invoke_with_retry(self, chain, payload: dict, tokens: int):
+        """
+        调用链并处理 429 重试，重试策略见 _retry_wait。
+
+        :return: 结构化输出对象；熔断、重试耗尽或发生其他错误时返回 None。
+        """
+        retries = 0
+        wait_time = self.initial_wait
+        while self._allow():
+            # 按 RPM / TPM 配额放行，429 之后所有线程一起暂停到 Retry-After
+            self.rate_limiter.acquire(tokens)
+            try:
+                result = chain.invoke(payload)
             except Exception as e:
-                # 对于其他类型的错误（如网络问题、API密钥错误），直接返回失败
-                print(f"❌ 处理过程中发生非速率限制错误：{e}")
-                # --- 修复点：使用 .keys() 获取字段名 ---
-                return {key: None for key in InvoiceInfo.model_fields.keys()}
+                retries += 1
+                wait_time = self._retry_wait(e, retries, wait_time)
+                if wait_time is None:
+                    return None
+                continue
+            self.breaker.record_success()
+            return result
+        return None
+
+    async def _ainvoke_with_retry(self, chain, payload: dict, tokens: int):
+        """_invoke_with_retry 的异步版本：限流等待不阻塞事件循环，重试策略相同"""
+        retries = 0
+        wait_time = self.initial_wait
+        while self._allow():
+            await self.rate_limiter.aacquire(tokens)
+            try:
+                result = await chain.ainvoke(payload)
+            except Exception as e:
+                retries += 1
+                wait_time = self._retry_wait(e, retries, wait_time)
+                if wait_time is None:
+                    return None
+                continue
+            self.breaker.record_success()
+            return result
+        return None
+
+    def _retry_wait(self, error, retries: int, wait_time: float) -> Optional[float]:
+        """
+        同步、异步调用共用的重试策略：记录失败，决定是否重试。
+        只有 429 在未熔断、未超过 max_retries 时重试（暂停限流器到 Retry-After）；
+        其他错误（网络问题、API 密钥错误、输出结构不合法等）直接放弃。
 
-        # 理论上不会执行到这里，但为了代码完整性
+        :param retries: 包括这一次在内已经失败的次数。
+        :return: 下一次没有 Retry-After 时使用的退避时间；放弃时返回 None。
+        """
+        from openai import RateLimitError
+
+        circuit_open = self._record_failure(error)
+        if not isinstance(error, RateLimitError):
+            print(f"❌ 处理过程中发生非速率限制错误：{error}")
+            return None
+        if circuit_open or retries > self.max_retries:
+            print(f"❌ 达到最大重试次数 {self.max_retries} 或已熔断，放弃重试。最终错误：{error}")
+            return None
+        return self._pause_for_rate_limit(error, retries, wait_time)
+
+    def _allow(self) -> bool:
+        """熔断器是否放行；打开时提示并返回 False"""
+        if self.breaker.allow():
+            return True
+        print(f"⚠️ {self.model_name} 熔断中，约 {self.breaker.retry_in():.0f} 秒后试探恢复，跳过 AI 调用")
+        return False
+
+    def _record_failure(self, error) -> bool:
+        """
+        记录一次调用失败：服务商故障计入熔断器，模型输出不合法等说明服务是通的。
+        :return: 熔断器是否已打开
+        """
+        if is_provider_error(error):
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return self.breaker.state == OPEN
+
+    def _estimate_tokens(self, invoice_text: str) -> int:
+        # 输入（系统提示 + 发票文本）加上结构化输出的大致长度
+        return estimate_tokens(SYSTEM_PROMPT) + estimate_tokens(invoice_text) + self.output_token_budget
+
+    def _pause_for_rate_limit(self, error, retries: int, wait_time: float) -> float:
+        """收到 429 后暂停限流器，返回下一次没有 Retry-After 时使用的退避时间"""
+        retry_after = retry_after_seconds(error)
+        wait = retry_after if retry_after is not None else wait_time
+        print(f"⚠️ API 速率限制 (429)，将在 {wait:.1f} 秒后进行第 {retries} 次重试...")
+        self.rate_limiter.pause(wait)
+        return wait_time * 1.5  # 指数退避
+
+    def _remember(self, invoice_text: str, extracted_info: InvoiceInfo) -> Dict[str, Optional[str]]:
+        # 批量模式的项多一个 index，只保存 InvoiceInfo 的字段
+        result = extracted_info.model_dump(include=set(InvoiceInfo.model_fields))
+        if self.memo is not None:
+            self.memo.put(invoice_text, result)
+        return result
+
+    @staticmethod
+    def _empty_result() -> Dict[str, Optional[str]]:
+        # --- 修复点：使用 .keys() 获取字段名 ---
         return {key: None for key in InvoiceInfo.model_fields.keys()}
 
     # --- 新增函数 ---
@@ -151,48 +402,118 @@ class InvoiceExtractor:
 
         return formatted_result
 
-    # 调用ai方法 文本专用
-    def get_rename_by_chat_ai(self, invoice_text, fields, split):
+    # 调用ai方法 文本专用，返回 {中文字段名: 值}
+    def get_fields_by_chat_ai(self, invoice_text, fields):
         # 1. 先提取所有信息
         full_data_dict = self.extract(invoice_text)
 
         # 2. 调用新函数，按需格式化
-        formatted_data = self.format_by_fields(full_data_dict, fields)
-        time.sleep(random.randint(1, 3))
-        # 3. 改成文件命名
-        return split.join(formatted_data.values())
+        return self.format_by_fields(full_data_dict, fields)
+
+    # 批量调用ai方法 文本专用，返回与 invoice_texts 一一对应的 {中文字段名: 值} 列表
+    def get_fields_batch_by_chat_ai(self, invoice_texts, fields, **batch_options):
+        return [self.format_by_fields(data, fields) for data in self.extract_batch(invoice_texts, **batch_options)]
+
+    # 调用ai方法 文本专用
+    def get_rename_by_chat_ai(self, invoice_text, fields, split):
+        formatted_data = self.get_fields_by_chat_ai(invoice_text, fields)
+        # 3. 改成文件命名（未识别的字段留空）
+        return split.join(value or "" for value in formatted_data.values())
 
 ######################### 下面是用ocr识别图片，不太准 #########################
-from typing import Union, List
-import numpy as np
-from PIL import Image
-from paddleocr import PaddleOCR
-from pdf2image import convert_from_path
+# paddleocr / pdf2image / numpy 导入很慢（几秒），只在真正创建 OCR 提取器时才导入
+from typing import TYPE_CHECKING, Union, List
 import logging
 logging.getLogger('ppocr').setLevel(logging.ERROR)   # 只显示错误
 
+if TYPE_CHECKING:
+    import numpy as np
+    from PIL import Image
+
+
+def pdf_page_count(file_path: str) -> int:
+    """读取 PDF 页数（pdfinfo）。模块级函数，可以提交到 parse_pool 的工作进程里运行"""
+    from pdf2image import pdfinfo_from_path
+    return int(pdfinfo_from_path(file_path)["Pages"])
+
+
+def render_pdf_pages(file_path: str, dpi: int = 300, first_page: Optional[int] = None,
+                     last_page: Optional[int] = None, grayscale: bool = False,
+                     thread_count: int = 1) -> "List[Image.Image]":
+    """把 PDF 的指定页渲染为 PIL 图像。模块级函数，可以提交到 parse_pool 的工作进程里运行"""
+    from pdf2image import convert_from_path
+    return convert_from_path(file_path, dpi=dpi, first_page=first_page, last_page=last_page,
+                             grayscale=grayscale, thread_count=thread_count)
+
+
+def render_pdf_pages_with_rss(file_path: str, dpi: int, first_page: int, last_page: int, grayscale: bool,
+                              thread_count: int):
+    """
+    同 render_pdf_pages，同时返回渲染完成时渲染进程的常驻内存（字节）。
+    提交到 parse_pool 时测的是工作进程自己的内存，不包括主进程。
+    :return: (images, rss)
+    """
+    images = render_pdf_pages(file_path, dpi, first_page, last_page, grayscale, thread_count)
+    return images, process_rss(os.getpid())
+
+
+def _peak_mb(previous: Optional[float], rss: Optional[int]) -> Optional[float]:
+    """更新内存峰值（MB）；读不到内存（process_rss 返回 None）时保持原值，从未读到过则为 None"""
+    if rss is None:
+        return previous
+    return max(previous or 0.0, rss / 1024 / 1024)
+
+
+def _image_bytes(image) -> int:
+    """PIL 图像解码后占用的内存（字节）"""
+    return image.width * image.height * len(image.getbands())
+
+
 # --- 1. 创建封装类 ---
 class ImageOcrExtractor:
     """
     一个用于从图片或PDF文件中提取文本的封装类。
     """
 
-    def __init__(self, lang: str = 'ch'):
+    def __init__(self, lang: str = 'ch', raster_pool=None, dpi: Optional[int] = None, grayscale: bool = True,
+                 thread_count: int = 1, dpi_policy: Optional[Dict] = None, file_timeout: Optional[float] = None):
         """
         初始化OCR提取器，并加载PaddleOCR模型。
 
         :param lang: 指定OCR的语言，'ch'代表中文。
+        :param raster_pool: 可选的 parse_pool.ParsePool，PDF 渲染在隔离进程里进行，超时或内存超限时抛出异常。
+        :param dpi: 固定的 PDF 渲染分辨率；不指定时按 dpi_policy 先低后高，见 ocr_dpi.load_ocr_dpi。
+        :param grayscale: PDF 按灰度渲染，内存只有彩色的三分之一，OCR 结果基本不受影响。
+        :param thread_count: pdftoppm 渲染线程数。
+        :param dpi_policy: 分辨率策略，默认读取环境变量 OCR_DPI_MODE / OCR_LOW_DPI / OCR_HIGH_DPI 等。
+        :param file_timeout: 单个文件所有页面渲染 + 识别的总时长上限（秒），默认读取环境变量 PARSE_FILE_TIMEOUT，0 表示不限制。
         """
+        from ocr_dpi import fixed_dpi, load_ocr_dpi
+
+        self.raster_pool = raster_pool
+        self.dpi_policy = fixed_dpi(dpi) if dpi else (dpi_policy or load_ocr_dpi())
+        self.grayscale = grayscale
+        self.thread_count = thread_count
+        self.file_timeout = load_parse_limits(file_timeout=file_timeout)["file_timeout"]
+        # 最近一次 extract_from_path 的统计：页数、渲染 / 识别耗时、单页图像和渲染进程内存的峰值、分辨率升级情况；
+        # process_rss_mb 是整个主进程的内存（所有 OCR 线程共用），不是这个文件单独占用的；
+        # 读不到进程内存（非 Linux 且没有安装 psutil）时两项内存都为 None，而不是 0
+        self.last_stats = {}
+        from paddleocr import PaddleOCR
+
         # 使用新版API（不使用已废弃的use_angle_cls参数）
         self.ocr = PaddleOCR(lang=lang)
 
-    def _extract_text_from_single_image(self, image: Union[np.ndarray, Image.Image]) -> str:
+    def _recognize(self, image: "Union[np.ndarray, Image.Image]") -> "List[OcrLine]":
         """
-        从单个图像对象（PIL.Image 或 np.ndarray）中提取文本。
+        识别单个图像对象（PIL.Image 或 np.ndarray）。
 
         :param image: 图像对象。
-        :return: 提取出的合并文本字符串。
+        :return: OcrLine 列表，保留每一行的文字、位置框和置信度。
         """
+        import numpy as np
+        from PIL import Image
+
         # 如果是PIL图像，转换为numpy数组
         if isinstance(image, Image.Image):
             image = np.array(image)
@@ -202,47 +523,188 @@ class ImageOcrExtractor:
 
         # 检查结果是否为空
         if not result or not result[0]:
-            return ""
+            return []
+
+        return [OcrLine.from_paddle(line) for line in result[0]]
+
+    def _extract_text_from_single_image(self, image: "Union[np.ndarray, Image.Image]") -> str:
+        """
+        从单个图像对象（PIL.Image 或 np.ndarray）中提取文本。
 
+        :param image: 图像对象。
+        :return: 提取出的合并文本字符串。
+        """
         # 提取所有文本行并合并
-        text_lines = [line[1][0] for line in result[0]]
-        return '\n'.join(text_lines)
+        return '\n'.join(line.text for line in self._recognize(image))
+
+    def _run(self, func, *args, **kwargs):
+        """设置了 raster_pool 时在隔离进程里运行"""
+        if self.raster_pool is not None:
+            return self.raster_pool.submit(func, *args, **kwargs).result()
+        return func(*args, **kwargs)
+
+    def _render_page(self, file_path: str, page: int, dpi: int, stats: Optional[Dict] = None):
+        images, rss = self._run(render_pdf_pages_with_rss, file_path, dpi, page, page,
+                                self.grayscale, self.thread_count)
+        if stats is not None:
+            # 渲染进程（设置了 raster_pool 时是工作进程）渲染完这一页时的内存
+            stats["peak_render_rss_mb"] = _peak_mb(stats["peak_render_rss_mb"], rss)
+        return images.pop() if images else None
+
+    def iter_pdf_pages(self, file_path: str, dpi: Optional[int] = None, stats: Optional[Dict] = None):
+        """
+        逐页渲染 PDF：每次只渲染一页（first_page / last_page），调用方用完后即可释放，
+        内存占用与页数无关。
 
-    def extract_from_path(self, file_path: str) -> str:
+        :param dpi: 渲染分辨率，默认为策略的第一遍分辨率。
+        :param stats: 可选的统计字典，记录渲染进程内存的峰值（peak_render_rss_mb）。
+        :return: 依次产出 (页码, 图像) 的生成器。
         """
-        从图片文件或PDF文件的路径中提取所有文本。
+        from ocr_dpi import first_dpi
+
+        dpi = dpi or first_dpi(self.dpi_policy)
+        for page in range(1, self._run(pdf_page_count, file_path) + 1):
+            images = [self._render_page(file_path, page, dpi, stats)]
+            if images[0] is not None:
+                # pop 出来再交给调用方，生成器里不保留对这一页的引用
+                yield page, images.pop()
+
+    def _ocr_page(self, image, stats):
+        """识别一页并累计统计，返回 OcrResult（单页）"""
+        stats["peak_image_mb"] = max(stats["peak_image_mb"], _image_bytes(image) / 1024 / 1024)
+        start = time.perf_counter()
+        page = OcrResult([self._recognize(image)])
+        stats["ocr_ms"] += (time.perf_counter() - start) * 1000
+        # 主进程整体的内存，多个 OCR 线程同时运行时包含其他文件的占用
+        stats["process_rss_mb"] = _peak_mb(stats["process_rss_mb"], process_rss(os.getpid()))
+        return page
+
+    def _escalate_page(self, file_path: str, page: int, stats):
+        """按高分辨率重新渲染并识别一页，返回 OcrResult（单页）；渲染不出图像时返回 None"""
+        start = time.perf_counter()
+        try:
+            image = self._render_page(file_path, page, self.dpi_policy["high"], stats)
+        except POOL_ERRORS:
+            raise
+        except Exception as e:
+            # 高分辨率渲染失败时保留低分辨率的结果
+            print(f"⚠️ 第{page}页高分辨率渲染失败，使用低分辨率结果: {e}")
+            return None
+        stats["render_ms"] += (time.perf_counter() - start) * 1000
+        if image is None:
+            return None
+        stats["escalated_pages"] += 1
+        return self._ocr_page(image, stats)
+
+    def extract_from_path(self, file_path: str, fields: Optional[List[str]] = None) -> str:
+        """
+        从图片文件或PDF文件的路径中提取所有文本，见 extract_result。
 
         :param file_path: 文件的路径。
+        :param fields: 需要的字段列表（中文名），用于判断字段覆盖率；不传时只按置信度判断。
         :return: 提取出的完整文本字符串。
         """
+        return self.extract_result(file_path, fields).text
+
+    def extract_result(self, file_path: str, fields: Optional[List[str]] = None) -> OcrResult:
+        """
+        从图片文件或PDF文件的路径中提取结构化的识别结果（每一行的文字、位置框和置信度）。
+        PDF 逐页渲染、识别后立即释放；adaptive 模式下先按低分辨率识别，
+        平均置信度不够的页面、或识别完字段覆盖率不够时，再按高分辨率重新识别。
+        统计信息保存在 last_stats。
+
+        :param file_path: 文件的路径。
+        :param fields: 需要的字段列表（中文名），用于判断字段覆盖率；不传时只按置信度判断。
+        :return: OcrResult；文件打不开或渲染失败时 error 为错误描述。
+        """
+        from ocr_dpi import field_coverage, first_dpi, needs_escalation
+
         if not os.path.exists(file_path):
             raise FileNotFoundError(f"文件未找到: {file_path}")
 
+        from PIL import Image
+
         ext = os.path.splitext(file_path)[1].lower()
-        images: List[Image.Image] = []
+        policy = self.dpi_policy
+        stats = {"pages": 0, "render_ms": 0.0, "ocr_ms": 0.0, "peak_image_mb": 0.0, "peak_render_rss_mb": None,
+                 "process_rss_mb": None,
+                 "dpi": None, "escalated_pages": 0, "escalation": None, "confidence": None, "coverage": None}
+        self.last_stats = stats
 
         # 根据文件扩展名处理
         if ext == '.pdf':
-            try:
-                # 将PDF转换为PIL图像列表
-                images = convert_from_path(file_path, dpi=300)
-            except Exception as e:
-                return f"处理PDF文件时出错: {e}"
+            # 将PDF逐页转换为PIL图像
+            stats["dpi"] = first_dpi(policy)
+            pages = self.iter_pdf_pages(file_path, stats=stats)
         elif ext in ['.png', '.jpg', '.jpeg', '.bmp', '.gif']:
             try:
-                # 打开单个图片文件
-                images = [Image.open(file_path)]
+                # 打开单个图片文件，图片没有分辨率可调，不做升级
+                pages = iter([(None, Image.open(file_path))])
             except Exception as e:
-                return f"打开图片文件时出错: {e}"
+                return OcrResult(error=f"打开图片文件时出错: {e}")
         else:
-            return f"不支持的文件类型: {ext}"
+            return OcrResult(error=f"不支持的文件类型: {ext}")
+
+        # 单页渲染有进程池的超时，这里再限制整个文件的总时间：超时后不再渲染新页面，也不再升级分辨率
+        deadline = time.monotonic() + self.file_timeout if self.file_timeout else None
 
-        # 遍历所有图像页，提取文本并合并
-        image_text = ''
-        for i, img in enumerate(images):
-            # print(f"正在处理第 {i + 1}/{len(images)} 页...")
-            image_text += self._extract_text_from_single_image(img)
-            if i < len(images) - 1:
-                image_text += "\n\n"  # 在不同页面之间添加分隔
+        def out_of_time():
+            return deadline is not None and time.monotonic() > deadline
 
-        return image_text
+        # 逐页识别，记录每页的页码、结果和是否已升级，供后面按字段覆盖率升级
+        results = []
+        while True:
+            if out_of_time():
+                # 和单页超时一样交给调用方报告并跳过该文件
+                raise ParseTimeoutError(f"处理超时（超过 {self.file_timeout:g} 秒，已识别 {stats['pages']} 页），已跳过")
+            start = time.perf_counter()
+            try:
+                item = next(pages, None)
+            except POOL_ERRORS:
+                # 超时 / 内存超限交给调用方报告并跳过该文件
+                raise
+            except Exception as e:
+                return OcrResult(error=f"处理PDF文件时出错: {e}")
+            if item is None:
+                break
+            page, img = item
+            stats["render_ms"] += (time.perf_counter() - start) * 1000
+            stats["pages"] += 1
+            result = self._ocr_page(img, stats)
+            del img, item
+            escalated = False
+            if page is not None and not out_of_time() and needs_escalation(policy, confidence=result.confidence):
+                retry = self._escalate_page(file_path, page, stats)
+                if retry is not None:
+                    stats["escalation"] = "confidence"
+                    escalated = True
+                    if retry.confidence >= result.confidence:
+                        result = retry
+            results.append([page, result, escalated])
+
+        ocr_result = OcrResult([r[1].pages[0] for r in results])
+        if fields and results:
+            from rename_function import extract_fields_from_text
+
+            coverage = field_coverage(extract_fields_from_text(ocr_result.text, fields), fields)
+            if policy["mode"] == "adaptive" and coverage < policy["min_coverage"]:
+                # 字段不全：还没升级过、并且置信度不够高（可能没看清）的页面按高分辨率重新识别
+                for item in results:
+                    if out_of_time():
+                        break
+                    if item[0] is None or item[2] or not needs_escalation(policy, item[1].confidence, coverage):
+                        continue
+                    retry = self._escalate_page(file_path, item[0], stats)
+                    if retry is not None:
+                        stats["escalation"] = stats["escalation"] or "coverage"
+                        item[1], item[2] = retry, True
+                ocr_result = OcrResult([r[1].pages[0] for r in results])
+                coverage = field_coverage(extract_fields_from_text(ocr_result.text, fields), fields)
+            stats["coverage"] = round(coverage, 3)
+
+        if results:
+            stats["confidence"] = round(ocr_result.confidence, 3)
+        for key in ("render_ms", "ocr_ms", "peak_image_mb", "peak_render_rss_mb", "process_rss_mb"):
+            if stats[key] is not None:
+                stats[key] = round(stats[key], 1)
+        return ocr_result
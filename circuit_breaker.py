@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+按服务商共享的熔断器 - 服务商宕机时快速失败，不再对每个文件都重试、退避等待
+    关闭（closed）：正常调用，连续失败达到阈值时打开
+    打开（open）：直接拒绝调用（调用方快速失败或换别的后端），超过冷却时间后进入半开
+    半开（half_open）：只放行一个试探请求，成功则关闭，失败则重新打开
+
+只有服务商侧的错误（连接失败、超时、5xx、认证失败）算作失败；
+模型返回了内容但解析不出来不算，说明服务是通的。429 也不算：服务是通的，只是要慢一点，
+由限流器按 Retry-After 暂停、调用方的重试策略处理，短时间的限流不会把服务商熔断。
+
+环境变量（均可选）：
+    CIRCUIT_FAILURE_THRESHOLD：连续失败多少次后打开（默认 5）
+    CIRCUIT_RESET_TIMEOUT：打开后多少秒进入半开、试探恢复（默认 30）
+"""
+import os
+import threading
+import time
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_RESET_TIMEOUT = 30
+# 算作服务商故障的 HTTP 状态码（另外所有 5xx 都算；429 不算，见模块说明）
+PROVIDER_ERROR_STATUS = (401, 403, 408)
+
+_breakers = {}
+_lock = threading.Lock()
+
+
+def load_breaker_settings(failure_threshold=None, reset_timeout=None):
+    """
+    读取熔断设置，优先级：参数 > 环境变量 > 默认值。
+    :return: {"failure_threshold", "reset_timeout"}
+    """
+    return {
+        "failure_threshold": int(failure_threshold if failure_threshold is not None
+                                 else os.environ.get("CIRCUIT_FAILURE_THRESHOLD", DEFAULT_FAILURE_THRESHOLD)),
+        "reset_timeout": float(reset_timeout if reset_timeout is not None
+                               else os.environ.get("CIRCUIT_RESET_TIMEOUT", DEFAULT_RESET_TIMEOUT)),
+    }
+
+
+def _status_code(error):
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def is_provider_error(error):
+    """
+    异常是否说明服务商不可用：连接失败 / 超时（openai、requests 和内置的连接、超时异常），
+    或者 HTTP 状态码为 5xx / PROVIDER_ERROR_STATUS。
+    """
+    status = _status_code(error)
+    if status is not None:
+        return status >= 500 or status in PROVIDER_ERROR_STATUS
+    names = [cls.__name__ for cls in type(error).__mro__]
+    return any("Connection" in name or "Timeout" in name for name in names)
+
+
+class CircuitOpenError(RuntimeError):
+    """熔断器打开时拒绝调用"""
+
+
+class CircuitBreaker:
+    """
+    一个服务商的熔断器，可以在多个线程间共享。
+    调用前 allow()，调用后 record_success() / record_failure()；或者直接用 call()。
+    """
+
+    def __init__(self, name, failure_threshold=None, reset_timeout=None):
+        settings = load_breaker_settings(failure_threshold, reset_timeout)
+        self.name = name
+        self.failure_threshold = max(1, settings["failure_threshold"])
+        self.reset_timeout = settings["reset_timeout"]
+        self._state = CLOSED
+        self._failures = 0           # 连续失败次数
+        self._opened_at = 0.0
+        self._probe_started = None   # 半开状态下试探请求的开始时间
+        self._lock = threading.Lock()
+        self.stats = {"successes": 0, "failures": 0, "rejected": 0, "opens": 0}
+
+    def _refresh(self, now):
+        """打开超过冷却时间后转为半开（调用方需持有锁）"""
+        if self._state == OPEN and now - self._opened_at >= self.reset_timeout:
+            self._state = HALF_OPEN
+            self._probe_started = None
+        return self._state
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._refresh(time.monotonic())
+
+    def retry_in(self):
+        """距离下一次试探还有多少秒，未打开时为 0"""
+        with self._lock:
+            if self._refresh(time.monotonic()) != OPEN:
+                return 0.0
+            return max(0.0, self._opened_at + self.reset_timeout - time.monotonic())
+
+    def allow(self):
+        """
+        是否可以发出请求。半开状态只放行一个试探请求；
+        试探请求超过冷却时间还没有结果（调用方没有记录）时再放行一个。
+        """
+        with self._lock:
+            now = time.monotonic()
+            state = self._refresh(now)
+            if state == CLOSED:
+                return True
+            if state == HALF_OPEN and (self._probe_started is None or now - self._probe_started >= self.reset_timeout):
+                self._probe_started = now
+                return True
+            self.stats["rejected"] += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.stats["successes"] += 1
+            self._failures = 0
+            if self._state != CLOSED:
+                print(f"  ✅ {self.name} 已恢复，熔断关闭")
+            self._state = CLOSED
+            self._probe_started = None
+
+    def record_failure(self):
+        with self._lock:
+            now = time.monotonic()
+            self.stats["failures"] += 1
+            self._failures += 1
+            state = self._refresh(now)
+            if state == HALF_OPEN or (state == CLOSED and self._failures >= self.failure_threshold):
+                self._state = OPEN
+                self._opened_at = now
+                self._probe_started = None
+                self.stats["opens"] += 1
+                print(f"  🔌 {self.name} 连续失败 {self._failures} 次，熔断 {self.reset_timeout:.0f} 秒")
+
+    def record(self, error=None):
+        """按调用结果记录：没有异常或异常不是服务商故障时算成功"""
+        if error is not None and is_provider_error(error):
+            self.record_failure()
+        else:
+            self.record_success()
+
+    def call(self, func, *args, **kwargs):
+        """通过熔断器调用 func；打开时抛出 CircuitOpenError"""
+        if not self.allow():
+            raise CircuitOpenError(f"{self.name} 熔断中，约 {self.retry_in():.0f} 秒后试探恢复")
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            self.record(e)
+            raise
+        self.record_success()
+        return result
+
+    def to_dict(self):
+        state = self.state
+        with self._lock:
+            return {"state": state, "consecutive_failures": self._failures, **self.stats}
+
+
+def get_breaker(name):
+    """按服务商名取共享的熔断器，第一次调用时创建；同名的调用方（包括不同的提取器）共用一个"""
+    breaker = _breakers.get(name)
+    if breaker is None:
+        with _lock:
+            breaker = _breakers.get(name)
+            if breaker is None:
+                breaker = _breakers[name] = CircuitBreaker(name)
+    return breaker
+
+
+def breaker_report():
+    """所有熔断器的状态和统计，{服务商名: {...}}"""
+    with _lock:
+        breakers = list(_breakers.values())
+    return {breaker.name: breaker.to_dict() for breaker in breakers}
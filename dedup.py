@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+分阶段查找重复文件 - 只对可能重复的文件计算完整哈希
+1. 按文件大小分组，大小唯一的文件直接排除（不读内容）
+2. 对同大小的文件只读开头和结尾各几 KB 计算探测哈希
+3. 探测哈希也相同的文件，才在线程池里分块流式计算完整哈希
+每个文件同时只占用一个分块的内存，与文件大小无关
+
+环境变量 DEDUP_HASH：blake2b（默认）/ md5 / sha1 / sha256 / xxhash（需要安装 xxhash）
+"""
+import hashlib
+import os
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+HASH_ALGORITHMS = ("blake2b", "md5", "sha1", "sha256", "xxhash")
+DEFAULT_HASH = "blake2b"
+PROBE_BYTES = 4 * 1024          # 探测哈希读取的开头 / 结尾字节数
+CHUNK_SIZE = 1024 * 1024        # 完整哈希每次读取的字节数
+DEFAULT_WORKERS = min(8, (os.cpu_count() or 1) * 2)
+
+
+def load_hash_name(value=None):
+    """
+    读取哈希算法，参数优先，其次环境变量 DEDUP_HASH。
+    未知算法或未安装 xxhash 时退回 blake2b。
+    """
+    name = (value or os.environ.get("DEDUP_HASH") or DEFAULT_HASH).lower()
+    if name not in HASH_ALGORITHMS:
+        print(f"⚠️ 不支持的哈希算法 {name}，改用 {DEFAULT_HASH}")
+        return DEFAULT_HASH
+    if name == "xxhash":
+        try:
+            import xxhash  # noqa: F401
+        except ImportError:
+            print(f"⚠️ 未安装 xxhash（pip install xxhash），改用 {DEFAULT_HASH}")
+            return DEFAULT_HASH
+    return name
+
+
+def new_hasher(name):
+    if name == "xxhash":
+        import xxhash
+        return xxhash.xxh3_128()
+    return hashlib.new(name)
+
+
+def probe_digest(file_path, size, hash_name, probe_bytes=PROBE_BYTES):
+    """只读文件开头和结尾各 probe_bytes 字节计算哈希；文件不大于 2 * probe_bytes 时等于完整哈希"""
+    h = new_hasher(hash_name)
+    with open(file_path, 'rb') as f:
+        h.update(f.read(probe_bytes))
+        if size > 2 * probe_bytes:
+            f.seek(-probe_bytes, os.SEEK_END)
+        h.update(f.read(probe_bytes))
+    return h.hexdigest()
+
+
+def full_digest(file_path, hash_name, chunk_size=CHUNK_SIZE):
+    """分块流式计算完整哈希"""
+    h = new_hasher(hash_name)
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _regroup(groups, key_func, pool):
+    """把每组里的文件按 key_func 的结果再细分，只保留至少两个文件的子组"""
+    items = [(group_key, path) for group_key, paths in groups.items() for path in paths]
+    keys = pool.map(lambda item: key_func(*item), items)
+    regrouped = defaultdict(list)
+    for (group_key, path), key in zip(items, keys):
+        regrouped[(group_key, key)].append(path)
+    return {key: paths for key, paths in regrouped.items() if len(paths) > 1}
+
+
+def find_duplicates(paths, hash_name=None, workers=DEFAULT_WORKERS, probe_bytes=PROBE_BYTES):
+    """
+    查找内容相同的文件。
+
+    :param paths: 文件路径列表，每组重复文件按这里的顺序排列。
+    :param hash_name: 哈希算法，默认读取环境变量 DEDUP_HASH。
+    :param workers: 读取文件的线程数。
+    :param probe_bytes: 探测哈希读取的开头 / 结尾字节数。
+    :return: (groups, stats)。groups 为重复文件组列表，每组第一个是应保留的文件；
+             stats 为各阶段剩余的候选文件数和实际读取的字节数。
+    """
+    hash_name = load_hash_name(hash_name)
+    order = {path: i for i, path in enumerate(paths)}
+
+    by_size = defaultdict(list)
+    for path in paths:
+        by_size[os.path.getsize(path)].append(path)
+    candidates = {size: group for size, group in by_size.items() if len(group) > 1}
+    stats = {"hash": hash_name, "files": len(paths),
+             "size_candidates": sum(len(group) for group in candidates.values())}
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        candidates = _regroup(candidates, lambda size, path: probe_digest(path, size, hash_name, probe_bytes), pool)
+        stats["probe_candidates"] = sum(len(group) for group in candidates.values())
+
+        # 小文件的探测哈希已经覆盖全部内容，不需要再读一遍
+        small = {key: group for key, group in candidates.items() if key[0] <= 2 * probe_bytes}
+        large = {key: group for key, group in candidates.items() if key[0] > 2 * probe_bytes}
+        stats["full_hashed"] = sum(len(group) for group in large.values())
+        stats["bytes_read"] = (
+            sum(min(size, 2 * probe_bytes) * len(group) for size, group in by_size.items() if len(group) > 1)
+            + sum(key[0] * len(group) for key, group in large.items()))
+        large = _regroup(large, lambda key, path: full_digest(path, hash_name), pool)
+
+    groups = [sorted(group, key=order.get) for group in list(small.values()) + list(large.values())]
+    groups.sort(key=lambda group: order[group[0]])
+    return groups, stats
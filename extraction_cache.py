@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+基于文件内容哈希的提取结果缓存（SQLite）
+同一个文件、同一组字段、同一版本的提取流程，只提取一次；重跑时直接命中，不再调用 OCR 和 AI
+另外提供 AI 响应的记忆化缓存：相同（或仅空白不同）的发票文本不会重复请求模型
+"""
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# 提取流程（正则、提示词、各阶段判断逻辑）有变化时递增，旧缓存自动失效
+EXTRACTOR_VERSION = "4"
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".invoice_renamer", "extraction_cache.sqlite3")
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024   # 缓存内容总大小上限
+DEFAULT_MAX_AGE_DAYS = 90              # 超过这个天数没有被访问的记录会被清理
+
+
+def file_digest(file_path, chunk_size=1024 * 1024):
+    """分块读取文件计算 SHA-256，内存占用与文件大小无关"""
+    h = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def make_cache_key(digest, fields, version=EXTRACTOR_VERSION):
+    """
+    生成缓存键：文件哈希 + 请求的字段 + 提取器版本。
+    字段按名称排序，只改变字段顺序或分隔符时仍然可以命中。
+    """
+    return f"{digest}:{','.join(sorted(fields))}:{version}"
+
+
+def cache_enabled_by_env():
+    """环境变量 EXTRACTION_CACHE=0 / false 时关闭缓存"""
+    return os.environ.get("EXTRACTION_CACHE", "1").lower() not in ("0", "false", "no", "off")
+
+
+class SqliteJsonCache:
+    """
+    一个键值都为字符串/JSON 的 SQLite 缓存，支持按总大小和闲置时间清理。
+    同一个实例可以在多个线程间共享。
+    """
+
+    def __init__(self, path=None, table="extractions", max_bytes=DEFAULT_MAX_BYTES,
+                 max_age_days=DEFAULT_MAX_AGE_DAYS):
+        """
+        :param path: 数据库文件路径，默认读取环境变量 EXTRACTION_CACHE_PATH。
+        :param table: 表名，不同用途的缓存可以共用一个数据库文件。
+        :param max_bytes: 缓存内容总大小上限，超出时按最久未访问的顺序删除。
+        :param max_age_days: 超过这个天数未被访问的记录会被删除。
+        """
+        self.path = path or os.environ.get("EXTRACTION_CACHE_PATH", DEFAULT_CACHE_PATH)
+        self.table = table
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+        self.hits = 0
+        self.misses = 0
+        self._puts_since_evict = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table} ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+        self.evict()
+
+    def get(self, key):
+        """命中返回解析后的 JSON 值，未命中返回 None"""
+        with self._lock:
+            row = self._conn.execute(f"SELECT value FROM {self.table} WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            with self._conn:
+                self._conn.execute(f"UPDATE {self.table} SET accessed_at = ? WHERE key = ?", (time.time(), key))
+        return json.loads(row[0])
+
+    def put(self, key, value):
+        now = time.time()
+        data = json.dumps(value, ensure_ascii=False)
+        with self._lock:
+            with self._conn:
+                self._conn.execute(
+                    f"INSERT OR REPLACE INTO {self.table} (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                    (key, data, now, now),
+                )
+            self._puts_since_evict += 1
+            need_evict = self._puts_since_evict >= 100
+        if need_evict:
+            self.evict()
+
+    def evict(self):
+        """删除过期记录，并在总大小超限时删除最久未访问的记录"""
+        with self._lock, self._conn:
+            self._puts_since_evict = 0
+            if self.max_age_days:
+                cutoff = time.time() - self.max_age_days * 86400
+                self._conn.execute(f"DELETE FROM {self.table} WHERE accessed_at < ?", (cutoff,))
+            if self.max_bytes:
+                total = self._conn.execute(f"SELECT COALESCE(SUM(LENGTH(value)), 0) FROM {self.table}").fetchone()[0]
+                if total > self.max_bytes:
+                    rows = self._conn.execute(
+                        f"SELECT key, LENGTH(value) FROM {self.table} ORDER BY accessed_at ASC").fetchall()
+                    stale = []
+                    for key, size in rows:
+                        if total <= self.max_bytes:
+                            break
+                        stale.append((key,))
+                        total -= size
+                    self._conn.executemany(f"DELETE FROM {self.table} WHERE key = ?", stale)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class ExtractionCache(SqliteJsonCache):
+    """按文件内容缓存字段提取结果：{"fields": {中文字段名: 值}, "tier": 结果来源}"""
+
+    def __init__(self, path=None, version=EXTRACTOR_VERSION, **kwargs):
+        """
+        :param version: 提取器版本，一般为 EXTRACTOR_VERSION 加上模型名称。
+        """
+        super().__init__(path, table="extractions", **kwargs)
+        self.version = version
+
+    def lookup(self, file_path, fields):
+        """
+        :return: (key, cached)。cached 为 None 表示未命中；key 用于之后写入。
+        """
+        key = make_cache_key(file_digest(file_path), fields, self.version)
+        return key, self.get(key)
+
+    def store(self, key, field_values, tier):
+        self.put(key, {"fields": field_values, "tier": tier})
+
+
+def normalize_text(text):
+    """合并连续空白并去掉首尾空白，空白不同但内容相同的文本视为同一份"""
+    return re.sub(r'\s+', ' ', text or '').strip()
+
+
+class LlmResponseMemo:
+    """
+    AI 响应记忆化：进程内 LRU 在前，SQLite 持久化存储在后。
+    键为 规范化文本 + 模型名 + 输出结构版本 的哈希，不保存原始文本。
+    """
+
+    def __init__(self, model_name, schema_version, max_memory_items=512, store=None):
+        """
+        :param model_name: 模型名称，不同模型的结果互不共用。
+        :param schema_version: 输出结构（以及提示词）的版本标识，结构变化后旧结果自动失效。
+        :param max_memory_items: 进程内 LRU 的容量。
+        :param store: 持久化存储，默认使用 SqliteJsonCache 的 llm_responses 表；传 False 只用内存。
+        """
+        self.model_name = model_name
+        self.schema_version = schema_version
+        self.max_memory_items = max_memory_items
+        self.store = SqliteJsonCache(table="llm_responses") if store is None else store
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+    def make_key(self, text):
+        raw = f"{self.model_name}\n{self.schema_version}\n{normalize_text(text)}"
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, text):
+        """命中返回之前的提取结果字典，未命中返回 None"""
+        key = self.make_key(text)
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return dict(self._memory[key])
+
+        value = self.store.get(key) if self.store else None
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._remember(key, value)
+        return dict(value)
+
+    def put(self, text, value):
+        key = self.make_key(text)
+        with self._lock:
+            self._remember(key, value)
+        if self.store:
+            self.store.put(key, value)
+
+    def _remember(self, key, value):
+        self._memory[key] = dict(value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {"memory_hits": self.memory_hits, "disk_hits": self.disk_hits, "misses": self.misses}
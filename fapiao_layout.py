@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+增值税电子发票版面提取 - 按坐标分区取值，不把整页压成一行再用正则
+发票的购方 / 销方信息一般分别在左右两栏（也有上下排列的版式），合计、价税合计各占一行；
+先用 pdfplumber 的单词坐标找到这些标签，再只在对应区域里取值，
+购方和销方不会因为文本顺序交错而互相串位，名称折行也能完整拼接。
+
+环境变量 FAPIAO_LAYOUT=0 时关闭，只用整页文本 + 正则
+"""
+import os
+import re
+
+LINE_TOLERANCE = 3        # top 相差不超过这么多点视为同一行
+COLUMN_MIN_GAP = 50       # 两个标签的 x0 相差超过这么多点才视为左右两栏，否则是上下排列
+# 购买方 / 销售方信息栏左侧竖排的单字标签，不属于任何字段的值
+_SIDE_LABELS = set("购买方销售信息")
+
+_LABEL_SPLIT_RE = re.compile(r"[：:]")
+_AMOUNT_RE = re.compile(r"^[¥￥]?(-?[\d.]+)$")
+_PRICE_TAX_TOTAL_RE = re.compile(r"（小写）\s*[¥￥]?([\d.]+)")
+_PRICE_TAX_WORDS_RE = re.compile(r"（大写）\s*(\S+)")
+
+
+def layout_enabled_by_env():
+    return os.environ.get("FAPIAO_LAYOUT", "1").lower() not in ("0", "false", "no", "off")
+
+
+def group_lines(words):
+    """按 top 坐标把单词分成行，每行内按 x0 排序"""
+    lines = []
+    for word in sorted(words, key=lambda w: (w["top"], w["x0"])):
+        if lines and abs(word["top"] - lines[-1][0]["top"]) <= LINE_TOLERANCE:
+            lines[-1].append(word)
+        else:
+            lines.append([word])
+    return [sorted(line, key=lambda w: w["x0"]) for line in lines]
+
+
+def _value_after_label(line, index, label, x_max=None):
+    """
+    取标签之后的值：同一个单词里冒号后面的部分，为空时取同一行下一个单词。
+    x_max 限制取值的右边界（左栏的值不能越过右栏）。
+    """
+    word = line[index]
+    text = word["text"]
+    rest = _LABEL_SPLIT_RE.split(text[text.index(label) + len(label):], 1)
+    value = rest[-1].strip()
+    if value:
+        return value
+    for next_word in line[index + 1:]:
+        if x_max is not None and next_word["x0"] >= x_max:
+            break
+        if next_word["text"] not in _SIDE_LABELS:
+            return next_word["text"]
+    return ""
+
+
+def _find(lines, label):
+    """按阅读顺序找出所有包含 label 的单词，返回 [(行号, 单词序号)]"""
+    return [(i, j) for i, line in enumerate(lines) for j, word in enumerate(line) if label in word["text"]]
+
+
+def _party_fields(lines, label):
+    """
+    在购方 / 销方信息里找 label（“名称” 或 “纳税人识别号”）。
+    两个标签横向相距超过 COLUMN_MIN_GAP 时为左右两栏（左购右销），
+    否则为上下排列（上购下销）：左边缘只差零点几个点，不能按 x0 区分。
+    :return: (购方位置, 销方位置, 是否上下排列)，找不到的为 None；位置为 (行号, 单词序号)。
+    """
+    label_re = re.compile(rf"(?:统一社会信用代码/)?{label}(?:[：:]|$)")
+    hits = [(i, j) for i, j in _find(lines, label) if label_re.match(lines[i][j]["text"])]
+    if not hits:
+        return None, None, False
+    if len(hits) == 1:
+        return hits[0], None, False
+    by_x = sorted(hits, key=lambda hit: lines[hit[0]][hit[1]]["x0"])
+    left, right = by_x[0], by_x[-1]
+    if lines[right[0]][right[1]]["x0"] - lines[left[0]][left[1]]["x0"] >= COLUMN_MIN_GAP:
+        return left, right, False
+    # _find 按阅读顺序返回，第一个在上
+    return hits[0], hits[-1], True
+
+
+def _stop_row(row, *positions, default):
+    """同一栏里 row 之后、最近的一个标签所在的行，作为该字段取值区域的下边界"""
+    rows = [position[0] for position in positions if position and position[0] > row]
+    return min(rows) if rows else default
+
+
+def _name_value(lines, position, x_min, x_max, stop_row):
+    """取名称的值，并把折行到下面几行（同一栏、识别号之前，最多两行）的内容拼接上"""
+    i, j = position
+    value = _value_after_label(lines[i], j, "名称", x_max)
+    for row in range(i + 1, min(stop_row, i + 3)):
+        parts = [w["text"] for w in lines[row]
+                 if x_min <= w["x0"] < x_max and w["text"] not in _SIDE_LABELS]
+        value += "".join(parts)
+    return value
+
+
+def _total_row(lines):
+    """找到“合 计”所在的行（排除“价税合计”）"""
+    for i, line in enumerate(lines):
+        texts = [w["text"] for w in line]
+        for j, text in enumerate(texts):
+            if "价税" in text:
+                break
+            if text.replace(" ", "") in ("合计", "合计：", "合计:") or (
+                    text == "合" and j + 1 < len(texts) and texts[j + 1] == "计"):
+                return i, j
+    return None
+
+
+def extract_layout_fields(page, fields):
+    """
+    从标准电子发票页面按区域提取字段。
+
+    :param page: pdfplumber 的 Page（一般是第一页）。
+    :param fields: 用户选择的字段列表（中文名）。
+    :return: (field_values, lines_text)。不是标准发票版面时返回 (None, None)；
+             field_values 只包含找到的字段，lines_text 为按行拼接的页面文本。
+    """
+    lines = group_lines(page.extract_words())
+    lines_text = "\n".join(" ".join(w["text"] for w in line) for line in lines)
+    if not _find(lines, "发票号码"):
+        return None, None
+
+    values = {}
+    buyer_name, seller_name, names_stacked = _party_fields(lines, "名称")
+    buyer_tax, seller_tax, tax_stacked = _party_fields(lines, "纳税人识别号")
+    stacked = names_stacked or tax_stacked
+    if stacked:
+        # 上下排列：两方都占整行宽度，靠行号分区（购方区域到销方名称为止）；
+        # 只找到一个识别号时按它在哪个区域里归属，不能默认算作购方
+        seller_x, buyer_x_max = 0, page.width
+        if buyer_name and seller_name:
+            taxes = [hit for hit in (buyer_tax, seller_tax) if hit]
+            buyer_tax = next((hit for hit in taxes if buyer_name[0] < hit[0] < seller_name[0]), None)
+            seller_tax = next((hit for hit in taxes if hit[0] > seller_name[0]), None)
+    else:
+        # 两栏的分界：右栏第一个标签（销方名称 / 识别号）的横坐标
+        right_anchor = seller_name or seller_tax
+        split_x = lines[right_anchor[0]][right_anchor[1]]["x0"] if right_anchor else page.width
+        # 右栏左侧竖排的“销售方”标签也算右栏
+        for line in lines:
+            for word in line:
+                if word["text"] in ("销", "销售方") and word["x0"] < split_x and word["x0"] > page.width / 3:
+                    split_x = word["x0"]
+        seller_x = buyer_x_max = split_x
+
+    if "购方名称" in fields and buyer_name:
+        stop = _stop_row(buyer_name[0], buyer_tax, *((seller_name, seller_tax) if stacked else ()),
+                         default=len(lines))
+        values["购方名称"] = _name_value(lines, buyer_name, 0, buyer_x_max, stop)
+    if "销方名称" in fields and seller_name:
+        stop = _stop_row(seller_name[0], seller_tax, default=len(lines))
+        values["销方名称"] = _name_value(lines, seller_name, seller_x, page.width, stop)
+    if "购方税号" in fields and buyer_tax:
+        values["购方税号"] = _value_after_label(lines[buyer_tax[0]], buyer_tax[1], "纳税人识别号", buyer_x_max)
+    if "销方税号" in fields and seller_tax:
+        values["销方税号"] = _value_after_label(lines[seller_tax[0]], seller_tax[1], "纳税人识别号")
+
+    for key in ("发票号码", "开票日期", "开票人"):
+        hits = _find(lines, key)
+        if key in fields and hits:
+            values[key] = _value_after_label(lines[hits[0][0]], hits[0][1], key)
+
+    if "合计" in fields or "总税额" in fields:
+        row = _total_row(lines)
+        if row is not None:
+            amounts = [m.group(1) for m in (_AMOUNT_RE.match(w["text"]) for w in lines[row[0]][row[1] + 1:]) if m]
+            if "合计" in fields and amounts:
+                values["合计"] = amounts[0]
+            if "总税额" in fields and len(amounts) > 1:
+                values["总税额"] = amounts[1]
+
+    if "价税合计" in fields or "价税合计大写" in fields:
+        hits = _find(lines, "价税合计")
+        if hits:
+            row_text = " ".join(w["text"] for w in lines[hits[0][0]])
+            m = _PRICE_TAX_TOTAL_RE.search(row_text)
+            if "价税合计" in fields and m:
+                values["价税合计"] = m.group(1)
+            m = _PRICE_TAX_WORDS_RE.search(row_text)
+            if "价税合计大写" in fields and m:
+                values["价税合计大写"] = m.group(1)
+
+    return {key: value for key, value in values.items() if value}, lines_text
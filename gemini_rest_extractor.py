@@ -4,12 +4,13 @@ Gemini REST API 提取器 - 直接调用API，不使用SDK
 支持多语言收据/发票识别（中英日文）
 """
 import os
-import base64
-import requests
 from PIL import Image
 from typing import Dict
 import io
 import json
+from http_session import get_session, request_timeout
+from image_prep import format_prep_stats, load_image_prep, prepare_image_base64
+from receipt_schema import field_guide, gemini_generation_config, parse_receipts, record_parse
 
 
 class GeminiRestExtractor:
@@ -26,47 +27,39 @@ class GeminiRestExtractor:
         """
         self.api_key = api_key
         self.api_url = "https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash:generateContent"
+        # 上传前的图片压缩设置（长边、灰度、格式、质量），见 image_prep.load_image_prep
+        self.image_prep = load_image_prep()
+        # 结构化输出：JSON 模式 + 共用的收据 Schema
+        self.generation_config = gemini_generation_config()
+        # 复用 keep-alive 连接，超时和重试见 http_session
+        self.session = get_session("gemini")
+        self.timeout = request_timeout()
         print(f"🔧 初始化 Gemini REST API...")
         print("   ✅ 初始化成功\n")
 
-    def _image_to_base64(self, image_path: str) -> str:
-        """将图片转换为base64编码"""
-        with open(image_path, 'rb') as f:
-            image_data = f.read()
-        return base64.b64encode(image_data).decode('utf-8')
+    def _image_to_base64(self, image) -> tuple:
+        """按压缩设置准备图片并转换为base64编码，返回 (base64, mime_type)，见 image_prep.prepare_image"""
+        encoded, mime_type, stats = prepare_image_base64(image, self.image_prep)
+        print(f"  🖼️ {format_prep_stats(stats)}")
+        return encoded, mime_type
 
-    def extract_from_image(self, image_path: str) -> Dict:
+    def extract_from_image(self, image) -> Dict:
         """
         从图片中提取收据信息
 
-        :param image_path: 图片路径
+        :param image: 图片路径、已编码的图片字节或内存中的 PIL 图像
         :return: 提取的信息字典
         """
-        # 构建请求体
-        prompt = """
-请详细分析这张收据/发票图片，提取所有可见信息。
-
-返回JSON格式，包含以下字段：
-{
-  "seller_name": "店铺或公司名称（保留原语言）",
-  "issue_date": "日期（YYYY-MM-DD格式）",
-  "issue_time": "时间（如果有，HH:MM格式）",
-  "invoice_number": "发票或收据编号（如果有）",
-  "total_amount": "总金额（仅数字）",
-  "subtotal": "小计金额",
-  "tax": "税额",
-  "currency": "货币符号（如¥、$、€等）",
-  "payment_method": "支付方式（现金/信用卡/支付宝等）",
-  "items": "商品列表（如果有多个商品，用分号分隔）"
-}
-
-支持中文、英文、日文识别。如果某项信息不存在，设为null。
-
-只返回JSON，不要其他解释文字。
+        # 构建请求体；输出结构由 generationConfig 的 responseSchema 约束，这里只说明字段含义
+        prompt = f"""
+识别这张收据/发票图片中的信息。支持中文、英文、日文识别。某项信息不存在时设为 null。
+
+字段说明：
+{field_guide()}
 """
 
-        # 转换图片
-        img_base64 = self._image_to_base64(image_path)
+        # 转换图片（在内存中完成，不经过临时文件）
+        img_base64, mime_type = self._image_to_base64(image)
 
         # 构建请求
         payload = {
@@ -76,13 +69,14 @@ class GeminiRestExtractor:
                         {"text": prompt},
                         {
                             "inline_data": {
-                                "mime_type": "image/jpeg",
+                                "mime_type": mime_type,
                                 "data": img_base64
                             }
                         }
                     ]
                 }
-            ]
+            ],
+            "generationConfig": self.generation_config
         }
 
         # 发送请求
@@ -90,37 +84,34 @@ class GeminiRestExtractor:
         headers = {"Content-Type": "application/json"}
 
         try:
-            response = requests.post(url, headers=headers, json=payload, timeout=30)
+            response = self.session.post(url, headers=headers, json=payload, timeout=self.timeout)
             response.raise_for_status()
 
             result = response.json()
 
-            # 提取生成的文本
+            # 提取生成的文本（JSON 模式下就是符合 Schema 的 JSON）
             if "candidates" in result and len(result["candidates"]) > 0:
-                content = result["candidates"][0]["content"]["parts"][0]["text"]
-
-                # 解析JSON
-                import re
-                json_match = re.search(r'\{.*\}', content, re.DOTALL)
-                if json_match:
-                    json_str = json_match.group(0)
-                    return json.loads(json_str)
-                else:
-                    return {"raw_text": content}
+                candidate = result["candidates"][0]
+                parts = candidate.get("content", {}).get("parts") or []
+                if not parts:
+                    # 被截断（MAX_TOKENS）或被安全策略拦截时没有内容
+                    record_parse("gemini_rest", False)
+                    return {"error": f"No content in response ({candidate.get('finishReason')})"}
+                return parse_receipts("gemini_rest", parts[0]["text"])[0]
             else:
                 return {"error": "No content in response"}
 
         except Exception as e:
             return {"error": str(e)}
 
-    def extract_with_deep_structure(self, image_path: str) -> Dict:
+    def extract_with_deep_structure(self, image) -> Dict:
         """
         深度结构化提取
 
-        :param image_path: 图片路径
+        :param image: 图片路径、已编码的图片字节或内存中的 PIL 图像
         :return: 详细的信息字典
         """
-        return self.extract_from_image(image_path)
+        return self.extract_from_image(image)
 
 
 # 测试代码
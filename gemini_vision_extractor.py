@@ -6,9 +6,11 @@ Gemini Vision 提取器 - 支持多语言收据/发票识别
 """
 import os
 import google.generativeai as genai
-from PIL import Image
 from typing import Dict, Optional
 import base64
+from image_prep import open_image
+from receipt_schema import (deep_field_guide, field_guide, gemini_deep_response_schema, gemini_response_schema,
+                            parse_receipts, record_parse)
 
 
 class GeminiVisionExtractor:
@@ -17,121 +19,77 @@ class GeminiVisionExtractor:
     支持多语言收据/发票的直接识别和结构化提取
     """
 
-    def __init__(self, api_key: str, model: str = "gemini-pro-vision"):
+    # 快速提取的字段
+    FIELDS = ("seller_name", "total_amount", "issue_date", "currency")
+
+    def __init__(self, api_key: str, model: str = "gemini-1.5-flash"):
         """
         初始化 Gemini Vision
 
         :param api_key: Google API Key
-        :param model: 模型名称（gemini-pro-vision 专门用于视觉）
+        :param model: 模型名称（需要支持 JSON 模式，gemini-pro-vision 不支持）
         """
         genai.configure(api_key=api_key)
         self.model = genai.GenerativeModel(model)
+        # 结构化输出：JSON 模式 + 共用的收据 Schema；深度提取用带商品明细的 Schema
+        self.schema_config = {"response_mime_type": "application/json",
+                              "response_schema": gemini_response_schema(self.FIELDS)}
+        self.deep_config = {"response_mime_type": "application/json",
+                            "response_schema": gemini_deep_response_schema()}
         print(f"🔧 初始化 Gemini Vision (模型: {model})...")
         print("   ✅ 初始化成功\n")
 
-    def extract_from_image_path(self, image_path: str) -> Dict:
+    def extract_from_image_path(self, image) -> Dict:
         """
-        从图片路径提取收据/发票信息
+        从图片提取收据/发票信息
 
-        :param image_path: 图片路径（支持JPG/PNG/PDF转图片）
+        :param image: 图片路径（支持JPG/PNG/PDF转图片）、已编码的图片字节或内存中的 PIL 图像
         :return: 提取的信息字典
         """
-        # 加载图片
-        img = Image.open(image_path)
-
-        # 构建提示词
-        prompt = """
-你是一个专业的收据/发票识别助手。请从这张图片中提取信息，并以JSON格式返回。
+        # 加载图片（已经在内存中的图像直接使用）
+        img = open_image(image)
 
-请提取以下字段（如果图片中没有对应信息，设为null）：
-- seller_name: 店铺/公司名称（保留原语言，不要翻译）
-- total_amount: 总金额（仅数字）
-- issue_date: 日期（YYYY-MM-DD格式）
-- currency: 货币符号（如¥、$、€等）
+        # 构建提示词；输出结构由 response_schema 约束，这里只说明字段含义
+        prompt = f"""
+你是一个专业的收据/发票识别助手。请从这张图片中提取以下字段（图片中没有对应信息时设为null，不要翻译）：
+{field_guide(self.FIELDS)}
 
 支持语言：中文、英文、日文
-
-只返回JSON，不要其他文字。
 """
 
         # 调用 Gemini Vision
-        response = self.model.generate_content([prompt, img])
+        response = self.model.generate_content([prompt, img], generation_config=self.schema_config)
+        return self._parse(response)
 
-        # 解析结果
-        result_text = response.text
-
-        # 简单的JSON解析（提取花括号内容）
+    @staticmethod
+    def _parse(response) -> Dict:
+        """解析 JSON 模式的输出；被截断或拦截时 response.text 会抛异常，计为解析失败"""
         try:
-            import json
-            import re
-
-            # 提取JSON部分
-            json_match = re.search(r'\{.*\}', result_text, re.DOTALL)
-            if json_match:
-                json_str = json_match.group(0)
-                return json.loads(json_str)
-            else:
-                # 如果没有找到JSON，返回原始文本
-                return {"raw_text": result_text}
-        except Exception as e:
-            # 解析失败，返回原始文本
-            return {"raw_text": result_text, "error": str(e)}
-
-    def extract_with_deep_structure(self, image_path: str) -> Dict:
+            result_text = response.text
+        except ValueError as e:
+            record_parse("gemini_vision", False)
+            return {"error": str(e)}
+        return parse_receipts("gemini_vision", result_text)[0]
+
+    def extract_with_deep_structure(self, image) -> Dict:
         """
         深度结构化提取（使用更详细的Prompt）
 
-        :param image_path: 图片路径
+        :param image: 图片路径、已编码的图片字节或内存中的 PIL 图像
         :return: 详细的信息字典
         """
-        img = Image.open(image_path)
-
-        prompt = """
-请详细分析这张收据/发票图片，提取所有可见信息。
-
-返回JSON格式，包含以下字段：
-{
-  "seller_name": "店铺或公司名称（保留原语言）",
-  "seller_address": "地址（如果有）",
-  "seller_phone": "电话（如果有）",
-  "issue_date": "日期（YYYY-MM-DD）",
-  "issue_time": "时间（如果有，HH:MM格式）",
-  "invoice_number": "发票或收据编号（如果有）",
-  "items": [
-    {
-      "name": "商品名称",
-      "quantity": "数量",
-      "price": "单价",
-      "amount": "小计"
-    }
-  ],
-  "subtotal": "小计金额",
-  "tax": "税额",
-  "total_amount": "总金额",
-  "payment_method": "支付方式（现金/信用卡/支付宝等）",
-  "currency": "货币符号"
-}
-
-支持中文、英文、日文识别。如果某项信息不存在，设为null。
-
-只返回JSON，不要其他解释文字。
-"""
+        img = open_image(image)
 
-        response = self.model.generate_content([prompt, img])
-        result_text = response.text
+        # 输出结构由 response_schema 约束（包括商品明细），这里只说明字段含义
+        prompt = f"""
+请详细分析这张收据/发票图片，提取所有可见信息（图片中没有对应信息时设为null，不要翻译）：
+{deep_field_guide()}
 
-        try:
-            import json
-            import re
-
-            json_match = re.search(r'\{.*\}', result_text, re.DOTALL)
-            if json_match:
-                json_str = json_match.group(0)
-                return json.loads(json_str)
-            else:
-                return {"raw_text": result_text}
-        except Exception as e:
-            return {"raw_text": result_text, "error": str(e)}
+支持中文、英文、日文识别。
+"""
+
+        response = self.model.generate_content([prompt, img], generation_config=self.deep_config)
+        return self._parse(response)
 
 
 # 测试代码
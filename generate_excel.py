@@ -9,9 +9,10 @@ import os
 import pandas as pd
 from tqdm import tqdm
 from dotenv import load_dotenv
-from openai_vision_extractor import OpenAIVisionExtractor
-from pdf2image import convert_from_path
-import tempfile
+from receipt_extractors import ExtractorRouter
+from receipt_schema import parse_report
+from pdf2image import convert_from_path, pdfinfo_from_path
+from ocr_dpi import field_coverage, first_dpi, load_ocr_dpi, needs_paid_escalation
 
 # 加载环境变量
 load_dotenv()
@@ -19,46 +20,69 @@ load_dotenv()
 # --- 配置区 ---
 INPUT_FOLDER = "/Users/esther/Downloads/consolidated_receipts"  # 输入文件夹
 OUTPUT_EXCEL = "我的对账单.xlsx"  # 输出Excel文件名
-OPENAI_VISION_API_KEY = os.getenv("OPENAI_VISION_API_KEY")  # OpenAI Vision API Key
+# PDF 渲染分辨率：默认按 150 dpi 识别（上传前还会按 IMAGE_MAX_EDGE 缩放）；
+# OCR_PAID_ESCALATIONS 开启时，字段不全的页面再用 300 dpi 重新调用（见 ocr_dpi.py）
+REQUIRED_RECEIPT_FIELDS = ("issue_date", "seller_name", "total_amount")
 
 
-def process_file(file_path: str, extractor: OpenAIVisionExtractor) -> list:
+def _receipts_coverage(receipts: list) -> float:
+    """一页识别结果的必填字段覆盖率（多张收据时取最好的一张）"""
+    return max((field_coverage(r, REQUIRED_RECEIPT_FIELDS) for r in receipts), default=0.0)
+
+
+def _extract_pdf_page(file_path: str, page_num: int, dpi: int, extractor: ExtractorRouter) -> list:
+    """按指定分辨率渲染 PDF 的一页并识别；渲染出的图像直接在内存中编码上传，不写临时文件"""
+    images = convert_from_path(file_path, dpi=dpi, first_page=page_num, last_page=page_num)
+    if not images:
+        return []
+    return extractor.extract_from_image(images.pop())
+
+
+def process_file(file_path: str, extractor: ExtractorRouter, dpi_policy: dict = None,
+                 stats: dict = None) -> list:
     """
     处理单个文件（支持PDF、图片、单收据、多收据）
 
     :param file_path: 文件路径
-    :param extractor: OpenAI Vision提取器
+    :param extractor: 提取器（ExtractorRouter，或 OpenAIVisionExtractor 等提供 extract_from_image 的提取器）
+    :param dpi_policy: PDF 渲染分辨率策略，默认读取环境变量 OCR_DPI_MODE / OCR_LOW_DPI / OCR_PAID_ESCALATIONS 等
+    :param stats: 可选的统计字典，累计 PDF 页数（pages）和升级到高分辨率的页数（escalated_pages）
     :return: 收据列表（支持多个收据）
     """
     ext = os.path.splitext(file_path)[1].lower()
     filename = os.path.basename(file_path)
+    dpi_policy = dpi_policy or load_ocr_dpi()
+    stats = stats if stats is not None else {}
 
     try:
         # PDF处理：转换为图片后识别
         if ext == '.pdf':
             print(f"  📄 PDF文件，转换为图片...")
-            with tempfile.TemporaryDirectory() as temp_dir:
-                # 转换PDF为图片（提高DPI以获得更清晰的识别）
-                images = convert_from_path(file_path, dpi=300)
-
-                all_receipts = []
-                for page_num, image in enumerate(images, 1):
-                    # 保存为临时文件
-                    temp_image_path = os.path.join(temp_dir, f"page_{page_num}.jpg")
-                    image.save(temp_image_path, 'JPEG')
-
-                    # 识别这一页
-                    print(f"    📖 第{page_num}页识别中...")
-                    receipts = extractor.extract_from_image(temp_image_path)
-
-                    # 为每个收据添加源文件信息
-                    for receipt in receipts:
-                        receipt['源文件名'] = f"{filename} (第{page_num}页)"
-
-                    all_receipts.extend(receipts)
-
-                print(f"  ✅ PDF识别完成：{len(all_receipts)}个收据")
-                return all_receipts
+            # 逐页转换为图片：先按低分辨率识别；必填字段不全时，在付费重试次数以内按高分辨率重新识别
+            page_count = int(pdfinfo_from_path(file_path)["Pages"])
+
+            all_receipts = []
+            for page_num in range(1, page_count + 1):
+                # 识别这一页
+                print(f"    📖 第{page_num}页识别中...")
+                receipts = _extract_pdf_page(file_path, page_num, first_dpi(dpi_policy), extractor)
+                stats["pages"] = stats.get("pages", 0) + 1
+                coverage = _receipts_coverage(receipts)
+                if needs_paid_escalation(dpi_policy, coverage, stats.get("escalated_pages", 0)):
+                    print(f"    🔍 第{page_num}页字段不全，按 {dpi_policy['high']} dpi 重新识别...")
+                    retry = _extract_pdf_page(file_path, page_num, dpi_policy["high"], extractor)
+                    stats["escalated_pages"] = stats.get("escalated_pages", 0) + 1
+                    if _receipts_coverage(retry) >= coverage:
+                        receipts = retry
+
+                # 为每个收据添加源文件信息
+                for receipt in receipts:
+                    receipt['源文件名'] = f"{filename} (第{page_num}页)"
+
+                all_receipts.extend(receipts)
+
+            print(f"  ✅ PDF识别完成：{len(all_receipts)}个收据")
+            return all_receipts
 
         # 图片处理：直接识别
         elif ext in ['.jpg', '.png', '.jpeg', '.bmp']:
@@ -106,13 +130,13 @@ def convert_receipt_to_row(receipt: dict) -> dict:
 
 def main():
     """主处理流程"""
-    if not OPENAI_VISION_API_KEY:
-        print("❌ 请设置环境变量: OPENAI_VISION_API_KEY")
+    # 初始化提取后端：按 EXTRACTOR_CHAIN 路由（默认 openai,gemini_rest,baidu，缺少 API Key 的自动跳过）
+    extractor = ExtractorRouter()
+    if not extractor.available():
+        print("❌ 请设置环境变量: OPENAI_VISION_API_KEY（或 GEMINI_API_KEY / BAIDU_OCR_API_KEY，见 EXTRACTOR_CHAIN）")
         print("   获取方式: https://platform.openai.com/api-keys")
         return
-
-    # 初始化 OpenAI Vision
-    extractor = OpenAIVisionExtractor(OPENAI_VISION_API_KEY)
+    print(f"🔀 提取后端: {' → '.join(extractor.available())}")
 
     # 获取所有支持的文件（图片 + PDF）
     supported_extensions = ('.jpg', '.png', '.jpeg', '.bmp', '.pdf')
@@ -151,6 +175,8 @@ def main():
     print("="*60)
 
     all_results = []
+    dpi_policy = load_ocr_dpi()
+    dpi_stats = {"pages": 0, "escalated_pages": 0}
 
     # 遍历处理每个文件
     for i, filename in enumerate(files, 1):
@@ -158,13 +184,29 @@ def main():
         print(f"\n[{i}/{len(files)}] 处理: {filename}")
 
         # 处理文件（支持PDF、多收据）
-        receipts = process_file(file_path, extractor)
+        receipts = process_file(file_path, extractor, dpi_policy, dpi_stats)
 
         # 转换为Excel行格式
         for receipt in receipts:
             row = convert_receipt_to_row(receipt)
             all_results.append(row)
 
+    if dpi_stats["pages"]:
+        print(f"\n🔍 PDF 共 {dpi_stats['pages']} 页（{dpi_policy['mode']}，{first_dpi(dpi_policy)} dpi），"
+              f"其中 {dpi_stats['escalated_pages']} 页升级到 {dpi_policy['high']} dpi 重新识别")
+    for name, backend_stats in extractor.report().items():
+        if backend_stats["calls"]:
+            print(f"   {name}: 调用 {backend_stats['calls']} 次，失败 {backend_stats['failures']} 次，"
+                  f"不完整 {backend_stats['incomplete']} 次，平均延迟 {backend_stats['latency_sec']} 秒，"
+                  f"成本约 ${backend_stats['cost']}，熔断器 {backend_stats['circuit']}")
+    for name, parse_stats in parse_report().items():
+        print(f"   {name}: 结构化输出 {parse_stats['responses']} 次，解析失败 {parse_stats['parse_failures']} 次"
+              f"（{parse_stats['failure_rate']:.1%}）")
+    hedge = extractor.hedge_report()
+    if hedge["enabled"]:
+        print(f"   对冲：{hedge['requests']} 次请求中触发 {hedge['fired']} 次，对冲方胜出 {hedge['wins']} 次，"
+              f"因上限跳过 {hedge['skipped']} 次，额外成本约 ${hedge['extra_cost']}")
+
     # 生成 Excel
     if all_results:
         print("\n" + "="*60)
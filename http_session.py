@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+共享的 HTTP 连接池 - 百度 OCR、Gemini REST 等接口复用 keep-alive 连接
+每次 requests.post 都会新建 TCP + TLS 连接；同一个 Session 内按主机保留连接池，
+并发请求时复用已建立的连接，并统一设置超时和重试。
+
+环境变量（均可选）：
+    HTTP_POOL_SIZE：每个主机保留的连接数（默认 16，应不小于并发数）
+    HTTP_CONNECT_TIMEOUT / HTTP_READ_TIMEOUT：连接 / 读取超时秒数（默认 5 / 30）
+    HTTP_RETRIES：连接失败、429 和 5xx 时的重试次数（默认 3，按 Retry-After 或指数退避等待）；
+        请求发出后读取超时或断开不重试，服务商可能已经处理并计费
+"""
+import os
+import threading
+
+DEFAULT_POOL_SIZE = 16
+DEFAULT_CONNECT_TIMEOUT = 5
+DEFAULT_READ_TIMEOUT = 30
+DEFAULT_RETRIES = 3
+RETRY_BACKOFF = 0.5                         # 重试等待：0.5s, 1s, 2s ...
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+_sessions = {}
+_lock = threading.Lock()
+
+
+def load_http_settings(pool_size=None, connect_timeout=None, read_timeout=None, retries=None):
+    """
+    读取连接池设置，优先级：参数 > 环境变量 > 默认值。
+    :return: {"pool_size", "connect_timeout", "read_timeout", "retries"}
+    """
+    return {
+        "pool_size": int(pool_size if pool_size is not None else os.environ.get("HTTP_POOL_SIZE", DEFAULT_POOL_SIZE)),
+        "connect_timeout": float(connect_timeout if connect_timeout is not None
+                                 else os.environ.get("HTTP_CONNECT_TIMEOUT", DEFAULT_CONNECT_TIMEOUT)),
+        "read_timeout": float(read_timeout if read_timeout is not None
+                              else os.environ.get("HTTP_READ_TIMEOUT", DEFAULT_READ_TIMEOUT)),
+        "retries": int(retries if retries is not None else os.environ.get("HTTP_RETRIES", DEFAULT_RETRIES)),
+    }
+
+
+def request_timeout(settings=None):
+    """requests 的 timeout 参数：(连接超时, 读取超时)"""
+    settings = settings or load_http_settings()
+    return settings["connect_timeout"], settings["read_timeout"]
+
+
+def create_session(settings=None):
+    """创建带连接池和重试的 Session"""
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    settings = settings or load_http_settings()
+    retry = Retry(
+        total=settings["retries"],
+        # 读取阶段的错误（如读取超时）说明请求已经发出去了，识别接口按次计费，重发就是再付一次钱；
+        # 只在连接失败（请求没有发出）和服务商明确返回 429 / 5xx 时重试
+        read=0,
+        backoff_factor=RETRY_BACKOFF,
+        status_forcelist=RETRY_STATUS,
+        allowed_methods=frozenset(["GET", "POST"]),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=settings["pool_size"], max_retries=retry,
+                          pool_block=False)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session(name="default"):
+    """
+    按名称取共享的 Session，第一次调用时创建；同名的调用方共用一个连接池。
+    Session 可以在多个线程间共享。
+    """
+    session = _sessions.get(name)
+    if session is None:
+        with _lock:
+            session = _sessions.get(name)
+            if session is None:
+                session = _sessions[name] = create_session()
+    return session
+
+
+def close_sessions():
+    """关闭所有共享的 Session（进程退出前调用，可选）"""
+    with _lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
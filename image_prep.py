@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+视觉模型的图片输入 - 文件路径、已编码的字节、内存中的 PIL 图像统一转换为上传用的字节
+PDF 渲染出的页面直接在内存里编码，不再先写临时文件再读回来。
+
+上传前按以下设置压缩，减少上传时间和图片 token（环境变量，均可选）：
+    IMAGE_MAX_EDGE：长边最大像素，超过时等比缩小（默认 2048，0 表示不缩放）
+    IMAGE_GRAYSCALE：1 时转为灰度（默认 0）
+    IMAGE_FORMAT：jpeg（默认）/ webp
+    IMAGE_QUALITY：JPEG / WebP 质量（默认 85）
+不需要缩放且原文件比重新编码更小时，直接上传原文件。MIME 类型按文件内容判断，不看扩展名。
+"""
+import base64
+import io
+import os
+
+DEFAULT_MIME = "image/jpeg"
+IMAGE_FORMATS = {"jpeg": ("JPEG", "image/jpeg"), "webp": ("WEBP", "image/webp")}
+DEFAULT_MAX_EDGE = 2048
+DEFAULT_QUALITY = 85
+
+# 文件头 → MIME 类型
+_SIGNATURES = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"BM", "image/bmp"),
+    (b"II*\x00", "image/tiff"),
+    (b"MM\x00*", "image/tiff"),
+)
+# 视觉模型普遍支持、可以原样上传的格式
+_UPLOADABLE_MIMES = ("image/jpeg", "image/png", "image/webp")
+
+
+def load_image_prep(max_edge=None, grayscale=None, image_format=None, quality=None):
+    """
+    读取压缩设置，优先级：参数 > 环境变量 > 默认值。
+    :return: {"max_edge", "grayscale", "format", "quality"}
+    """
+    image_format = (image_format or os.environ.get("IMAGE_FORMAT") or "jpeg").lower()
+    if image_format not in IMAGE_FORMATS:
+        print(f"⚠️ 不支持的 IMAGE_FORMAT {image_format}，改用 jpeg")
+        image_format = "jpeg"
+    if grayscale is None:
+        grayscale = os.environ.get("IMAGE_GRAYSCALE", "0").lower() in ("1", "true", "yes", "on")
+    return {
+        "max_edge": int(max_edge if max_edge is not None else os.environ.get("IMAGE_MAX_EDGE", DEFAULT_MAX_EDGE)),
+        "grayscale": grayscale,
+        "format": image_format,
+        "quality": int(quality if quality is not None else os.environ.get("IMAGE_QUALITY", DEFAULT_QUALITY)),
+    }
+
+
+def sniff_mime(data):
+    """按文件头判断图片的 MIME 类型，无法识别时返回 None"""
+    head = bytes(data[:12])
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    for signature, mime in _SIGNATURES:
+        if head.startswith(signature):
+            return mime
+    return None
+
+
+def _is_pil_image(source):
+    try:
+        from PIL import Image
+    except ImportError:
+        return False
+    return isinstance(source, Image.Image)
+
+
+def _read_source(source):
+    """路径 / 字节输入读成字节；PIL 图像返回 None"""
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            return f.read()
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return bytes(source)
+    if _is_pil_image(source):
+        return None
+    raise TypeError(f"不支持的图片输入类型: {type(source).__name__}")
+
+
+def encode_image(source, mime=None):
+    """
+    把图片转换为字节，不做压缩。
+
+    :param source: 图片文件路径、已编码的图片字节（bytes / bytearray / memoryview），或 PIL 图像。
+    :param mime: 指定 MIME 类型；默认按文件内容判断，PIL 图像编码为 JPEG。
+    :return: (data, mime)
+    """
+    data = _read_source(source)
+    if data is None:
+        return _save(source, "jpeg", DEFAULT_QUALITY), "image/jpeg"
+    return data, mime or sniff_mime(data) or DEFAULT_MIME
+
+
+def open_image(source):
+    """转换为 PIL 图像（供直接接收图像对象的 SDK 使用），PIL 图像原样返回"""
+    if _is_pil_image(source):
+        return source
+    from PIL import Image
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return Image.open(io.BytesIO(source))
+    return Image.open(source)
+
+
+def _save(image, image_format, quality):
+    """编码为 JPEG / WebP；带透明通道或调色板的图像先铺白底转为 RGB"""
+    from PIL import Image
+
+    if image.mode not in ("RGB", "L"):
+        rgba = image.convert("RGBA")
+        image = Image.new("RGB", rgba.size, (255, 255, 255))
+        image.paste(rgba, mask=rgba.getchannel("A"))
+    buffer = io.BytesIO()
+    image.save(buffer, format=IMAGE_FORMATS[image_format][0], quality=quality)
+    return buffer.getvalue()
+
+
+def prepare_image(source, options=None):
+    """
+    按压缩设置准备上传用的图片。
+
+    :param source: 图片文件路径、已编码的图片字节，或 PIL 图像。
+    :param options: load_image_prep 的结果，默认读取环境变量。
+    :return: (data, mime, stats)。stats 为 {"original_bytes", "bytes", "saved_bytes", "size", "mime", "reencoded"}，
+             original_bytes 对 PIL 图像为解码后的内存大小。
+    """
+    from PIL import Image, ImageOps
+
+    options = options or load_image_prep()
+    original = _read_source(source)
+    try:
+        image = source if original is None else Image.open(io.BytesIO(original))
+        # 手机照片的方向保存在 EXIF 里，重新编码会丢掉 EXIF，先把像素转正
+        image = ImageOps.exif_transpose(image) if original is not None else image
+    except Exception:
+        # Pillow 打不开的图片原样上传
+        mime = sniff_mime(original) or DEFAULT_MIME
+        return original, mime, {"original_bytes": len(original), "bytes": len(original), "saved_bytes": 0,
+                                "size": None, "mime": mime, "reencoded": False}
+
+    original_mime = sniff_mime(original) if original is not None else None
+    resize = options["max_edge"] and max(image.size) > options["max_edge"]
+    grayscale = options["grayscale"] and image.mode != "L"
+    if resize:
+        image = image.copy()
+        image.thumbnail((options["max_edge"], options["max_edge"]), Image.LANCZOS)
+    if grayscale:
+        image = image.convert("L")
+
+    data = _save(image, options["format"], options["quality"])
+    mime = IMAGE_FORMATS[options["format"]][1]
+    reencoded = True
+    if (original is not None and not resize and not grayscale and original_mime in _UPLOADABLE_MIMES
+            and len(original) <= len(data)):
+        # 原文件已经足够小，重新编码反而更大
+        data, mime, reencoded = original, original_mime, False
+
+    original_bytes = len(original) if original is not None else image.width * image.height * len(image.getbands())
+    stats = {"original_bytes": original_bytes, "bytes": len(data), "saved_bytes": original_bytes - len(data),
+             "size": image.size, "mime": mime, "reencoded": reencoded}
+    return data, mime, stats
+
+
+def prepare_image_base64(source, options=None):
+    """同 prepare_image，返回 (base64 字符串, mime, stats)"""
+    data, mime, stats = prepare_image(source, options)
+    return base64.b64encode(data).decode('utf-8'), mime, stats
+
+
+def data_url(encoded, mime):
+    """data:<mime>;base64,... 形式，用于 OpenAI 的 image_url"""
+    return f"data:{mime};base64,{encoded}"
+
+
+def format_prep_stats(stats):
+    """日志里显示的压缩效果，如 “图片 3.2 MB → 412.0 KB（节省 87%），1536x2048 image/jpeg”"""
+    def size(n):
+        return f"{n / 1024 / 1024:.1f} MB" if n >= 1024 * 1024 else f"{n / 1024:.1f} KB"
+
+    saved = stats["saved_bytes"] / stats["original_bytes"] * 100 if stats["original_bytes"] else 0
+    dims = f"{stats['size'][0]}x{stats['size'][1]} " if stats["size"] else ""
+    return f"图片 {size(stats['original_bytes'])} → {size(stats['bytes'])}（节省 {saved:.0f}%），{dims}{stats['mime']}"
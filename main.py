@@ -15,6 +15,7 @@ import sys
 
 from invoice_rename_config import FieldSelector, fields
 from rename_function import run_main_ui_local
+from warmup import Warmup
 
 def load_config_to_environ(config_file: str = "config.json") -> None:
     """读 config.json；找不到就 用.env """
@@ -43,8 +44,12 @@ def load_config_to_environ(config_file: str = "config.json") -> None:
 def start_config():
     # 存放json配置的路径
     # load_config_to_environ()    # 用.env 可以注释这行
+
+    # 用户选择字段期间，在后台加载 OCR 模型和 AI 客户端
+    warmup = Warmup().start()
+
     def on_config_confirm(cfg):
-        run_main_ui_local(cfg)
+        run_main_ui_local(cfg, warmup)
 
     app = FieldSelector(fields, on_confirm=on_config_confirm)
     app.mainloop()
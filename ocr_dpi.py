@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+OCR 渲染分辨率策略 - 先低分辨率识别，不够好的页面再用高分辨率重来
+大多数发票 150 dpi 就能识别清楚，像素只有 300 dpi 的四分之一；
+adaptive 模式下先按 OCR_LOW_DPI 渲染，以下情况才按 OCR_HIGH_DPI 重新渲染该页：
+    置信度：该页识别结果的平均置信度低于 OCR_MIN_CONFIDENCE
+    字段覆盖：整个文件识别完后，需要的字段找到的比例低于 OCR_MIN_COVERAGE，
+              并且该页的置信度低于 OCR_COVERAGE_MAX_CONFIDENCE（很多收据本来就缺某些字段，
+              识别得很清楚却找不到字段时，高分辨率也找不到，不升级）
+fixed 模式始终按 OCR_HIGH_DPI 渲染（原来的行为）
+
+按字段覆盖升级需要再调用一次付费接口（视觉模型）的场景没有置信度可用，默认不升级；
+OCR_PAID_ESCALATIONS 设为 N 时，每次运行最多对 N 页重新调用。
+
+环境变量 OCR_DPI_MODE：adaptive（默认）/ fixed
+"""
+import os
+
+DPI_MODES = ("adaptive", "fixed")
+DEFAULT_LOW_DPI = 150
+DEFAULT_HIGH_DPI = 300
+DEFAULT_MIN_CONFIDENCE = 0.85
+DEFAULT_MIN_COVERAGE = 0.5      # 找到的字段不到一半时才考虑升级
+DEFAULT_COVERAGE_MAX_CONFIDENCE = 0.95
+DEFAULT_PAID_ESCALATIONS = 0    # 付费接口默认不重新调用
+
+
+def load_ocr_dpi(mode=None, low=None, high=None, min_confidence=None, min_coverage=None,
+                 coverage_max_confidence=None, paid_escalations=None):
+    """
+    读取分辨率策略，优先级：参数 > 环境变量 > 默认值。
+    :return: {"mode", "low", "high", "min_confidence", "min_coverage", "coverage_max_confidence",
+              "paid_escalations"}
+    """
+    mode = (mode or os.environ.get("OCR_DPI_MODE") or "adaptive").lower()
+    if mode not in DPI_MODES:
+        print(f"⚠️ 不支持的 OCR_DPI_MODE {mode}，改用 adaptive")
+        mode = "adaptive"
+    policy = {
+        "mode": mode,
+        "low": int(low if low is not None else os.environ.get("OCR_LOW_DPI", DEFAULT_LOW_DPI)),
+        "high": int(high if high is not None else os.environ.get("OCR_HIGH_DPI", DEFAULT_HIGH_DPI)),
+        "min_confidence": float(min_confidence if min_confidence is not None
+                                else os.environ.get("OCR_MIN_CONFIDENCE", DEFAULT_MIN_CONFIDENCE)),
+        "min_coverage": float(min_coverage if min_coverage is not None
+                              else os.environ.get("OCR_MIN_COVERAGE", DEFAULT_MIN_COVERAGE)),
+        "coverage_max_confidence": float(
+            coverage_max_confidence if coverage_max_confidence is not None
+            else os.environ.get("OCR_COVERAGE_MAX_CONFIDENCE", DEFAULT_COVERAGE_MAX_CONFIDENCE)),
+        "paid_escalations": int(paid_escalations if paid_escalations is not None
+                                else os.environ.get("OCR_PAID_ESCALATIONS", DEFAULT_PAID_ESCALATIONS)),
+    }
+    if policy["low"] >= policy["high"]:
+        # 低分辨率不低于高分辨率时没有升级的意义
+        policy["mode"] = "fixed"
+    return policy
+
+
+def fixed_dpi(dpi):
+    """固定分辨率的策略（调用方显式指定 dpi 时使用）"""
+    return {"mode": "fixed", "low": dpi, "high": dpi, "min_confidence": 0.0, "min_coverage": 0.0,
+            "coverage_max_confidence": 0.0, "paid_escalations": 0}
+
+
+def first_dpi(policy):
+    """第一遍渲染用的分辨率"""
+    return policy["low"] if policy["mode"] == "adaptive" else policy["high"]
+
+
+def needs_escalation(policy, confidence=None, coverage=None):
+    """
+    是否需要按高分辨率重新渲染。
+    :param confidence: 平均置信度，没有时不升级（字段覆盖率低也不升级）。
+    :param coverage: 字段覆盖率（0~1），没有时只按置信度判断。
+    :return: 升级原因 "confidence" / "coverage"，不需要时为 None。
+    """
+    if policy["mode"] != "adaptive" or confidence is None:
+        return None
+    if confidence < policy["min_confidence"]:
+        return "confidence"
+    if coverage is not None and coverage < policy["min_coverage"] \
+            and confidence < policy["coverage_max_confidence"]:
+        return "coverage"
+    return None
+
+
+def needs_paid_escalation(policy, coverage, used):
+    """
+    没有置信度的付费识别（视觉模型）是否按高分辨率重新调用一次：
+    只在 OCR_PAID_ESCALATIONS 开启、还没用完次数、并且字段覆盖率低于 OCR_MIN_COVERAGE 时。
+    :param used: 本次运行已经重新调用的页数。
+    """
+    return (policy["mode"] == "adaptive" and used < policy["paid_escalations"]
+            and coverage is not None and coverage < policy["min_coverage"])
+
+
+def field_coverage(values, fields):
+    """字段覆盖率：fields 中值非空的比例；fields 为空时返回 None"""
+    if not fields:
+        return None
+    return sum(1 for field in fields if values.get(field)) / len(fields)
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+结构化 OCR 结果 - 保留每一行的文字、位置框和置信度
+OCR 之后先用本地正则提取字段，字段齐全且所在行的置信度都够高时直接使用，
+只有字段缺失或置信度低时才调用 LLM。
+
+环境变量 OCR_FIELD_MIN_CONFIDENCE：字段所在行的最低置信度，低于它的字段交给 LLM 复核
+"""
+import os
+
+DEFAULT_FIELD_MIN_CONFIDENCE = 0.9
+
+
+def load_field_min_confidence(value=None):
+    """读取字段置信度阈值，参数优先，其次环境变量 OCR_FIELD_MIN_CONFIDENCE"""
+    return float(value if value is not None
+                 else os.environ.get("OCR_FIELD_MIN_CONFIDENCE", DEFAULT_FIELD_MIN_CONFIDENCE))
+
+
+class OcrLine:
+    """一行识别结果：文字、四个角点的位置框 [[x, y], ...] 和置信度"""
+
+    __slots__ = ("text", "box", "confidence")
+
+    def __init__(self, text, box=None, confidence=1.0):
+        self.text = text
+        self.box = box
+        self.confidence = confidence
+
+    @classmethod
+    def from_paddle(cls, line):
+        """PaddleOCR 的一行结果：[box, (text, score)]"""
+        box, (text, score) = line[0], line[1]
+        return cls(text, [[float(x), float(y)] for x, y in box], float(score))
+
+    def to_dict(self):
+        return {"text": self.text, "box": self.box, "confidence": round(self.confidence, 4)}
+
+    def __repr__(self):
+        return f"OcrLine({self.text!r}, confidence={self.confidence:.3f})"
+
+
+class OcrResult:
+    """
+    一个文件的 OCR 结果，按页保存 OcrLine。
+    text 与原来 extract_from_path 返回的文本一致：行之间换行，页之间空一行。
+    """
+
+    def __init__(self, pages=None, error=None):
+        self.pages = pages if pages is not None else []
+        # 打开 / 渲染文件失败时的错误描述，此时 text 返回该描述（与原来的行为一致）
+        self.error = error
+
+    @property
+    def lines(self):
+        return [line for page in self.pages for line in page]
+
+    @property
+    def text(self):
+        if self.error:
+            return self.error
+        return "\n\n".join("\n".join(line.text for line in page) for page in self.pages)
+
+    @property
+    def confidence(self):
+        """所有行的平均置信度；没有识别出文字时为 0"""
+        lines = self.lines
+        return sum(line.confidence for line in lines) / len(lines) if lines else 0.0
+
+    def value_confidence(self, value):
+        """
+        字段值的置信度：包含该值的行中置信度最低的一行。
+        值跨行（OCR 把它拆成了几行）时取被拆开的各行中最低的；找不到时返回 None。
+        """
+        if not value:
+            return None
+        compact = "".join(value.split())
+        scores = [line.confidence for line in self.lines if compact in "".join(line.text.split())]
+        if not scores:
+            scores = [line.confidence for line in self.lines
+                      if len(line.text.strip()) > 1 and "".join(line.text.split()) in compact]
+        return min(scores) if scores else None
+
+    def low_confidence_fields(self, field_values, threshold):
+        """置信度低于 threshold 的字段名列表（找不到所在行的字段不算低置信度）"""
+        low = []
+        for field, value in field_values.items():
+            confidence = self.value_confidence(value)
+            if confidence is not None and confidence < threshold:
+                low.append(field)
+        return low
+
+    def to_dict(self):
+        return {"pages": [[line.to_dict() for line in page] for page in self.pages], "error": self.error}
@@ -4,12 +4,14 @@ OpenAI GPT-4o Vision 提取器
 支持多语言收据/发票识别（中英日文）
 """
 import os
-import base64
 from openai import OpenAI
 from PIL import Image
 from typing import Dict
 import io
 import json
+from circuit_breaker import OPEN, get_breaker, is_provider_error
+from image_prep import data_url, format_prep_stats, load_image_prep, prepare_image_base64
+from receipt_schema import field_guide, openai_response_format, parse_receipts, record_parse
 
 
 class OpenAIVisionExtractor:
@@ -18,67 +20,57 @@ class OpenAIVisionExtractor:
     直接理解图片并提取结构化数据
     """
 
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, breaker=None):
         """
         初始化 OpenAI Vision
 
         :param api_key: OpenAI API Key
+        :param breaker: 熔断器，默认使用共享的 "openai" 熔断器（与提取路由共用）
         """
         self.client = OpenAI(api_key=api_key)
+        self.breaker = breaker or get_breaker("openai")
+        # 结构化输出：按共用的收据 Schema 约束返回 {"receipts": [...]}
+        self.response_format = openai_response_format()
+        # 上传前的图片压缩设置（长边、灰度、格式、质量），见 image_prep.load_image_prep
+        self.image_prep = load_image_prep()
         print(f"🔧 初始化 OpenAI GPT-4o Vision...")
         print("   ✅ 初始化成功\n")
 
-    def _encode_image(self, image_path: str) -> str:
-        """将图片转换为base64编码"""
-        with open(image_path, 'rb') as f:
-            return base64.b64encode(f.read()).decode('utf-8')
+    def _encode_image(self, image) -> str:
+        """按压缩设置准备图片并转换为 data URL（base64 编码），见 image_prep.prepare_image"""
+        encoded, mime, stats = prepare_image_base64(image, self.image_prep)
+        print(f"  🖼️ {format_prep_stats(stats)}")
+        return data_url(encoded, mime)
 
-    def extract_from_image(self, image_path: str) -> Dict:
+    def extract_from_image(self, image) -> Dict:
         """
         从图片中提取收据信息（支持多收据）
 
-        :param image_path: 图片路径
+        :param image: 图片路径、已编码的图片字节或内存中的 PIL 图像
         :return: 提取的信息字典或字典列表
         """
-        # 构建提示词 - 支持多收据识别
-        prompt = """
-请详细分析这张图片，识别其中的收据/发票信息。
-
-**重要说明：**
-- 如果图片中有多个收据/发票，请返回JSON数组格式：[{收据1}, {收据2}, ...]
-- 如果只有一个收据/发票，返回单个JSON对象：{收据信息}
-
-返回JSON格式，每个收据包含以下字段：
-{
-  "seller_name": "店铺或公司名称（保留原语言）",
-  "issue_date": "日期（YYYY-MM-DD格式）",
-  "issue_time": "时间（如果有，HH:MM格式）",
-  "invoice_number": "发票或收据编号（如果有）",
-  "total_amount": "总金额（仅数字）",
-  "subtotal": "小计金额",
-  "tax": "税额",
-  "currency": "货币符号（如¥、$、€等）",
-  "payment_method": "支付方式（现金/信用卡/支付宝等）",
-  "items": "商品列表（如果有多个商品，用分号分隔）"
-}
-
-支持中文、英文、日文识别。如果某项信息不存在，设为null。
-
-**示例：**
-单个收据：{"seller_name": "星巴克", "total_amount": "50", ...}
-多个收据：[{"seller_name": "星巴克", ...}, {"seller_name": "7-11", ...}]
-
-只返回JSON，不要其他解释文字。
+        # 构建提示词 - 支持多收据识别；输出结构由 response_format 的 JSON Schema 约束，这里只说明字段含义
+        prompt = f"""
+识别这张图片中的收据/发票信息。图片中有多张收据/发票时，receipts 中每张一条。
+支持中文、英文、日文识别。某项信息不存在时设为 null。
+
+字段说明：
+{field_guide()}
 """
 
-        # 编码图片
-        base64_image = self._encode_image(image_path)
+        # 编码图片（在内存中完成，不经过临时文件）
+        image_url = self._encode_image(image)
 
         # 添加重试机制
         import time
         max_retries = 3
 
         for attempt in range(max_retries):
+            # 服务商连续失败时熔断，直接返回错误，不再重试和等待
+            if not self.breaker.allow():
+                print(f"  🔌 OpenAI 熔断中，约 {self.breaker.retry_in():.0f} 秒后试探恢复，跳过调用")
+                # circuit_open：一次请求都没有发出（提取路由据此不计入延迟和错误率统计）
+                return [{"error": "OpenAI 熔断中", "circuit_open": attempt == 0}]
             try:
                 # 调用 GPT-4o Vision API
                 response = self.client.chat.completions.create(
@@ -91,36 +83,35 @@ class OpenAIVisionExtractor:
                                 {
                                     "type": "image_url",
                                     "image_url": {
-                                        "url": f"data:image/jpeg;base64,{base64_image}"
+                                        "url": image_url
                                     }
                                 }
                             ]
                         }
                     ],
-                    max_tokens=2000  # 增加token以支持多收据
+                    max_tokens=2000,  # 增加token以支持多收据
+                    response_format=self.response_format
                 )
 
-                # 提取响应
-                content = response.choices[0].message.content
-
-                # 解析JSON（支持数组或对象）
-                import re
-                json_match = re.search(r'\[.*\]|\{.*\}', content, re.DOTALL)
-                if json_match:
-                    json_str = json_match.group(0)
-                    result = json.loads(json_str)
-
-                    # 如果是单个对象，转换为数组
-                    if isinstance(result, dict):
-                        return [result]
-                    elif isinstance(result, list):
-                        return result
-                    else:
-                        return [{"raw_text": content}]
-                else:
-                    return [{"raw_text": content}]
+                self.breaker.record_success()
+
+                # 结构化输出一定是合法 JSON；被截断（finish_reason=length）或拒答时没有完整内容
+                choice = response.choices[0]
+                if choice.finish_reason == "length" or getattr(choice.message, "refusal", None):
+                    record_parse("openai", False)
+                    print(f"  ⚠️ OpenAI 输出不完整（{choice.finish_reason}）")
+                    return [{"raw_text": choice.message.content or choice.message.refusal}]
+                return parse_receipts("openai", choice.message.content)
 
             except Exception as e:
+                if is_provider_error(e):
+                    self.breaker.record_failure()
+                    if self.breaker.state == OPEN:
+                        print(f"  ❌ API调用失败，OpenAI 已熔断，不再重试")
+                        return [{"error": str(e)}]
+                elif getattr(e, "status_code", None) is not None:
+                    # 接口有响应（如 400），服务是通的
+                    self.breaker.record_success()
                 # 如果不是最后一次尝试，等待后重试
                 if attempt < max_retries - 1:
                     print(f"  ⚠️ API调用失败，{2**attempt}秒后重试... (尝试 {attempt + 1}/{max_retries})")
@@ -131,14 +122,14 @@ class OpenAIVisionExtractor:
                     print(f"  ❌ API调用失败，已重试{max_retries}次")
                     return [{"error": str(e)}]
 
-    def extract_with_deep_structure(self, image_path: str) -> Dict:
+    def extract_with_deep_structure(self, image) -> Dict:
         """
         深度结构化提取
 
-        :param image_path: 图片路径
+        :param image: 图片路径、已编码的图片字节或内存中的 PIL 图像
         :return: 详细的信息字典
         """
-        return self.extract_from_image(image_path)
+        return self.extract_from_image(image)
 
 
 # 测试代码
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+隔离的 PDF 解析进程池 - 一个损坏或超大的 PDF 不会卡住整批任务
+每个工作进程由一个监督线程负责：
+    超时：超过 PARSE_TIMEOUT 秒没有返回，杀掉进程（连同 pdftoppm 等子进程）并重启，该文件报超时
+    内存：进程 RSS 超过 PARSE_MAX_RSS_MB，立即杀掉并重启，该文件报内存超限
+    回收：每个进程处理 PARSE_MAX_TASKS 个文件后正常退出并换一个新进程，避免内存碎片累积
+提交接口与 concurrent.futures 相同，submit 返回 Future
+"""
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+from concurrent.futures import Future
+
+DEFAULT_TIMEOUT = 120           # 单个文件的最长处理时间（秒）
+DEFAULT_MAX_RSS_MB = 2048       # 单个工作进程的内存上限
+DEFAULT_MAX_TASKS = 200         # 每个工作进程处理多少个文件后回收
+DEFAULT_FILE_TIMEOUT = 600      # 单个文件 OCR（逐页渲染 + 识别）的总时长上限（秒）
+_POLL_INTERVAL = 0.1            # 等待结果时检查超时 / 内存的间隔（有结果会立即返回）
+# forkserver 服务进程启动时预先导入的模块，之后 fork 出的工作进程直接继承，不用每次重新导入
+_FORKSERVER_PRELOAD = ["pdfplumber", "rename_function", "chat_ai_rename"]
+
+
+def _mp_context():
+    """
+    工作进程的启动方式。进程在监督线程里按需启动，此时其他线程可能正持有导入锁等，
+    直接 fork 会把锁的状态复制到子进程里导致死锁；所以优先用 forkserver（从单线程的服务进程 fork），
+    不支持时用 spawn。
+    """
+    if "forkserver" not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("spawn")
+    context = multiprocessing.get_context("forkserver")
+    # 只在服务进程启动前生效；导入失败的模块会被忽略
+    context.set_forkserver_preload(_FORKSERVER_PRELOAD)
+    return context
+
+
+class ParseTimeoutError(TimeoutError):
+    """文件处理超时，工作进程已被杀掉"""
+
+
+class ParseMemoryError(MemoryError):
+    """工作进程内存超限，已被杀掉"""
+
+
+class WorkerCrashedError(RuntimeError):
+    """工作进程意外退出（段错误等）"""
+
+
+POOL_ERRORS = (ParseTimeoutError, ParseMemoryError, WorkerCrashedError)
+
+
+def load_parse_limits(timeout=None, max_rss_mb=None, max_tasks=None, file_timeout=None):
+    """
+    读取进程池限制，优先级：参数 > 环境变量（PARSE_TIMEOUT / PARSE_MAX_RSS_MB / PARSE_MAX_TASKS /
+    PARSE_FILE_TIMEOUT）> 默认值。值为 0 表示不限制。
+    timeout 限制的是单次调用（渲染一页），file_timeout 限制一个文件所有页面加起来的时间。
+    """
+    return {
+        "timeout": float(timeout if timeout is not None else os.environ.get("PARSE_TIMEOUT", DEFAULT_TIMEOUT)),
+        "max_rss_mb": int(max_rss_mb if max_rss_mb is not None
+                          else os.environ.get("PARSE_MAX_RSS_MB", DEFAULT_MAX_RSS_MB)),
+        "max_tasks": int(max_tasks if max_tasks is not None else os.environ.get("PARSE_MAX_TASKS", DEFAULT_MAX_TASKS)),
+        "file_timeout": float(file_timeout if file_timeout is not None
+                              else os.environ.get("PARSE_FILE_TIMEOUT", DEFAULT_FILE_TIMEOUT)),
+    }
+
+
+def process_rss(pid):
+    """读取进程当前的常驻内存（字节）：Linux 读 /proc，其他系统用 psutil；读不到时返回 None"""
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    try:
+        import psutil
+        return psutil.Process(pid).memory_info().rss
+    except Exception:
+        return None
+
+
+_rss_warned = False
+
+
+def _warn_if_rss_unavailable(limits):
+    """读不到进程内存时（非 Linux 且没有安装 psutil）内存上限和按内存回收都不生效，提示一次"""
+    global _rss_warned
+    if _rss_warned or not limits["max_rss_mb"] or process_rss(os.getpid()) is not None:
+        return
+    _rss_warned = True
+    print("⚠️ 无法读取进程内存（请 pip install psutil），PARSE_MAX_RSS_MB 内存上限不会生效")
+
+
+def _worker_main(conn):
+    """工作进程：循环接收 (func, args, kwargs)，返回 (是否成功, 结果或异常)"""
+    # 自成一个进程组，超时时可以连同 pdftoppm 等子进程一起杀掉
+    if hasattr(os, "setsid"):
+        try:
+            os.setsid()
+        except OSError:
+            pass
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, OSError):
+            break
+        if job is None:
+            break
+        func, args, kwargs = job
+        try:
+            result = (True, func(*args, **kwargs))
+        except BaseException as e:
+            result = (False, e)
+        try:
+            conn.send(result)
+        except Exception as e:
+            # 结果或异常无法序列化时，只传回文字描述
+            conn.send((False, RuntimeError(f"{type(e).__name__}: {e}; 原始结果: {result[1]!r}")))
+
+
+class _WorkerSlot:
+    """一个工作进程及其监督逻辑，只被一个监督线程使用"""
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.process = None
+        self.conn = None
+        self.tasks = 0
+
+    def _start(self):
+        context = _mp_context()
+        parent_conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.conn = parent_conn
+        self.tasks = 0
+
+    def stop(self):
+        """正常退出（回收）"""
+        if self.process is None:
+            return
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join(5)
+        if self.process.is_alive():
+            self.kill()
+        else:
+            self._discard()
+
+    def kill(self):
+        """强制结束进程及其进程组"""
+        if self.process is None:
+            return
+        try:
+            if hasattr(os, "killpg"):
+                os.killpg(self.process.pid, signal.SIGKILL)
+            else:
+                self.process.kill()
+        except (OSError, ProcessLookupError):
+            self.process.kill()
+        self.process.join(5)
+        self._discard()
+
+    def _discard(self):
+        try:
+            self.conn.close()
+        except OSError:
+            pass
+        self.process = None
+        self.conn = None
+
+    def call(self, func, args, kwargs):
+        limits = self.pool.limits
+        max_rss = limits["max_rss_mb"] * 1024 * 1024
+        if self.process is None:
+            self._start()
+        try:
+            self.conn.send((func, args, kwargs))
+        except OSError:
+            # 进程在空闲时已经退出（被 OOM killer 杀掉、段错误等）：换一个新进程再发送一次
+            self.kill()
+            self.pool._count("crashes")
+            self._start()
+            try:
+                self.conn.send((func, args, kwargs))
+            except OSError:
+                self.kill()
+                raise WorkerCrashedError("解析进程启动后意外退出")
+
+        deadline = time.monotonic() + limits["timeout"] if limits["timeout"] else None
+        while not self.conn.poll(_POLL_INTERVAL):
+            if not self.process.is_alive():
+                code = self.process.exitcode
+                self._discard()
+                self.pool._count("crashes")
+                raise WorkerCrashedError(f"解析进程意外退出（exitcode={code}）")
+            if deadline is not None and time.monotonic() > deadline:
+                self.kill()
+                self.pool._count("timeouts")
+                raise ParseTimeoutError(f"处理超时（超过 {limits['timeout']:g} 秒），已跳过")
+            if max_rss and (process_rss(self.process.pid) or 0) > max_rss:
+                self.kill()
+                self.pool._count("memory_kills")
+                raise ParseMemoryError(f"解析进程内存超过 {limits['max_rss_mb']} MB，已跳过")
+
+        try:
+            ok, value = self.conn.recv()
+        except (EOFError, OSError):
+            self._discard()
+            self.pool._count("crashes")
+            raise WorkerCrashedError("解析进程意外退出")
+        self.tasks += 1
+        if (limits["max_tasks"] and self.tasks >= limits["max_tasks"]) or (
+                max_rss and (process_rss(self.process.pid) or 0) > max_rss * 0.8):
+            # 处理完成但进程已经用了较多内存，或处理数量到了上限：换一个新进程
+            self.stop()
+            self.pool._count("recycled")
+        if ok:
+            return value
+        raise value
+
+
+class ParsePool:
+    """
+    常驻的隔离进程池，用法与 ProcessPoolExecutor 相同（submit / shutdown）。
+    工作进程按需启动，跨文件复用。
+    """
+
+    def __init__(self, max_workers, timeout=None, max_rss_mb=None, max_tasks=None):
+        """
+        :param max_workers: 工作进程数。
+        :param timeout: 单个文件的最长处理时间（秒），默认读取环境变量 PARSE_TIMEOUT。
+        :param max_rss_mb: 单个工作进程的内存上限，默认读取环境变量 PARSE_MAX_RSS_MB。
+        :param max_tasks: 每个工作进程处理多少个文件后回收，默认读取环境变量 PARSE_MAX_TASKS。
+        """
+        self.limits = load_parse_limits(timeout, max_rss_mb, max_tasks)
+        _warn_if_rss_unavailable(self.limits)
+        self._queue = queue.Queue()
+        self._stats = {"tasks": 0, "timeouts": 0, "memory_kills": 0, "crashes": 0, "recycled": 0}
+        self._lock = threading.Lock()
+        self._shutdown = False
+        self._slots = [_WorkerSlot(self) for _ in range(max(1, max_workers))]
+        self._threads = [threading.Thread(target=self._supervise, args=(slot,), name=f"parse-{i}", daemon=True)
+                         for i, slot in enumerate(self._slots)]
+        for thread in self._threads:
+            thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.shutdown()
+
+    def submit(self, func, *args, **kwargs):
+        """func 及参数、返回值都必须可以 pickle（模块级函数）"""
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError("cannot schedule new futures after shutdown")
+            future = Future()
+            self._queue.put((future, func, args, kwargs))
+        return future
+
+    def _supervise(self, slot):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            future, func, args, kwargs = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            self._count("tasks")
+            try:
+                result = slot.call(func, args, kwargs)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+        slot.stop()
+
+    def _count(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            if self._shutdown:
+                return
+            self._shutdown = True
+            for _ in self._threads:
+                self._queue.put(None)
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, **self.limits}
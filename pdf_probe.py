@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+PDF 文本层探测 - 不做版面分析，只看 PDF 结构，几毫秒内判断文件该走哪条路
+    text:    有字体资源和文字绘制指令，走文本提取
+    scanned: 没有文字绘制指令（扫描件 / 整页图片），直接走 OCR
+    hybrid:  整页图片上叠加了文字层（扫描后做过 OCR 的 PDF 等），先走文本提取，不行再 OCR
+    image:   图片文件，直接走 OCR
+    unknown: 探测失败，按原来的顺序先走文本提取
+"""
+import re
+import time
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif')
+TEXT_KINDS = ("text", "hybrid", "unknown")   # 这些类型先走文本提取
+
+# 文字绘制指令 Tj / TJ，前面紧跟字符串 ) / > 或数组 ]
+_TEXT_OP_RE = re.compile(rb"[)>\]]\s*T[jJ]\b")
+# 整页图片判定：宽高比与页面相差不超过 15%，且像素宽度不小于页面宽度（点）的一半
+_ASPECT_TOLERANCE = 0.15
+
+
+def _resolve(obj):
+    from pdfminer.pdftypes import resolve1
+    return resolve1(obj)
+
+
+def _name(obj):
+    """PSLiteral → 字符串"""
+    return getattr(obj, "name", obj)
+
+
+def _count_text_ops(streams):
+    count = 0
+    for stream in streams:
+        stream = _resolve(stream)
+        try:
+            count += len(_TEXT_OP_RE.findall(stream.get_data()))
+        except Exception:
+            continue
+    return count
+
+
+def _scan_resources(resources, page_size, stats, depth=0):
+    """统计字体、图片 XObject，并递归进入表单 XObject（最多两层）"""
+    resources = _resolve(resources) or {}
+    fonts = _resolve(resources.get("Font")) or {}
+    stats["fonts"] += len(fonts)
+
+    xobjects = _resolve(resources.get("XObject")) or {}
+    for xobj in xobjects.values():
+        xobj = _resolve(xobj)
+        attrs = getattr(xobj, "attrs", {})
+        subtype = _name(attrs.get("Subtype"))
+        if subtype == "Image":
+            stats["images"] += 1
+            width, height = _resolve(attrs.get("Width")) or 0, _resolve(attrs.get("Height")) or 0
+            page_width, page_height = page_size
+            if width and height and page_width and page_height:
+                same_aspect = abs(width / height - page_width / page_height) <= _ASPECT_TOLERANCE * page_width / page_height
+                if same_aspect and width >= page_width / 2:
+                    stats["full_page_images"] += 1
+        elif subtype == "Form" and depth < 2:
+            stats["text_ops"] += _count_text_ops([xobj])
+            _scan_resources(attrs.get("Resources"), page_size, stats, depth + 1)
+
+
+def probe_pdf(file_path, max_pages=1):
+    """
+    探测 PDF 前几页的结构。
+
+    :param max_pages: 检查的页数，发票一般看第一页就够了。
+    :return: {"kind", "pages", "fonts", "text_ops", "images", "full_page_images", "elapsed_ms"}
+    """
+    start = time.perf_counter()
+    stats = {"kind": "unknown", "pages": 0, "fonts": 0, "text_ops": 0, "images": 0, "full_page_images": 0}
+
+    if file_path.lower().endswith(IMAGE_EXTENSIONS):
+        stats["kind"] = "image"
+    else:
+        try:
+            from pdfminer.pdfdocument import PDFDocument
+            from pdfminer.pdfpage import PDFPage
+            from pdfminer.pdfparser import PDFParser
+
+            with open(file_path, 'rb') as f:
+                document = PDFDocument(PDFParser(f))
+                for page in PDFPage.create_pages(document):
+                    if stats["pages"] >= max_pages:
+                        break
+                    stats["pages"] += 1
+                    x0, y0, x1, y1 = page.mediabox
+                    _scan_resources(page.resources, (abs(x1 - x0), abs(y1 - y0)), stats)
+                    stats["text_ops"] += _count_text_ops(page.contents)
+            stats["kind"] = classify(stats)
+        except Exception as e:
+            stats["error"] = str(e)
+
+    stats["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 2)
+    return stats
+
+
+def classify(stats):
+    """根据结构统计判断类型"""
+    if not stats["pages"]:
+        return "unknown"
+    has_text = stats["fonts"] > 0 and stats["text_ops"] > 0
+    if not has_text:
+        return "scanned"
+    if stats["full_page_images"]:
+        return "hybrid"
+    return "text"
+
+
+def route_for(kind):
+    """探测结果对应的第一个处理阶段"""
+    return "text" if kind in TEXT_KINDS else "ocr"
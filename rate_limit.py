@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+令牌桶限流 - 控制 AI 接口的每分钟请求数(RPM)和每分钟 token 数(TPM)
+同一个限流器可以同时给线程（acquire）和 asyncio 协程（aacquire）使用
+"""
+import asyncio
+import os
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗略估算文本的 token 数：英文/数字约 4 个字符一个 token，中日文约 1 个字一个 token。
+    只用于限流预算，不需要精确。
+    """
+    if not text:
+        return 1
+    ascii_count = sum(1 for c in text if ord(c) < 128)
+    return ascii_count // 4 + (len(text) - ascii_count) + 1
+
+
+def retry_after_seconds(error) -> Optional[float]:
+    """
+    从 429 错误的响应头中读取 Retry-After（支持 retry-after-ms、秒数和 HTTP 日期）。
+
+    :return: 需要等待的秒数；响应里没有给出时返回 None。
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return max(0.0, float(value) / 1000)
+        except ValueError:
+            pass
+
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """
+    连续补充的令牌桶。
+    取令牌时先预约（余额可以为负），再按欠额计算需要等待的时间，这样先到的请求先放行。
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        """
+        :param rate_per_minute: 每分钟补充的令牌数。
+        :param capacity: 桶容量（允许的突发量），默认等于一分钟的配额。
+        """
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float) -> float:
+        """预约 amount 个令牌，返回需要等待的秒数"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class RateLimiter:
+    """
+    组合 RPM 和 TPM 两个令牌桶，并支持在收到 429 后按 Retry-After 暂停所有调用方。
+    两项都不配置时不做任何限制，只在 429 之后暂停。
+    """
+
+    def __init__(self, requests_per_minute: Optional[float] = None, tokens_per_minute: Optional[float] = None):
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "RateLimiter":
+        """从环境变量 LLM_RPM / LLM_TPM 读取配额"""
+        rpm = os.environ.get("LLM_RPM")
+        tpm = os.environ.get("LLM_TPM")
+        return cls(float(rpm) if rpm else None, float(tpm) if tpm else None)
+
+    def pause(self, seconds: float):
+        """在接下来的 seconds 秒内暂停放行（用于遵守 Retry-After）"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def _reserve(self, tokens: int) -> float:
+        wait = 0.0
+        if self.request_bucket:
+            wait = max(wait, self.request_bucket.reserve(1))
+        if self.token_bucket:
+            wait = max(wait, self.token_bucket.reserve(tokens))
+        with self._lock:
+            return max(wait, self._paused_until - time.monotonic())
+
+    def acquire(self, tokens: int = 1) -> float:
+        """阻塞直到可以发出一次消耗 tokens 个 token 的请求，返回实际等待的秒数"""
+        wait = self._reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+        return max(wait, 0.0)
+
+    async def aacquire(self, tokens: int = 1) -> float:
+        """acquire 的协程版本，等待期间不阻塞事件循环"""
+        wait = self._reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return max(wait, 0.0)
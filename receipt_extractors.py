@@ -0,0 +1,485 @@
+#!/usr/bin/env python3
+"""
+统一的收据/发票提取接口 + 按成本和延迟选择后端的路由
+各个提取器的方法名和返回值都不一样（str / dict / list），这里统一为：
+    backend.extract(image) -> [记录, ...]
+image 可以是图片路径、已编码的图片字节或内存中的 PIL 图像（PDF 由调用方按 ocr_dpi 策略逐页渲染，见 generate_excel）；
+每条记录都是同样字段的字典，见 RECORD_FIELDS。
+
+路由：按每个后端实时统计的延迟、错误率和单次调用成本估算先用它的预期成本，最低的先用；
+结果缺少关键字段或调用失败时，按配置的顺序依次换下一个后端。
+每个后端有一个共享的熔断器（circuit_breaker），连续失败后暂时不再路由到它，冷却后放行一次试探。
+
+环境变量（均可选）：
+    EXTRACTOR_CHAIN：参与路由的后端及回退顺序，逗号分隔（默认 openai,gemini_rest,baidu）
+        可选 paddle / easyocr / baidu / openai / gemini_rest / gemini_vision；缺少 API Key 或依赖的后端自动跳过
+    EXTRACTOR_COST_<后端名>：单次调用成本（美元），如 EXTRACTOR_COST_OPENAI=0.005
+    ROUTER_LATENCY_WEIGHT：每秒延迟折算的成本（美元，默认 0.001），越大越偏向快的后端
+
+对冲请求（ROUTER_HEDGE=1 时开启）：第一个后端超过它最近的 p90 延迟还没有返回时，
+同时向下一个后端发一份相同的请求，先返回完整结果的为准。额外成本受两个上限约束：
+    ROUTER_HEDGE_MAX_RATIO：对冲请求占请求数的比例上限（默认 0.1）
+    ROUTER_HEDGE_MAX_COST：对冲累计的额外成本上限（美元，默认 0.5，0 表示不限制）
+"""
+import os
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from circuit_breaker import OPEN, CircuitOpenError, get_breaker
+
+RECORD_FIELDS = ("seller_name", "issue_date", "total_amount", "currency", "invoice_number",
+                 "buyer_name", "tax", "items")
+DEFAULT_CHAIN = "openai,gemini_rest,baidu"
+DEFAULT_LATENCY_WEIGHT = 0.001
+MIN_SAMPLES = 3          # 调用次数少于这个数时用预设的延迟，不用实测值
+EWMA_ALPHA = 0.3         # 延迟和错误率的指数滑动平均系数
+LATENCY_WINDOW = 100     # 计算 p90 用的最近调用数
+HEDGE_MIN_SAMPLES = 5    # 样本少于这个数时，对冲等待时间取预设延迟的两倍
+DEFAULT_HEDGE_MAX_RATIO = 0.1
+DEFAULT_HEDGE_MAX_COST = 0.5
+HEDGE_WORKERS = 8
+
+# 本地正则字段（中文名）→ 统一记录字段
+_TEXT_FIELD_MAP = {"销方名称": "seller_name", "开票日期": "issue_date", "价税合计": "total_amount",
+                   "发票号码": "invoice_number", "购方名称": "buyer_name", "总税额": "tax"}
+_CN_DATE_RE = re.compile(r"(\d{4})\s*年\s*(\d{1,2})\s*月\s*(\d{1,2})\s*日")
+
+
+def normalize_record(data, backend):
+    """
+    把各后端的返回值转换为统一记录：RECORD_FIELDS 中的字段（没有的为 None），
+    加上 backend（来源后端）、raw_text（只有文本时）和 error（失败时）。
+    """
+    data = data if isinstance(data, dict) else {"raw_text": str(data)}
+    record = {field: data.get(field) for field in RECORD_FIELDS}
+    if isinstance(record["items"], list):
+        record["items"] = "; ".join(item.get("name", str(item)) if isinstance(item, dict) else str(item)
+                                    for item in record["items"])
+    for field in ("total_amount", "tax"):
+        if record[field] is not None:
+            record[field] = str(record[field]).replace("¥", "").replace("￥", "").replace(",", "").strip()
+    if record["issue_date"]:
+        m = _CN_DATE_RE.search(str(record["issue_date"]))
+        if m:
+            record["issue_date"] = f"{m.group(1)}-{int(m.group(2)):02d}-{int(m.group(3)):02d}"
+    record["backend"] = backend
+    record["raw_text"] = data.get("raw_text")
+    record["error"] = data.get("error")
+    return record
+
+
+def is_complete(record):
+    """记录是否可用：有金额，并且有商家名称或日期"""
+    return not record.get("error") and bool(record.get("total_amount")) and bool(
+        record.get("seller_name") or record.get("issue_date"))
+
+
+def _record_score(record):
+    return (not record.get("error"), sum(1 for field in RECORD_FIELDS if record.get(field)))
+
+
+def _text_to_record(text, backend):
+    """OCR 文本 → 统一记录：用本地正则提取电子发票的字段"""
+    from rename_function import extract_fields_from_text
+
+    values = extract_fields_from_text(text, list(_TEXT_FIELD_MAP))
+    data = {_TEXT_FIELD_MAP[key]: value for key, value in values.items() if value}
+    if data.get("total_amount"):
+        data["currency"] = "¥"
+    data["raw_text"] = text
+    return normalize_record(data, backend)
+
+
+# --- 后端 ---
+class ReceiptBackend:
+    """
+    后端基类。子类设置 name / cost / prior_latency / env_keys，并实现 _create 和 _extract。
+    提取器在第一次使用时创建。
+    """
+
+    name = ""
+    cost = 0.0               # 单次调用成本（美元），可用 EXTRACTOR_COST_<NAME> 覆盖
+    prior_latency = 5.0      # 没有实测数据时假设的延迟（秒）
+    env_keys = ()            # 需要的环境变量（API Key），缺少时视为不可用
+    thread_safe = True       # 本地 OCR 模型不能多线程同时调用
+    manages_breaker = False  # 提取器自己按每次请求记录熔断器（如 OpenAIVisionExtractor），路由不再重复记录
+
+    def __init__(self):
+        self.cost = float(os.environ.get(f"EXTRACTOR_COST_{self.name.upper()}", self.cost))
+        self.breaker = get_breaker(self.name)
+        self._extractor = None
+        self._error = None
+        self._lock = threading.Lock()
+
+    def unavailable_reason(self):
+        """不可用的原因（缺少 API Key / 依赖），可用时返回 None"""
+        missing = [key for key in self.env_keys if not os.getenv(key)]
+        if missing:
+            return f"缺少环境变量 {', '.join(missing)}"
+        return self._error
+
+    @property
+    def extractor(self):
+        if self._extractor is None:
+            with self._lock:
+                if self._extractor is None:
+                    try:
+                        self._extractor = self._create()
+                    except ImportError as e:
+                        self._error = f"缺少依赖: {e}"
+                        raise
+        return self._extractor
+
+    def extract(self, image):
+        """识别一张图片，返回统一记录列表"""
+        extractor = self.extractor
+        if self.thread_safe:
+            return self._extract(extractor, image)
+        with self._lock:
+            return self._extract(extractor, image)
+
+    def _create(self):
+        raise NotImplementedError
+
+    def _extract(self, extractor, image):
+        raise NotImplementedError
+
+
+class PaddleOcrBackend(ReceiptBackend):
+    name = "paddle"
+    prior_latency = 3.0
+    thread_safe = False
+
+    def _create(self):
+        from chat_ai_rename import ImageOcrExtractor
+        return ImageOcrExtractor()
+
+    def _extract(self, extractor, image):
+        from image_prep import open_image
+        return [_text_to_record(extractor._extract_text_from_single_image(open_image(image)), self.name)]
+
+
+class EasyOcrBackend(ReceiptBackend):
+    name = "easyocr"
+    prior_latency = 4.0
+    thread_safe = False
+
+    def _create(self):
+        from easyocr_extractor import EasyOcrExtractor
+        return EasyOcrExtractor()
+
+    def _extract(self, extractor, image):
+        from image_prep import open_image
+        return [_text_to_record(extractor.extract_from_image(open_image(image)), self.name)]
+
+
+class BaiduBackend(ReceiptBackend):
+    name = "baidu"
+    cost = 0.0015
+    prior_latency = 1.5
+    env_keys = ("BAIDU_OCR_API_KEY", "BAIDU_OCR_SECRET_KEY")
+
+    def _create(self):
+        from baidu_ocr_extractor import BaiduOcrExtractor
+        return BaiduOcrExtractor(os.getenv("BAIDU_OCR_API_KEY"), os.getenv("BAIDU_OCR_SECRET_KEY"))
+
+    def _extract(self, extractor, image):
+        # 先用增值税发票接口，识别不出再用通用票据接口 + 本地正则
+        try:
+            data = extractor.extract_vat_invoice(image)
+        except Exception:
+            data = None
+        if data and any(data.values()):
+            data = dict(data, total_amount=data.get("total_including_tax") or data.get("total_amount"),
+                        tax=data.get("total_tax"), currency="¥")
+            return [normalize_record(data, self.name)]
+        return [_text_to_record(extractor.extract_general_receipt(image), self.name)]
+
+
+class OpenAIVisionBackend(ReceiptBackend):
+    name = "openai"
+    cost = 0.005
+    prior_latency = 8.0
+    env_keys = ("OPENAI_VISION_API_KEY",)
+    manages_breaker = True
+
+    def _create(self):
+        from openai_vision_extractor import OpenAIVisionExtractor
+        return OpenAIVisionExtractor(os.getenv("OPENAI_VISION_API_KEY"), breaker=self.breaker)
+
+    def _extract(self, extractor, image):
+        items = extractor.extract_from_image(image)
+        if any(isinstance(item, dict) and item.get("circuit_open") for item in items):
+            # 提取器的熔断器拒绝了调用，没有发出请求
+            raise CircuitOpenError(f"{self.name} 熔断中")
+        return [normalize_record(item, self.name) for item in items]
+
+
+class GeminiRestBackend(ReceiptBackend):
+    name = "gemini_rest"
+    cost = 0.0005
+    prior_latency = 4.0
+    env_keys = ("GEMINI_API_KEY",)
+
+    def _create(self):
+        from gemini_rest_extractor import GeminiRestExtractor
+        return GeminiRestExtractor(os.getenv("GEMINI_API_KEY"))
+
+    def _extract(self, extractor, image):
+        result = extractor.extract_from_image(image)
+        return [normalize_record(item, self.name) for item in (result if isinstance(result, list) else [result])]
+
+
+class GeminiVisionBackend(GeminiRestBackend):
+    name = "gemini_vision"
+
+    def _create(self):
+        from gemini_vision_extractor import GeminiVisionExtractor
+        return GeminiVisionExtractor(os.getenv("GEMINI_API_KEY"))
+
+    def _extract(self, extractor, image):
+        return [normalize_record(extractor.extract_from_image_path(image), self.name)]
+
+
+BACKENDS = {cls.name: cls for cls in (PaddleOcrBackend, EasyOcrBackend, BaiduBackend, OpenAIVisionBackend,
+                                      GeminiRestBackend, GeminiVisionBackend)}
+
+
+def load_chain(value=None):
+    """读取后端顺序，参数优先，其次环境变量 EXTRACTOR_CHAIN；忽略未知的后端名"""
+    names = [name.strip().lower() for name in (value or os.environ.get("EXTRACTOR_CHAIN") or DEFAULT_CHAIN).split(",")]
+    unknown = [name for name in names if name and name not in BACKENDS]
+    if unknown:
+        print(f"⚠️ 未知的提取后端 {', '.join(unknown)}（可选：{', '.join(BACKENDS)}）")
+    return [name for name in dict.fromkeys(names) if name in BACKENDS]
+
+
+# --- 统计与路由 ---
+class BackendStats:
+    """
+    一个后端的实时统计：调用次数、失败次数、延迟和错误率的滑动平均、累计成本。
+    错误率把“调用成功但结果不完整”也算作一次错误，路由关心的是结果能不能用。
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.failures = 0
+        self.incomplete = 0
+        self.latency = None
+        self.error_rate = 0.0
+        self.cost = 0.0
+        self.recent = deque(maxlen=LATENCY_WINDOW)
+        self._lock = threading.Lock()
+
+    def record(self, elapsed, ok, complete, cost):
+        with self._lock:
+            self.recent.append(elapsed)
+            self.calls += 1
+            self.failures += 0 if ok else 1
+            self.incomplete += 0 if complete or not ok else 1
+            self.latency = elapsed if self.latency is None else EWMA_ALPHA * elapsed + (1 - EWMA_ALPHA) * self.latency
+            self.error_rate = EWMA_ALPHA * (0.0 if complete else 1.0) + (1 - EWMA_ALPHA) * self.error_rate
+            self.cost += cost
+
+    def p90(self):
+        """最近调用延迟的 p90；样本不足 HEDGE_MIN_SAMPLES 时返回 None"""
+        with self._lock:
+            if len(self.recent) < HEDGE_MIN_SAMPLES:
+                return None
+            ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.9))]
+
+    def to_dict(self):
+        p90 = self.p90()
+        with self._lock:
+            return {"calls": self.calls, "failures": self.failures, "incomplete": self.incomplete,
+                    "latency_sec": round(self.latency, 3) if self.latency is not None else None,
+                    "p90_sec": round(p90, 3) if p90 is not None else None,
+                    "error_rate": round(self.error_rate, 3), "cost": round(self.cost, 4)}
+
+
+def load_hedge_settings(enabled=None, max_ratio=None, max_cost=None):
+    """
+    读取对冲设置，优先级：参数 > 环境变量 > 默认值。
+    :return: {"enabled", "max_ratio", "max_cost"}
+    """
+    if enabled is None:
+        enabled = os.environ.get("ROUTER_HEDGE", "0").lower() in ("1", "true", "yes", "on")
+    return {
+        "enabled": enabled,
+        "max_ratio": float(max_ratio if max_ratio is not None
+                           else os.environ.get("ROUTER_HEDGE_MAX_RATIO", DEFAULT_HEDGE_MAX_RATIO)),
+        "max_cost": float(max_cost if max_cost is not None
+                          else os.environ.get("ROUTER_HEDGE_MAX_COST", DEFAULT_HEDGE_MAX_COST)),
+    }
+
+
+class ExtractorRouter:
+    """
+    按成本、延迟和错误率为每个文件选择后端，失败或结果不完整时按链路回退。
+    提供与 OpenAIVisionExtractor 相同的 extract_from_image，可以直接替换。可在多线程间共享。
+    """
+
+    def __init__(self, chain=None, latency_weight=None, hedge=None):
+        """
+        :param chain: 后端名列表或逗号分隔的字符串，默认读取环境变量 EXTRACTOR_CHAIN。
+        :param latency_weight: 每秒延迟折算的成本（美元），默认读取环境变量 ROUTER_LATENCY_WEIGHT。
+        :param hedge: 对冲设置，见 load_hedge_settings；默认读取环境变量 ROUTER_HEDGE 等。
+        """
+        self.chain = load_chain(",".join(chain) if isinstance(chain, (list, tuple)) else chain)
+        self.latency_weight = float(latency_weight if latency_weight is not None
+                                    else os.environ.get("ROUTER_LATENCY_WEIGHT", DEFAULT_LATENCY_WEIGHT))
+        self.backends = {name: BACKENDS[name]() for name in self.chain}
+        self.stats = {name: BackendStats() for name in self.chain}
+        self.hedge = hedge or load_hedge_settings()
+        self.hedge_stats = {"requests": 0, "fired": 0, "wins": 0, "skipped": 0, "extra_cost": 0.0}
+        self._hedge_lock = threading.Lock()
+        # 对冲时两个请求并行进行；输掉的请求无法取消，在后台执行完（结果计入统计）
+        self._pool = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix="hedge") \
+            if self.hedge["enabled"] else None
+
+    def available(self):
+        """可用的后端名（按链路顺序）"""
+        return [name for name in self.chain if self.backends[name].unavailable_reason() is None]
+
+    def _base_cost(self, name):
+        """单次调用的成本：调用成本 + 延迟 × 权重"""
+        backend, stats = self.backends[name], self.stats[name]
+        latency = stats.latency if stats.calls >= MIN_SAMPLES else backend.prior_latency
+        return backend.cost + latency * self.latency_weight
+
+    def _error_rate(self, name):
+        stats = self.stats[name]
+        return stats.error_rate if stats.calls >= MIN_SAMPLES else 0.0
+
+    def score(self, name, names=None):
+        """
+        先用这个后端的预期成本：自身成本 + 错误率 × 回退到其他后端中最便宜的一个的成本，越小越好。
+        :param names: 参与比较的后端，默认为全部可用后端。
+        """
+        others = [self._base_cost(other) for other in (names or self.available()) if other != name]
+        return self._base_cost(name) + self._error_rate(name) * (min(others) if others else 0.0)
+
+    def plan(self):
+        """
+        本次调用的后端顺序：预期成本最低的放第一个，其余按链路顺序作为回退。
+        熔断中的后端不参与；全部熔断时返回空列表（快速失败）。
+        """
+        names = [name for name in self.available() if self.backends[name].breaker.state != OPEN]
+        if not names:
+            return []
+        best = min(names, key=lambda name: (self.score(name, names), self.chain.index(name)))
+        return [best] + [name for name in names if name != best]
+
+    def _call(self, name, image):
+        backend = self.backends[name]
+        if not backend.manages_breaker and not backend.breaker.allow():
+            # 半开状态下别的线程正在试探，本次不计入统计
+            return [normalize_record({"error": f"{name} 熔断中"}, name)], False
+        start = time.perf_counter()
+        try:
+            records = backend.extract(image) or [normalize_record({"error": "没有识别结果"}, name)]
+        except CircuitOpenError as e:
+            # 自己管理熔断器的提取器直接拒绝了调用，耗时接近 0，计入统计会拉低延迟、抬高错误率
+            return [normalize_record({"error": str(e)}, name)], False
+        except Exception as e:
+            records = [normalize_record({"error": str(e)}, name)]
+        ok = not all(record.get("error") for record in records)
+        complete = any(is_complete(record) for record in records)
+        self.stats[name].record(time.perf_counter() - start, ok, complete, backend.cost)
+        if not backend.manages_breaker:
+            # 各后端把接口错误转换成了 error 记录，这里只能按整次调用是否失败来记录
+            if ok:
+                backend.breaker.record_success()
+            else:
+                backend.breaker.record_failure()
+        return records, complete
+
+    def hedge_delay(self, name):
+        """对冲前等待的时间：最近调用延迟的 p90，样本不足时取预设延迟的两倍"""
+        p90 = self.stats[name].p90()
+        return p90 if p90 is not None else self.backends[name].prior_latency * 2
+
+    def _reserve_hedge(self, name):
+        """检查比例和成本上限，允许时记一次对冲并返回 True"""
+        cost = self.backends[name].cost
+        with self._hedge_lock:
+            stats, limits = self.hedge_stats, self.hedge
+            over_ratio = stats["fired"] + 1 > limits["max_ratio"] * stats["requests"]
+            over_cost = limits["max_cost"] and stats["extra_cost"] + cost > limits["max_cost"]
+            if over_ratio or over_cost:
+                stats["skipped"] += 1
+                return False
+            stats["fired"] += 1
+            stats["extra_cost"] += cost
+            return True
+
+    def _hedged_call(self, primary, secondary, image):
+        """
+        先请求 primary，超过它的 p90 延迟还没返回时同时请求 secondary，先返回完整结果的为准。
+        :return: (results, used)。results 为按完成顺序的 [(后端名, records, complete)]，
+                 used 为实际请求了几个后端（1 或 2）。
+        """
+        with self._hedge_lock:
+            self.hedge_stats["requests"] += 1
+        futures = {self._pool.submit(self._call, primary, image): primary}
+        delay = self.hedge_delay(primary)
+        done, _ = wait(futures, timeout=delay)
+        if not done and self._reserve_hedge(secondary):
+            print(f"  ⏱️ {primary} 超过 {delay:.1f} 秒未返回，同时请求 {secondary}")
+            futures[self._pool.submit(self._call, secondary, image)] = secondary
+
+        results = []
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = futures[future]
+                records, complete = future.result()
+                results.append((name, records, complete))
+                if complete:
+                    if name == secondary:
+                        with self._hedge_lock:
+                            self.hedge_stats["wins"] += 1
+                    return results, len(futures)
+        return results, len(futures)
+
+    def extract_from_image(self, image):
+        """
+        识别一张图片，返回统一记录列表（多张收据时有多条）。
+        开启对冲时第一个后端太慢会同时请求下一个后端。
+        全部后端都不完整时返回字段最多的一组；没有可用后端时返回一条 error 记录。
+        """
+        best = None
+        plan = self.plan()
+        i = 0
+        while i < len(plan):
+            if self._pool is not None and i + 1 < len(plan):
+                results, used = self._hedged_call(plan[i], plan[i + 1], image)
+            else:
+                results, used = [(plan[i], *self._call(plan[i], image))], 1
+            i += used
+            for name, records, complete in results:
+                if complete:
+                    return records
+                if best is None or max(map(_record_score, records)) > max(map(_record_score, best)):
+                    best = records
+                print(f"  ↪️ {name} 结果不完整，换下一个后端")
+        return best or [normalize_record({"error": "没有可用的提取后端"}, None)]
+
+    def hedge_report(self):
+        """对冲统计：可对冲的请求数、触发次数、对冲请求胜出次数、跳过次数（超出上限）、额外成本"""
+        with self._hedge_lock:
+            return {**self.hedge_stats, "extra_cost": round(self.hedge_stats["extra_cost"], 4),
+                    "enabled": self.hedge["enabled"]}
+
+    def report(self):
+        """各后端的可用状态、分数和统计"""
+        return {name: {"available": self.backends[name].unavailable_reason() is None,
+                       "reason": self.backends[name].unavailable_reason(),
+                       "circuit": self.backends[name].breaker.state,
+                       "score": round(self.score(name), 5), **self.stats[name].to_dict()}
+                for name in self.chain}
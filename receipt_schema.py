@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+视觉提取器共用的收据 JSON Schema 和结构化输出解析
+OpenAI（response_format=json_schema）和 Gemini（responseMimeType + responseSchema）都按这个 Schema
+约束输出，返回的一定是合法 JSON，不再用正则从自由文本里截取，也不需要在提示词里写示例 JSON。
+
+字段统一为可为 null 的字符串，输出尽量短；每个服务商的解析失败次数见 parse_report()。
+"""
+import json
+import threading
+
+# 字段名 → 说明（说明写进提示词，Schema 里不带，减少每次请求的 token）
+RECEIPT_FIELDS = {
+    "seller_name": "店铺或公司名称（保留原语言）",
+    "issue_date": "日期，YYYY-MM-DD",
+    "issue_time": "时间，HH:MM",
+    "invoice_number": "发票或收据编号",
+    "total_amount": "总金额，仅数字",
+    "subtotal": "小计金额",
+    "tax": "税额",
+    "currency": "货币符号，如 ¥、$、€",
+    "payment_method": "支付方式",
+    "items": "商品列表，用分号分隔",
+}
+
+# 深度提取（gemini_vision 的 extract_with_deep_structure）另外需要的字段，items 改为商品对象数组
+DEEP_FIELDS = {
+    "seller_address": "地址",
+    "seller_phone": "电话",
+}
+ITEM_FIELDS = {
+    "name": "商品名称",
+    "quantity": "数量",
+    "price": "单价",
+    "amount": "小计",
+}
+
+_stats = {}
+_lock = threading.Lock()
+
+
+def field_guide(fields=None):
+    """提示词里的字段说明，每行一个“字段: 说明”"""
+    return "\n".join(f"- {name}: {RECEIPT_FIELDS[name]}" for name in (fields or RECEIPT_FIELDS))
+
+
+def _json_schema_receipt(fields):
+    # OpenAI strict 模式要求列出全部字段并禁止多余字段，缺失的值用 null
+    return {"type": "object",
+            "properties": {name: {"type": ["string", "null"]} for name in fields},
+            "required": list(fields),
+            "additionalProperties": False}
+
+
+def openai_response_format(fields=None):
+    """
+    OpenAI 的 response_format：{"receipts": [收据, ...]}，一张图片里有多张收据时有多条。
+    strict 模式下根节点必须是对象，所以数组包在 receipts 里。
+    """
+    fields = list(fields or RECEIPT_FIELDS)
+    return {"type": "json_schema",
+            "json_schema": {"name": "receipts", "strict": True,
+                            "schema": {"type": "object",
+                                       "properties": {"receipts": {"type": "array",
+                                                                   "items": _json_schema_receipt(fields)}},
+                                       "required": ["receipts"],
+                                       "additionalProperties": False}}}
+
+
+def gemini_response_schema(fields=None):
+    """Gemini 的 responseSchema（OpenAPI 子集）：单张收据对象"""
+    return {"type": "OBJECT",
+            "properties": {name: {"type": "STRING", "nullable": True} for name in (fields or RECEIPT_FIELDS)}}
+
+
+def gemini_deep_response_schema():
+    """深度提取的 responseSchema：全部收据字段加上地址、电话，items 为商品对象数组"""
+    properties = {name: {"type": "STRING", "nullable": True} for name in (*RECEIPT_FIELDS, *DEEP_FIELDS)}
+    properties["items"] = {"type": "ARRAY",
+                           "items": {"type": "OBJECT",
+                                     "properties": {name: {"type": "STRING", "nullable": True} for name in ITEM_FIELDS}}}
+    return {"type": "OBJECT", "properties": properties}
+
+
+def deep_field_guide():
+    """深度提取提示词里的字段说明"""
+    fields = {**RECEIPT_FIELDS, **DEEP_FIELDS, "items": "商品列表，每项包含 " + "、".join(
+        f"{name}（{desc}）" for name, desc in ITEM_FIELDS.items())}
+    return "\n".join(f"- {name}: {desc}" for name, desc in fields.items())
+
+
+def gemini_generation_config(fields=None):
+    """Gemini REST 的 generationConfig：只输出符合 Schema 的 JSON"""
+    return {"responseMimeType": "application/json", "responseSchema": gemini_response_schema(fields)}
+
+
+def parse_receipts(provider, content):
+    """
+    解析结构化输出，返回收据字典列表；解析失败时返回 [{"raw_text": content}]，
+    没有任何收据（{"receipts": []} 或 []）时返回 [{"error": ...}]，两种情况都计为解析失败。
+    返回的列表至少有一项。
+    """
+    try:
+        data = json.loads(content)
+        if isinstance(data, dict) and isinstance(data.get("receipts"), list):
+            data = data["receipts"]
+        receipts = [data] if isinstance(data, dict) else data
+        if not isinstance(receipts, list) or not all(isinstance(item, dict) for item in receipts):
+            raise ValueError(f"不是收据对象: {type(data).__name__}")
+    except (TypeError, ValueError) as e:
+        record_parse(provider, False)
+        print(f"  ⚠️ {provider} 返回的 JSON 解析失败: {e}")
+        return [{"raw_text": content}]
+    if not receipts:
+        record_parse(provider, False)
+        print(f"  ⚠️ {provider} 没有返回任何收据")
+        return [{"error": "没有识别到收据"}]
+    record_parse(provider, True)
+    return receipts
+
+
+def record_parse(provider, ok):
+    """记录一次结构化输出的解析结果（截断、拒答等没有内容的情况也算失败）"""
+    with _lock:
+        stats = _stats.setdefault(provider, {"responses": 0, "parse_failures": 0})
+        stats["responses"] += 1
+        stats["parse_failures"] += 0 if ok else 1
+
+
+def parse_report():
+    """各服务商的解析统计：{服务商: {"responses", "parse_failures", "failure_rate"}}"""
+    with _lock:
+        return {provider: {**stats, "failure_rate": round(stats["parse_failures"] / stats["responses"], 4)}
+                for provider, stats in _stats.items()}
@@ -1,15 +1,10 @@
 import os
 import re
-import time
 import tkinter as tk
 from tkinter import messagebox, scrolledtext
 import threading
-import shutil
 
-import pdfplumber
-import hashlib
 import uuid
-from chat_ai_rename import InvoiceExtractor, ImageOcrExtractor
 
 
 def get_backup_dir(pdf_dir):
@@ -81,64 +76,140 @@ def extract_projects(text):
 
     return projects
 
+# --- 字段提取引擎 ---
+# 所有标签正则在导入时编译一次；提取时先用一个合并的正则单遍扫描出全部标签位置，
+# 再只对用户选择的字段，从对应标签的位置开始匹配取值，不再为每个字段重新扫描全文。
+# 注意：合并正则里不能用命名分组，否则 re 无法利用首字符集合快速跳过无关位置（实测慢十几倍），
+# 所以按匹配到的首字（开票日期/开票人 看第三个字）区分标签类型。
+_LABEL_RE = re.compile(
+    r"统一社会信用代码/纳税人识别号[：:]"
+    r"|购\s*名称[：:]"
+    r"|发票号码[：:]"
+    r"|开票日期[：:]"
+    r"|价税合计"
+    r"|合\s*计"
+    r"|开票人[:：]"
+)
+_LABEL_KINDS = {"统": "tax_id", "购": "buyer", "发": "invoice_number", "价": "price_tax_total", "合": "total"}
+
+# 标签之后的取值部分，从标签结束位置开始 match
+_TAX_ID_VALUE_RE = re.compile(r"\s*([\w\d]+)")
+_BUYER_SELLER_VALUE_RE = re.compile(r"\s*(.*?)\s+销\s*名称[：:]\s*(.*?)\s")
+_INVOICE_NUMBER_VALUE_RE = re.compile(r"\s*([\d\w]+)")
+_ISSUE_DATE_VALUE_RE = re.compile(r"\s*([\d年月日\-]+)")
+_TOTAL_VALUE_RE = re.compile(r"\s*¥?([\d\.]+)")
+# 如果没有明确字段“总税额”，匹配合计行后紧跟的两组金额，第二组是总税额
+_TOTAL_TAX_VALUE_RE = re.compile(r".*?¥?([\d\.]+)\s*\*?\s*¥?([\d\.]+)")
+_PRICE_TAX_TOTAL_VALUE_RE = re.compile(r".*（小写）¥([\d\.]+)", re.DOTALL)
+_PRICE_TAX_WORDS_VALUE_RE = re.compile(r"（大写）\s*([\S]+)")
+_PREPARER_VALUE_RE = re.compile(r"\s*([\S]+)")
+
+
+def _collapse_whitespace(text):
+    """
+    与 re.sub(r'\s+', ' ', text) 结果相同（首尾空白也保留为一个空格），
+    但 str.split 比正则替换快得多。
+    """
+    collapsed = ' '.join(text.split())
+    if not collapsed:
+        return ' ' if text else ''
+    if text[0].isspace():
+        collapsed = ' ' + collapsed
+    if text[-1].isspace():
+        collapsed += ' '
+    return collapsed
+
+
+def _scan_labels(text):
+    """单遍扫描，返回 {标签类型: [(标签起点, 标签终点), ...]}，按出现顺序排列"""
+    labels = {}
+    for m in _LABEL_RE.finditer(text):
+        label = m.group()
+        kind = _LABEL_KINDS.get(label[0]) or ("issue_date" if label[2] == "日" else "preparer")
+        labels.setdefault(kind, []).append((m.start(), m.end()))
+        if kind == "price_tax_total":
+            # “价税合计”里也包含“合计”，同样记作合计标签
+            labels.setdefault("total", []).append((m.start() + 2, m.end()))
+    return labels
+
+
+def _first_value(text, positions, value_re):
+    """依次从各个标签位置尝试取值，返回第一个匹配成功的 Match（与 re.search 的最左匹配一致）"""
+    for _, end in positions:
+        m = value_re.match(text, end)
+        if m:
+            return m
+    return None
+
+
 def extract_fields_from_text(text, fields):
     results = {}
 
-    # 这里text已经是合并空白后的完整字符串
-    # 先合并多余空白
-    text = re.sub(r'\s+', ' ', text)
+    # 先合并多余空白，后续所有匹配都基于合并后的字符串
+    text = _collapse_whitespace(text)
+    labels = _scan_labels(text)
 
     # 1. 统一提取所有“统一社会信用代码/纳税人识别号”后的号码（按顺序）
-    tax_numbers = re.findall(r"统一社会信用代码/纳税人识别号[：:]\s*([\w\d]+)", text)
-    buy_tax_number = tax_numbers[0] if len(tax_numbers) > 0 else ""
-    sell_tax_number = tax_numbers[1] if len(tax_numbers) > 1 else ""
-    if "购方税号" in fields:
-        results["购方税号"] = buy_tax_number
-    if "销方税号" in fields:
-        results["销方税号"] = sell_tax_number
+    if "购方税号" in fields or "销方税号" in fields:
+        tax_numbers = []
+        last_end = 0
+        for start, end in labels.get("tax_id", ()):
+            if start < last_end:
+                continue
+            m = _TAX_ID_VALUE_RE.match(text, end)
+            if m:
+                tax_numbers.append(m.group(1))
+                last_end = m.end()
+                if len(tax_numbers) == 2:
+                    break
+        if "购方税号" in fields:
+            results["购方税号"] = tax_numbers[0] if len(tax_numbers) > 0 else ""
+        if "销方税号" in fields:
+            results["销方税号"] = tax_numbers[1] if len(tax_numbers) > 1 else ""
 
     # 2. 购方名称 + 销方名称 （一行内）
-    m = re.search(r"购\s*名称[：:]\s*(.*?)\s+销\s*名称[：:]\s*(.*?)\s", text)
-    if m:
-        if "购方名称" in fields:
-            results["购方名称"] = m.group(1).strip()
-        if "销方名称" in fields:
-            results["销方名称"] = m.group(2).strip()
+    if "购方名称" in fields or "销方名称" in fields:
+        m = _first_value(text, labels.get("buyer", ()), _BUYER_SELLER_VALUE_RE)
+        if m:
+            if "购方名称" in fields:
+                results["购方名称"] = m.group(1).strip()
+            if "销方名称" in fields:
+                results["销方名称"] = m.group(2).strip()
 
     # 3. 发票号码
-    m = re.search(r"发票号码[：:]\s*([\d\w]+)", text)
     if "发票号码" in fields:
+        m = _first_value(text, labels.get("invoice_number", ()), _INVOICE_NUMBER_VALUE_RE)
         results["发票号码"] = m.group(1).strip() if m else ""
 
     # 4. 开票日期
-    m = re.search(r"开票日期[：:]\s*([\d年月日\-]+)", text)
     if "开票日期" in fields:
+        m = _first_value(text, labels.get("issue_date", ()), _ISSUE_DATE_VALUE_RE)
         results["开票日期"] = m.group(1).strip() if m else ""
 
     # 5. 合计金额
-    m = re.search(r"合\s*计\s*¥?([\d\.]+)", text)
     if "合计" in fields:
+        m = _first_value(text, labels.get("total", ()), _TOTAL_VALUE_RE)
         results["合计"] = m.group(1).strip() if m else ""
 
-    # 如果没有明确字段“总税额”，你可以尝试匹配合计行后紧跟的数字，或者暂时置空
-    m = re.search(r"合\s*计.*?¥?([\d\.]+)\s*\*?\s*¥?([\d\.]+)", text)
-    if m and "总税额" in fields:
-        # 如果匹配到两组金额，则第二组是总税额
-        results["总税额"] = m.group(2).strip()
+    # 总税额：合计行后的第二组金额，匹配不到时不返回该字段
+    if "总税额" in fields:
+        m = _first_value(text, labels.get("total", ()), _TOTAL_TAX_VALUE_RE)
+        if m:
+            results["总税额"] = m.group(2).strip()
 
     # 6. 价税合计（数字，小写）
-    m = re.search(r"价税合计.*（小写）¥([\d\.]+)", text, re.DOTALL)
     if "价税合计" in fields:
+        m = _first_value(text, labels.get("price_tax_total", ()), _PRICE_TAX_TOTAL_VALUE_RE)
         results["价税合计"] = m.group(1).strip() if m else ""
 
     # 7. 价税合计（大写）
-    m = re.search(r"价税合计（大写）\s*([\S]+)", text)
     if "价税合计大写" in fields:
+        m = _first_value(text, labels.get("price_tax_total", ()), _PRICE_TAX_WORDS_VALUE_RE)
         results["价税合计大写"] = m.group(1).strip() if m else ""
 
     # 8. 开票人
-    m = re.search(r"开票人[:：]\s*([\S]+)", text)
     if "开票人" in fields:
+        m = _first_value(text, labels.get("preparer", ()), _PREPARER_VALUE_RE)
         results["开票人"] = m.group(1).strip() if m else ""
 
     # # 9. 备注（匹配“备 注”到“开票人”之间的内容）
@@ -164,102 +235,119 @@ def extract_fields_from_text(text, fields):
     return results
 
 # 提取pdf文本
-import pdfplumber
-def get_full_text(text_area, file_path):
+def iter_pages(file_path, max_pages=None):
+    """
+    逐页产出 pdfplumber 的 Page，每页用完即释放解析缓存。
+
+    :param max_pages: 最多读取的页数，None 或 0 表示不限制。
+    """
+    import pdfplumber
+
+    with pdfplumber.open(file_path) as pdf:
+        for i, page in enumerate(pdf.pages):
+            if max_pages and i >= max_pages:
+                break
+            try:
+                yield page
+            finally:
+                page.close()
+
+
+def iter_page_texts(file_path, max_pages=None):
+    """逐页产出 PDF 文本，没有文本的页产出空字符串"""
+    for page in iter_pages(file_path, max_pages):
+        yield page.extract_text() or ""
+
+
+def read_pdf_text_fields(text_area, file_path, fields, max_pages=None, use_layout=None):
+    """
+    边读页边匹配字段：第一页先按标准电子发票版面分区取值（见 fapiao_layout），字段齐全就直接返回；
+    否则每读到一页有文本的页就对已读内容做一次正则提取（版面结果优先），
+    所有字段都匹配到时立即停止，不再解析后面的页（发票信息通常在第一页）。
+
+    :param max_pages: 最多读取的页数，None 或 0 表示不限制。
+    :param use_layout: 是否先尝试版面提取，默认读取环境变量 FAPIAO_LAYOUT。
+    :return: (full_text, field_values, pages_read, tier)。tier 为 layout 或 text；
+             没有提取到文本或打开失败时前两项为 None，并在 text_area 显示错误信息。
+    """
+    from fapiao_layout import extract_layout_fields, layout_enabled_by_env
+
+    if use_layout is None:
+        use_layout = layout_enabled_by_env()
+    full_text = ""
+    field_values = None
+    layout_values = None
+    pages_read = 0
+    try:
+        for page in iter_pages(file_path, max_pages):
+            pages_read += 1
+            if pages_read == 1 and use_layout:
+                layout_values, lines_text = extract_layout_fields(page, fields)
+                if layout_values is not None and all(layout_values.get(key) for key in fields):
+                    return lines_text + "\n", layout_values, pages_read, "layout"
+            page_text = page.extract_text() or ""
+            if not page_text:
+                continue
+            full_text += page_text + "\n"
+            field_values = extract_fields_from_text(full_text, fields)
+            if layout_values:
+                field_values.update(layout_values)
+            if all(field_values.get(key) for key in fields):
+                break
+    except Exception as e:
+        text_area.insert(tk.END, f"打开PDF失败: {e}\n")
+        text_area.see(tk.END)
+        return None, None, pages_read, "text"
+
+    # 如果整个文档没有提取到任何文本，返回 None
+    if not full_text.strip():
+        text_area.insert(tk.END, "PDF 中未提取到有效文本。\n")
+        text_area.see(tk.END)
+        return None, None, pages_read, "text"
+    return full_text, field_values, pages_read, "text"
+
+
+def get_full_text(text_area, file_path, max_pages=None):
     """
     从 PDF 文件中提取文本内容。
     如果提取失败或文件打不开，返回 None，并在 text_area 显示错误信息。
     """
     try:
-        with pdfplumber.open(file_path) as pdf:
-            full_text = ""
-            for page in pdf.pages:
-                page_text = page.extract_text()
-                if page_text:  # 如果页面提取到文本
-                    full_text += page_text + "\n"
-            # 如果整个文档没有提取到任何文本，返回 None
-            if not full_text.strip():
-                text_area.insert(tk.END, "PDF 中未提取到有效文本。\n")
-                text_area.see(tk.END)
-                return None
+        full_text = "".join(page_text + "\n" for page_text in iter_page_texts(file_path, max_pages) if page_text)
     except Exception as e:
         text_area.insert(tk.END, f"打开PDF失败: {e}\n")
         text_area.see(tk.END)
         return None
+    # 如果整个文档没有提取到任何文本，返回 None
+    if not full_text.strip():
+        text_area.insert(tk.END, "PDF 中未提取到有效文本。\n")
+        text_area.see(tk.END)
+        return None
     return full_text
 
 
-def process_files_local(text_area, pdf_dir, fields, split, rename_rule):
-    text_area.insert(tk.END, f"开始处理目录：{pdf_dir}\n")
-    text_area.see(tk.END)
-
-    bak_dir = get_backup_dir(pdf_dir)
-    text_area.insert(tk.END, f"备份目录为：{bak_dir}\n")
-    text_area.see(tk.END)
+def process_files_local(text_area, pdf_dir, fields, split, rename_rule, concurrency=None, warmup=None):
+    from rename_pipeline import backup_folder, run_rename_job
+    from warmup import Warmup
 
-    ai_extractor = InvoiceExtractor(model_name=os.environ.get("MODEL_NAME", 'moonshot-v1-8k'))
-    ocr_extractor = ImageOcrExtractor()
-    count = 0
-    # 文件备份
-    for filename in os.listdir(pdf_dir):
-        src = os.path.join(pdf_dir, filename)
-        dst = os.path.join(bak_dir, filename)
-        shutil.copy2(src, dst)
-        count += 1
-    text_area.insert(tk.END, f"已备份{count}个PDF文件到：{bak_dir}\n")
+    text_area.insert(tk.END, f"开始处理目录：{pdf_dir}\n")
     text_area.see(tk.END)
 
-    total = 0   # 总数
-    success_count = 0   # 处理成功总数
-    filename_same_count = 0     # 文件名冲突数
-    for filename in os.listdir(bak_dir):
-        total += 1
-        file_path = os.path.join(bak_dir, filename)
-        text_area.insert(tk.END, f"\n处理文件：{filename}\n")
-        text_area.see(tk.END)
-        full_text = get_full_text(text_area, file_path)
-        field_values = extract_fields_from_text(full_text, fields) if full_text is not None else None
-        if filename.lower().endswith('.pdf') and full_text is not None and any(field_values.values()):
-            parts = [field_values.get(key, "") for key in fields]
-            new_name_base = split.join(parts)
-        else:
-            # 不是pdf，就走图片识别
-            text_area.insert(tk.END, "\n未提取到有效字段，图片识别发票中，请稍候...")
-            text_area.see(tk.END)
-            full_text = ocr_extractor.extract_from_path(file_path)
-            new_name_base = ai_extractor.get_rename_by_chat_ai(full_text, fields, split)
-
-        # 如果 new_name_base 有两个 __ ，说明图片识别没有成功
-        # 直接把文本扔给ai识别
-        if '__' in new_name_base or new_name_base[0] == '_' or new_name_base[-1] == '_':
-            text_area.insert(tk.END, "\nAI处理发票中，请稍候...")
-            text_area.see(tk.END)
-            new_name_base = ai_extractor.get_rename_by_chat_ai(full_text, fields, split)
-        # 提取原始文件的后缀名
-        _, original_ext = os.path.splitext(filename)
-        # 将新的文件名基础部分与原始后缀名拼接
-        new_name = sanitize_filename(new_name_base) + original_ext
-        new_path = os.path.join(bak_dir, new_name)
-        if os.path.exists(new_path):
-            filename_same_count += 1
-            text_area.insert(tk.END, f"文件名冲突，加个随机数: {new_name}\n")
-            text_area.see(tk.END)
-            new_path = sanitize_filename(new_name_base) + time.strftime("%Y%m%d%H%M%S") + original_ext
+    # 有预热时直接用后台已经创建好的提取器，没有时现在创建（备份期间在后台加载）
+    if warmup is None:
+        warmup = Warmup().start()
+    bak_dir, _ = backup_folder(text_area, pdf_dir)
+    ai_extractor = warmup.ai_extractor()
 
-        try:
-            os.rename(file_path, new_path)
-            text_area.insert(tk.END, f"重命名成功: {filename} -> {new_name}\n")
-            text_area.see(tk.END)
-            success_count += 1
-        except Exception as e:
-            text_area.insert(tk.END, f"重命名失败: {e}\n")
-            text_area.see(tk.END)
+    # 文本提取、OCR、AI 三个阶段并发执行，重命名按文件名顺序串行进行
+    summary, _ = run_rename_job(text_area, bak_dir, fields, split, ai_extractor, warmup.ocr_factory(), concurrency)
+    total, success_count, filename_same_count = summary["total"], summary["success"], summary["conflicts"]
 
     text_area.insert(tk.END, f"\n全部处理完成。共处理{total}个PDF，成功重命名{success_count}个。\n")
     text_area.see(tk.END)
     messagebox.showinfo("处理完成", f"全部处理完成。共处理{total}个PDF，成功重命名{success_count}个，其中文件名冲突{filename_same_count}个。")
 
-def run_main_ui_local(cfg):
+def run_main_ui_local(cfg, warmup=None):
     root = tk.Tk()
     root.title("本地PDF智能重命名工具")
 
@@ -267,6 +355,7 @@ def run_main_ui_local(cfg):
     fields = cfg.get("fields", [])
     split = cfg.get("split", "_")
     rename_rule = cfg.get("rename", "")
+    concurrency = cfg.get("concurrency")
 
     text_area = scrolledtext.ScrolledText(root, width=80, height=24, font=("微软雅黑", 11))
     text_area.pack(padx=10, pady=10, fill=tk.BOTH, expand=True)
@@ -281,36 +370,34 @@ def run_main_ui_local(cfg):
             pass
 
     def threaded_process():
-        process_files_local(text_area, pdf_dir, fields, split, rename_rule)
+        process_files_local(text_area, pdf_dir, fields, split, rename_rule, concurrency, warmup)
         # finish_and_return()
 
     threading.Thread(target=threaded_process, daemon=True).start()
     root.mainloop()
 
-def filter_duplicate_files(folder):
+def filter_duplicate_files(folder, hash_name=None):
+    from dedup import find_duplicates
+
     if not os.path.isdir(folder):
         messagebox.showerror("错误", f"目录不存在: {folder}")
         return
 
-    hash_map = {}
     removed = []
-    total = 0
-
-    for fname in os.listdir(folder):
-        path = os.path.join(folder, fname)
-        if not os.path.isfile(path):
-            continue
-        with open(path, "rb") as f:
-            file_hash = hashlib.md5(f.read()).hexdigest()
-        if file_hash in hash_map:
-            try:
-                os.remove(path)
-                removed.append(fname)
-            except Exception as e:
-                messagebox.showerror("删除失败", f"{fname} 删除失败: {e}")
-        else:
-            hash_map[file_hash] = path
-        total += 1
+    paths = [os.path.join(folder, fname) for fname in os.listdir(folder)]
+    paths = [path for path in paths if os.path.isfile(path)]
+    total = len(paths)
+
+    # 先按大小、再按首尾探测哈希筛选，只对可能重复的文件计算完整哈希；每组保留第一个
+    groups, _ = find_duplicates(paths, hash_name)
+    order = {path: i for i, path in enumerate(paths)}
+    for path in sorted((path for group in groups for path in group[1:]), key=order.get):
+        fname = os.path.basename(path)
+        try:
+            os.remove(path)
+            removed.append(fname)
+        except Exception as e:
+            messagebox.showerror("删除失败", f"{fname} 删除失败: {e}")
 
     msg = f"共检测到{total}个文件，已删除{len(removed)}个重复文件。"
     if removed:
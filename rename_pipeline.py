@@ -0,0 +1,565 @@
+#!/usr/bin/env python3
+"""
+分阶段并发重命名流水线
+文本提取(pdfplumber + 正则) → 图片OCR → AI提取 → 按顺序重命名
+每个阶段各自使用有界的工作池，并发数可以分别配置
+"""
+import os
+import time
+import threading
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from backup import FileCloner, RenameJournal, is_journal
+from circuit_breaker import breaker_report
+from extraction_cache import EXTRACTOR_VERSION, ExtractionCache, cache_enabled_by_env
+from ocr_result import load_field_min_confidence
+from parse_pool import ParsePool
+from pdf_probe import TEXT_KINDS, probe_pdf, route_for
+
+# 与 tk.END 相同，避免在无界面环境下依赖 tkinter
+END = "end"
+
+# 各阶段默认并发数，可用环境变量覆盖
+# text: pdfplumber 解析 + 正则，CPU 密集，使用进程池
+# ocr:  PaddleOCR 识别，每个线程单独加载一份模型
+# ai:   InvoiceExtractor 调用，网络 I/O 密集
+DEFAULT_CONCURRENCY = {
+    "text": max(1, (os.cpu_count() or 2) - 1),
+    "ocr": 1,
+    "ai": 4,
+}
+
+
+def load_ai_batch_size(value=None):
+    """批量 AI 模式每批的发票数，优先级：参数 > 环境变量 PIPELINE_AI_BATCH > 1（不批量）"""
+    return max(1, int(value or os.environ.get("PIPELINE_AI_BATCH", 1)))
+
+
+def load_max_pages(value=None):
+    """文本阶段最多读取的页数，优先级：参数 > 环境变量 PDF_MAX_PAGES > 0（不限制）"""
+    return max(0, int(value or os.environ.get("PDF_MAX_PAGES", 0)))
+
+
+def load_concurrency(overrides=None):
+    """
+    读取各阶段并发数。优先级：参数 > 环境变量(PIPELINE_TEXT_WORKERS 等) > 默认值。
+
+    :param overrides: 形如 {"text": 4, "ai": 8} 的字典，可只给部分阶段。
+    :return: 包含 text / ocr / ai 三个阶段并发数的字典。
+    """
+    concurrency = {}
+    for stage, default in DEFAULT_CONCURRENCY.items():
+        value = os.environ.get(f"PIPELINE_{stage.upper()}_WORKERS", default)
+        if overrides and overrides.get(stage):
+            value = overrides[stage]
+        concurrency[stage] = max(1, int(value))
+    return concurrency
+
+
+class _MessageBuffer:
+    """模拟 text_area 的 insert/see 接口，把输出暂存起来"""
+
+    def __init__(self):
+        self.messages = []
+
+    def insert(self, index, text):
+        self.messages.append(text)
+
+    def see(self, index):
+        pass
+
+
+def read_text_fields(file_path, fields, max_pages=None):
+    """
+    文本阶段：在子进程中逐页提取 PDF 文本并用正则匹配字段，字段齐全后不再读后面的页。
+
+    :return: (full_text, field_values, messages, elapsed, pages_read, tier)，提取失败时前两项为 None；
+             tier 为 layout（按发票版面分区提取）或 text。
+    """
+    from rename_function import read_pdf_text_fields
+
+    start = time.perf_counter()
+    buffer = _MessageBuffer()
+    full_text, field_values, pages_read, tier = read_pdf_text_fields(buffer, file_path, fields, max_pages)
+    return full_text, field_values, buffer.messages, time.perf_counter() - start, pages_read, tier
+
+
+def is_incomplete_name(new_name_base):
+    """文件名中出现空字段（两个 __ 或首尾是 _），说明有字段没有识别出来"""
+    return (not new_name_base or '__' in new_name_base
+            or new_name_base[0] == '_' or new_name_base[-1] == '_')
+
+
+class FileTask(_MessageBuffer):
+    """
+    单个文件在流水线中的状态。
+    各阶段的输出先写入自身的缓冲区，重命名时再按文件顺序统一输出，保证日志不交错。
+    """
+
+    def __init__(self, index, filename, file_path):
+        super().__init__()
+        self.index = index
+        self.filename = filename
+        self.file_path = file_path
+        self.full_text = None
+        self.field_values = None
+        self.cache_key = None
+        self.new_name_base = None
+        self.from_ocr = False
+        self.stage = None    # 最终由哪个阶段得出文件名：cache / layout / text / ocr / ai / ocr_ai
+        self.route = None    # 文本层探测结果：text / scanned / hybrid / image / unknown，见 pdf_probe
+        self.error = None
+        self.queued_for_ai = False
+        self.new_name = None
+        self.renamed = False
+        self.stage_times = {}   # 各阶段实际耗时（秒）
+        self.pages_read = None  # 文本阶段实际解析的页数
+        self.ocr_stats = None   # OCR 阶段的页数、耗时和内存峰值，见 ImageOcrExtractor.last_stats
+        self.started = None
+        self.finished = None
+        self.done = Future()
+
+    @property
+    def latency(self):
+        """从提交到全部阶段完成的耗时（秒），包含排队时间"""
+        if self.started is None or self.finished is None:
+            return None
+        return self.finished - self.started
+
+    def to_record(self):
+        """转换为运行报告中的一行"""
+        return {
+            "filename": self.filename,
+            "new_name": self.new_name,
+            "tier": self.stage,
+            "route": self.route,
+            "renamed": self.renamed,
+            "latency_ms": round(self.latency * 1000, 1) if self.latency is not None else None,
+            "probe_ms": round(self.stage_times.get("probe", 0) * 1000, 1),
+            "text_ms": round(self.stage_times.get("text", 0) * 1000, 1),
+            "ocr_ms": round(self.stage_times.get("ocr", 0) * 1000, 1),
+            "ai_ms": round(self.stage_times.get("ai", 0) * 1000, 1),
+            "pages_read": self.pages_read,
+            "ocr_pages": self.ocr_stats.get("pages") if self.ocr_stats else None,
+            "ocr_peak_image_mb": self.ocr_stats.get("peak_image_mb") if self.ocr_stats else None,
+            "ocr_render_rss_mb": self.ocr_stats.get("peak_render_rss_mb") if self.ocr_stats else None,
+            "ocr_process_rss_mb": self.ocr_stats.get("process_rss_mb") if self.ocr_stats else None,
+            "ocr_dpi": self.ocr_stats.get("dpi") if self.ocr_stats else None,
+            "ocr_escalated_pages": self.ocr_stats.get("escalated_pages") if self.ocr_stats else None,
+            "ocr_escalation": self.ocr_stats.get("escalation") if self.ocr_stats else None,
+            "ocr_confidence": self.ocr_stats.get("confidence") if self.ocr_stats else None,
+            "error": str(self.error) if self.error is not None else None,
+        }
+
+
+class RenamePipeline:
+    """
+    有界并发的分阶段流水线。
+    文件提交后在各阶段的工作池之间流转，调用方按提交顺序取回结果。
+    """
+
+    def __init__(self, fields, split, ai_extractor, ocr_factory, concurrency=None, cache=None, ai_batch_size=None,
+                 max_pages=None):
+        """
+        :param fields: 用户选择的字段列表（中文名）。
+        :param split: 文件名分隔符。
+        :param ai_extractor: InvoiceExtractor 实例，可在多线程间共享。
+        :param ocr_factory: 创建 OCR 提取器的函数，每个 OCR 线程调用一次。
+        :param concurrency: 各阶段并发数，见 load_concurrency。
+        :param cache: ExtractionCache 实例；为 None 时不使用缓存。
+        :param ai_batch_size: 大于 1 时启用批量 AI 模式，把多张发票打包进一次调用，见 load_ai_batch_size。
+        :param max_pages: 文本阶段每个 PDF 最多读取的页数，见 load_max_pages。
+        """
+        self.fields = fields
+        self.split = split
+        self.ai_extractor = ai_extractor
+        self.ocr_factory = ocr_factory
+        self.concurrency = load_concurrency(concurrency)
+        self.cache = cache
+        self.ai_batch_size = load_ai_batch_size(ai_batch_size)
+        self.max_pages = load_max_pages(max_pages)
+        self.field_min_confidence = load_field_min_confidence()
+        self._ocr_local = threading.local()
+        # 批量 AI 模式：等待 AI 的文件先排队，凑满一批或上游已无文件时一起发出
+        self._ai_queue = []
+        self._upstream = 0
+        self._queue_lock = threading.Lock()
+        # 计算文件哈希并查询缓存，hashlib 计算时会释放 GIL
+        self._cache_pool = ThreadPoolExecutor(max_workers=self.concurrency["text"], thread_name_prefix="cache")
+        # PDF 解析和渲染在隔离进程里进行：单个文件超时或内存超限时杀掉进程并跳过该文件。
+        # OCR 的逐页渲染用单独的进程池（每个 OCR 线程一个进程），不排在文本阶段的解析任务后面
+        self._text_pool = ParsePool(max_workers=self.concurrency["text"])
+        self._raster_pool = ParsePool(max_workers=self.concurrency["ocr"])
+        self._ocr_pool = ThreadPoolExecutor(max_workers=self.concurrency["ocr"], thread_name_prefix="ocr")
+        self._ai_pool = ThreadPoolExecutor(max_workers=self.concurrency["ai"], thread_name_prefix="ai")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.shutdown()
+
+    def shutdown(self):
+        self._cache_pool.shutdown(wait=True)
+        # OCR 线程会把 PDF 渲染提交给渲染进程池，所以进程池在 OCR 线程之后关闭
+        self._ocr_pool.shutdown(wait=True)
+        self._raster_pool.shutdown(wait=True)
+        self._text_pool.shutdown(wait=True)
+        self._ai_pool.shutdown(wait=True)
+
+    def parse_stats(self):
+        """解析进程池的统计：处理数、超时 / 内存超限 / 崩溃次数、回收次数及限制值"""
+        return self._text_pool.stats()
+
+    def raster_stats(self):
+        """OCR 渲染进程池的统计，格式同 parse_stats"""
+        return self._raster_pool.stats()
+
+    def submit(self, task):
+        """把文件送入流水线，立即返回；结果通过 task.done 获取"""
+        task.started = time.perf_counter()
+        with self._queue_lock:
+            self._upstream += 1
+        if self.cache is not None:
+            self._run_stage(self._cache_pool, "cache", self._cache_stage, task)
+        else:
+            self._advance(task, lambda: "probe")
+        return task
+
+    def process(self, tasks):
+        """提交全部文件，并按原顺序逐个产出已完成的 FileTask"""
+        for task in tasks:
+            self.submit(task)
+        for task in tasks:
+            yield task.done.result()
+
+    # --- 阶段调度 ---
+    def _run_stage(self, pool, stage_name, stage_func, task):
+        def timed(task):
+            start = time.perf_counter()
+            try:
+                return stage_func(task)
+            finally:
+                task.stage_times[stage_name] = task.stage_times.get(stage_name, 0) + time.perf_counter() - start
+
+        future = pool.submit(timed, task)
+        future.add_done_callback(lambda f: self._advance(task, f.result))
+
+    def _advance(self, task, get_next_stage):
+        try:
+            next_stage = get_next_stage()
+        except Exception as e:
+            task.error = e
+            next_stage = None
+
+        if next_stage == "probe":
+            # 探测只读 PDF 结构，几毫秒，和缓存查询共用一个线程池
+            self._run_stage(self._cache_pool, "probe", self._probe_stage, task)
+        elif next_stage == "text":
+            future = self._text_pool.submit(read_text_fields, task.file_path, self.fields, self.max_pages)
+            # 文本阶段在子进程运行，回到本进程后再决定下一阶段
+            future.add_done_callback(lambda f: self._advance(task, lambda: self._text_stage(task, *f.result())))
+        elif next_stage == "ocr":
+            self._run_stage(self._ocr_pool, "ocr", self._ocr_stage, task)
+        elif next_stage == "ai" and self.ai_batch_size > 1:
+            task.queued_for_ai = True
+            self._enqueue_ai(task, leaving_upstream=True)
+        elif next_stage == "ai":
+            self._run_stage(self._ai_pool, "ai", self._ai_stage, task)
+        else:
+            if task.error is None and not self._has_values(task.field_values):
+                # 一个字段都没有提取到（AI 调用失败 / 熔断 / 429 重试耗尽），不能重命名成 “__.pdf”
+                task.error = RuntimeError("没有提取到任何字段，不重命名")
+            self._store(task)
+            task.finished = time.perf_counter()
+            task.done.set_result(task)
+            if not task.queued_for_ai:
+                self._enqueue_ai(None, leaving_upstream=True)
+
+    def _enqueue_ai(self, task, leaving_upstream):
+        """
+        批量 AI 模式的排队逻辑。task 为 None 表示只是有文件离开了上游阶段（已完成），
+        此时若上游已经没有文件，就把队列里剩下的不满一批的文件也发出去。
+        """
+        batches = []
+        with self._queue_lock:
+            if leaving_upstream:
+                self._upstream -= 1
+            if task is not None:
+                self._ai_queue.append(task)
+            while self._ai_queue and (len(self._ai_queue) >= self.ai_batch_size or self._upstream == 0):
+                batches.append(self._ai_queue[:self.ai_batch_size])
+                del self._ai_queue[:self.ai_batch_size]
+        for batch in batches:
+            future = self._ai_pool.submit(self._ai_batch_stage, batch)
+            future.add_done_callback(lambda f, batch=batch: [self._advance(t, f.result) for t in batch])
+
+    def _store(self, task):
+        if self.cache is None or task.cache_key is None or task.error is not None or task.stage == "cache":
+            return
+        try:
+            self.cache.store(task.cache_key, task.field_values, task.stage)
+        except Exception as e:
+            task.insert(END, f"\n写入缓存失败: {e}")
+
+    def _has_values(self, field_values):
+        """所选字段中至少有一个提取到了值"""
+        return any((field_values or {}).get(key) for key in self.fields)
+
+    # --- 各阶段 ---
+    def _set_values(self, task, field_values, stage):
+        task.field_values = field_values
+        task.new_name_base = self.split.join(field_values.get(key) or "" for key in self.fields)
+        task.stage = stage
+
+    def _cache_stage(self, task):
+        task.cache_key, cached = self.cache.lookup(task.file_path, self.fields)
+        if cached is None or not self._has_values(cached["fields"]):
+            # 旧版本可能缓存过全空的结果，当作未命中重新提取
+            return "probe"
+        task.insert(END, f"命中缓存（上次结果来自 {cached['tier']}）\n")
+        self._set_values(task, cached["fields"], "cache")
+        return None
+
+    def _probe_stage(self, task):
+        probe = probe_pdf(task.file_path)
+        task.route = probe["kind"]
+        return route_for(task.route)
+
+    def _text_stage(self, task, full_text, field_values, messages, elapsed, pages_read, tier):
+        task.messages.extend(messages)
+        task.stage_times["text"] = elapsed
+        task.pages_read = pages_read
+        task.full_text = full_text
+        if not task.filename.lower().endswith('.pdf') or full_text is None or not any(field_values.values()):
+            return "ocr"
+
+        self._set_values(task, field_values, tier)
+        return "ai" if is_incomplete_name(task.new_name_base) else None
+
+    def _ocr_extractor(self):
+        extractor = getattr(self._ocr_local, "extractor", None)
+        if extractor is None:
+            extractor = self._ocr_local.extractor = self.ocr_factory()
+        if hasattr(extractor, "raster_pool"):
+            extractor.raster_pool = self._raster_pool
+        return extractor
+
+    def _ocr_stage(self, task):
+        # 不是pdf，或者没有文本层、文本里没有字段，就走图片识别
+        reason = "未提取到有效字段" if task.route in TEXT_KINDS else f"未检测到文本层（{task.route}）"
+        task.insert(END, f"\n{reason}，图片识别发票中，请稍候...")
+        extractor = self._ocr_extractor()
+        if not hasattr(extractor, "extract_result"):
+            task.full_text = extractor.extract_from_path(task.file_path)
+            task.from_ocr = True
+            return "ai"
+        result = extractor.extract_result(task.file_path, fields=self.fields)
+        task.full_text = result.text
+        task.ocr_stats = dict(getattr(extractor, "last_stats", None) or {})
+        task.from_ocr = True
+        if result.error:
+            return "ai"
+
+        # 先用本地正则提取 OCR 文本，字段齐全且所在行的置信度都够高时不调用 AI
+        from rename_function import extract_fields_from_text
+
+        field_values = extract_fields_from_text(result.text, self.fields)
+        low = result.low_confidence_fields(field_values, self.field_min_confidence)
+        task.ocr_stats["low_confidence_fields"] = low
+        self._set_values(task, field_values, "ocr")
+        if is_incomplete_name(task.new_name_base):
+            return "ai"
+        if low:
+            task.insert(END, f"\n识别置信度较低：{'、'.join(low)}，交给 AI 复核")
+            return "ai"
+        return None
+
+    def _ai_stage(self, task):
+        # 文本或 OCR 结果不完整时交给 AI，每个文件只调用一次（同一段文本再调用一次也不会更好）
+        task.insert(END, "\nAI处理发票中，请稍候...")
+        stage = "ocr_ai" if task.from_ocr else "ai"
+        self._set_values(task, self.ai_extractor.get_fields_by_chat_ai(task.full_text, self.fields), stage)
+        return None
+
+    def _ai_batch_stage(self, tasks):
+        start = time.perf_counter()
+        for task in tasks:
+            task.insert(END, f"\nAI批量处理发票中（本批{len(tasks)}张），请稍候...")
+        values_list = self.ai_extractor.get_fields_batch_by_chat_ai(
+            [task.full_text for task in tasks], self.fields, max_batch_size=self.ai_batch_size)
+        elapsed = time.perf_counter() - start
+        for task, field_values in zip(tasks, values_list):
+            self._set_values(task, field_values, "ocr_ai" if task.from_ocr else "ai")
+            task.stage_times["ai"] = elapsed
+        return None
+
+
+def ocr_escalation_summary(tasks):
+    """统计 OCR 分辨率升级：走了 OCR 的文件数、升级的文件数 / 页数，以及按原因分类"""
+    stats = [task.ocr_stats for task in tasks if task.ocr_stats]
+    escalated = [s for s in stats if s.get("escalated_pages")]
+    return {
+        "files": len(stats),
+        "escalated_files": len(escalated),
+        "escalated_pages": sum(s["escalated_pages"] for s in escalated),
+        "pages": sum(s.get("pages", 0) for s in stats),
+        "reasons": dict(Counter(s.get("escalation") for s in escalated)),
+    }
+
+
+def rename_in_order(text_area, bak_dir, tasks, journal=None):
+    """
+    按提交顺序消费流水线结果并重命名，冲突处理只在这里串行进行，保证结果确定。
+    每次成功的重命名都会写入 journal（RenameJournal）。
+
+    :return: (total, success_count, filename_same_count)
+    """
+    from rename_function import sanitize_filename
+
+    total = 0   # 总数
+    success_count = 0   # 处理成功总数
+    filename_same_count = 0     # 文件名冲突数
+    for task in tasks:
+        total += 1
+        text_area.insert(END, f"\n处理文件：{task.filename}\n")
+        for message in task.messages:
+            text_area.insert(END, message)
+        text_area.see(END)
+
+        if task.error is not None:
+            text_area.insert(END, f"\n处理失败: {task.error}\n")
+            text_area.see(END)
+            continue
+
+        # 提取原始文件的后缀名
+        _, original_ext = os.path.splitext(task.filename)
+        base = sanitize_filename(task.new_name_base)
+        # 将新的文件名基础部分与原始后缀名拼接
+        new_name = base + original_ext
+        new_path = os.path.join(bak_dir, new_name)
+        if os.path.exists(new_path):
+            filename_same_count += 1
+            text_area.insert(END, f"文件名冲突，加个随机数: {new_name}\n")
+            text_area.see(END)
+            stamp = time.strftime("%Y%m%d%H%M%S")
+            new_name = base + stamp + original_ext
+            suffix = 1
+            while os.path.exists(os.path.join(bak_dir, new_name)):
+                new_name = f"{base}{stamp}_{suffix}{original_ext}"
+                suffix += 1
+            new_path = os.path.join(bak_dir, new_name)
+
+        try:
+            os.rename(task.file_path, new_path)
+            task.new_name = new_name
+            task.renamed = True
+            if journal is not None:
+                journal.record_rename(task.filename, new_name)
+            text_area.insert(END, f"重命名成功: {task.filename} -> {new_name}\n")
+            text_area.see(END)
+            success_count += 1
+        except Exception as e:
+            text_area.insert(END, f"重命名失败: {e}\n")
+            text_area.see(END)
+
+    return total, success_count, filename_same_count
+
+
+def backup_folder(text_area, pdf_dir, mode=None):
+    """
+    把待处理目录中的文件备份到新建的 rename_xxxxxxxx 目录，后续只在备份目录里重命名。
+    优先用 reflink / 硬链接，不复制文件数据；都不支持时才复制。
+
+    :param mode: 备份方式 auto / reflink / hardlink / copy，默认读取环境变量 BACKUP_MODE。
+    :return: (bak_dir, stats)。stats 包含备份方式、各方式的文件数、总字节数和实际复制的字节数。
+    """
+    from rename_function import get_backup_dir
+
+    bak_dir = get_backup_dir(pdf_dir)
+    text_area.insert(END, f"备份目录为：{bak_dir}\n")
+    text_area.see(END)
+
+    start = time.perf_counter()
+    cloner = FileCloner(mode)
+    count = 0
+    # 文件备份
+    for filename in os.listdir(pdf_dir):
+        src = os.path.join(pdf_dir, filename)
+        if not os.path.isfile(src) or is_journal(filename):
+            continue
+        cloner.clone(src, os.path.join(bak_dir, filename))
+        count += 1
+
+    stats = {"files": count, **cloner.stats(), "elapsed_sec": round(time.perf_counter() - start, 3)}
+    RenameJournal(bak_dir).write("backup", source=os.path.abspath(pdf_dir), **stats)
+    text_area.insert(END, f"已备份{count}个PDF文件到：{bak_dir}（{stats['methods']}，"
+                          f"实际复制 {stats['bytes_copied'] / 1024 / 1024:.1f} MB / "
+                          f"共 {stats['bytes_total'] / 1024 / 1024:.1f} MB）\n")
+    if cloner.counts["hardlink"]:
+        text_area.insert(END, "备份文件与原文件为硬链接，请不要直接修改备份目录里的文件内容。\n")
+    text_area.see(END)
+    return bak_dir, stats
+
+
+def run_rename_job(text_area, bak_dir, fields, split, ai_extractor, ocr_factory, concurrency=None, use_cache=True,
+                   ai_batch_size=None, max_pages=None):
+    """
+    对备份目录中的全部文件运行流水线并重命名。
+
+    :param use_cache: 是否使用提取结果缓存；环境变量 EXTRACTION_CACHE=0 时也会关闭。
+    :param ai_batch_size: 批量 AI 模式每批的发票数，1 表示逐张调用。
+    :param max_pages: 文本阶段每个 PDF 最多读取的页数，0 表示不限制。
+
+    :return: (summary, tasks)。summary 为本次运行的汇总统计，tasks 为按顺序排列的 FileTask 列表。
+    """
+    filenames = sorted(f for f in os.listdir(bak_dir)
+                       if os.path.isfile(os.path.join(bak_dir, f)) and not is_journal(f))
+    tasks = [FileTask(i, name, os.path.join(bak_dir, name)) for i, name in enumerate(filenames)]
+
+    cache = None
+    if use_cache and cache_enabled_by_env():
+        cache = ExtractionCache(version=f"{EXTRACTOR_VERSION}:{getattr(ai_extractor, 'model_name', '')}")
+        text_area.insert(END, f"提取结果缓存：{cache.path}\n")
+
+    start = time.perf_counter()
+    with RenamePipeline(fields, split, ai_extractor, ocr_factory, concurrency, cache, ai_batch_size,
+                        max_pages) as pipeline:
+        concurrency = pipeline.concurrency
+        ai_batch_size = pipeline.ai_batch_size
+        max_pages = pipeline.max_pages
+        text_area.insert(END, f"并发设置：文本{concurrency['text']} / OCR{concurrency['ocr']} / AI{concurrency['ai']}"
+                              f"（每批{ai_batch_size}张）\n")
+        text_area.see(END)
+        total, success_count, filename_same_count = rename_in_order(text_area, bak_dir, pipeline.process(tasks),
+                                                                    RenameJournal(bak_dir))
+    elapsed = time.perf_counter() - start
+    parse_stats = pipeline.parse_stats()
+    raster_stats = pipeline.raster_stats()
+
+    summary = {
+        "backup_dir": bak_dir,
+        "fields": list(fields),
+        "split": split,
+        "concurrency": concurrency,
+        "ai_batch_size": ai_batch_size,
+        "max_pages": max_pages,
+        "total": total,
+        "success": success_count,
+        "conflicts": filename_same_count,
+        "failed": total - success_count,
+        "elapsed_sec": round(elapsed, 3),
+        "files_per_sec": round(total / elapsed, 3) if elapsed > 0 else None,
+        "tiers": dict(Counter(task.stage or "none" for task in tasks)),
+        "routes": dict(Counter(task.route or "none" for task in tasks)),
+        "parse_pool": parse_stats,
+        "raster_pool": raster_stats,
+        "ocr_escalation": ocr_escalation_summary(tasks),
+        "cache": cache.stats() if cache is not None else None,
+        "llm_memo": ai_extractor.memo.stats() if getattr(ai_extractor, "memo", None) is not None else None,
+        "circuit_breakers": breaker_report(),
+    }
+    if cache is not None:
+        cache.close()
+    return summary, tasks
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+测试标准发票版面提取：左右两栏和上下排列的购方 / 销方信息都不能串位
+运行：python -m pytest test_fapiao_layout.py 或 python test_fapiao_layout.py
+"""
+from fapiao_layout import extract_layout_fields
+
+FIELDS = ["发票号码", "开票日期", "购方名称", "购方税号", "销方名称", "销方税号"]
+
+
+class FakePage:
+    """只提供 extract_layout_fields 用到的 width 和 extract_words()"""
+
+    def __init__(self, words, width=595):
+        self.width = width
+        self._words = [{"text": text, "x0": x0, "top": top} for text, x0, top in words]
+
+    def extract_words(self):
+        return list(self._words)
+
+
+def _header():
+    return [("发票号码：24310000000012345678", 400, 40), ("开票日期：2024年01月02日", 400, 55)]
+
+
+def test_two_columns():
+    page = FakePage(_header() + [
+        ("购", 20, 100), ("名称：", 40, 100), ("北京买方有限公司", 90, 100),
+        ("销", 300, 100), ("名称：", 320, 100), ("上海卖方有限公司", 370, 100),
+        ("统一社会信用代码/纳税人识别号：", 40, 120), ("91110000AAAAAAAAAA", 200, 120),
+        ("统一社会信用代码/纳税人识别号：", 320, 120), ("91310000BBBBBBBBBB", 480, 120),
+    ])
+    values, _ = extract_layout_fields(page, FIELDS)
+    assert values["购方名称"] == "北京买方有限公司"
+    assert values["销方名称"] == "上海卖方有限公司"
+    assert values["购方税号"] == "91110000AAAAAAAAAA"
+    assert values["销方税号"] == "91310000BBBBBBBBBB"
+
+
+def test_stacked_blocks():
+    # 购方在上、销方在下，两个“名称”标签的 x0 只差零点几个点，而且销方的更靠左
+    page = FakePage(_header() + [
+        ("购", 20, 100), ("名称：", 40.4, 100), ("北京买方有限公司", 90, 100),
+        ("统一社会信用代码/纳税人识别号：", 40.4, 115), ("91110000AAAAAAAAAA", 200, 115),
+        ("销", 20, 140), ("名称：", 40.1, 140), ("上海卖方有限公司", 90, 140),
+        ("统一社会信用代码/纳税人识别号：", 40.1, 155), ("91310000BBBBBBBBBB", 200, 155),
+    ])
+    values, _ = extract_layout_fields(page, FIELDS)
+    assert values["购方名称"] == "北京买方有限公司"
+    assert values["销方名称"] == "上海卖方有限公司"
+    assert values["购方税号"] == "91110000AAAAAAAAAA"
+    assert values["销方税号"] == "91310000BBBBBBBBBB"
+
+
+def test_stacked_name_does_not_absorb_seller_block():
+    # 购方名称下面紧跟销方名称（没有购方税号）时，折行拼接不能越过销方区域
+    page = FakePage(_header() + [
+        ("名称：", 40.4, 100), ("北京买方有限公司", 90, 100),
+        ("名称：", 40.1, 115), ("上海卖方有限公司", 90, 115),
+        ("统一社会信用代码/纳税人识别号：", 40.1, 130), ("91310000BBBBBBBBBB", 200, 130),
+    ])
+    values, _ = extract_layout_fields(page, ["购方名称", "销方名称"])
+    assert values["购方名称"] == "北京买方有限公司"
+    assert values["销方名称"] == "上海卖方有限公司"
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+多进程共享的 access token 磁盘缓存（百度 OCR 等 OAuth 接口）
+    持久化：token 和过期时间写入 ~/.invoice_renamer/tokens/，新进程直接读取，不再请求 OAuth 接口
+    提前刷新：剩余有效期不足 10%（至少 60 秒）时重新获取
+    失效处理：接口返回 token 失效时调用 invalidate，下一次 get 重新获取
+    防止并发风暴：刷新时持有文件锁，拿到锁后先重读文件，别的进程已经刷新过就直接使用
+
+环境变量 TOKEN_CACHE_DIR：缓存目录（默认 ~/.invoice_renamer/tokens）
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+DEFAULT_TOKEN_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".invoice_renamer", "tokens")
+MIN_REFRESH_MARGIN = 60          # 提前刷新的最短时间（秒）
+REFRESH_RATIO = 0.1              # 剩余有效期不足总有效期的这个比例时提前刷新
+MIN_FETCH_INTERVAL = 5           # 两次获取之间的最短间隔，避免失效判断出错时反复请求
+
+
+@contextmanager
+def _file_lock(path):
+    """跨进程的排他文件锁（Unix 用 flock，Windows 用 msvcrt），都不支持时只有进程内的锁"""
+    with open(path, "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        elif msvcrt is not None:
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            elif msvcrt is not None:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class TokenCache:
+    """
+    一组凭据对应的 token 缓存，可以在多个线程和进程间共享。
+    fetch() 返回 (token, expires_in 秒)，只在缓存缺失、即将过期或被标记失效时调用。
+    """
+
+    def __init__(self, name, credential, fetch, cache_dir=None):
+        """
+        :param name: 服务名，用于缓存文件名，如 "baidu"。
+        :param credential: 区分不同凭据的字符串（如 API Key），只保存其哈希。
+        :param fetch: 获取新 token 的函数，返回 (token, expires_in)。
+        :param cache_dir: 缓存目录，默认读取环境变量 TOKEN_CACHE_DIR。
+        """
+        cache_dir = cache_dir or os.environ.get("TOKEN_CACHE_DIR", DEFAULT_TOKEN_CACHE_DIR)
+        os.makedirs(cache_dir, exist_ok=True)
+        key = hashlib.sha256(credential.encode("utf-8")).hexdigest()[:16]
+        self.path = os.path.join(cache_dir, f"{name}_{key}.json")
+        self.lock_path = self.path + ".lock"
+        self.fetch = fetch
+        self._entry = None
+        self._lock = threading.Lock()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "fetches": 0, "invalidations": 0}
+
+    @staticmethod
+    def _fresh(entry, now=None):
+        """token 存在且不需要提前刷新"""
+        if not entry or not entry.get("token"):
+            return False
+        now = now or time.time()
+        lifetime = entry["expires_at"] - entry["fetched_at"]
+        margin = max(MIN_REFRESH_MARGIN, lifetime * REFRESH_RATIO)
+        return now < entry["expires_at"] - margin
+
+    def _read(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, entry):
+        """先写临时文件再替换，读取方不会看到写了一半的文件；文件只有当前用户可读"""
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(entry, f)
+        os.replace(tmp, self.path)
+
+    def get(self):
+        """返回有效的 token，必要时获取新的"""
+        entry = self._entry
+        if self._fresh(entry):
+            self.stats["memory_hits"] += 1
+            return entry["token"]
+        with self._lock, _file_lock(self.lock_path):
+            # 拿到锁后重读：其他线程 / 进程可能已经刷新过
+            entry = self._read()
+            if self._fresh(entry):
+                self._entry = entry
+                self.stats["disk_hits"] += 1
+                return entry["token"]
+            if entry and entry.get("token") and time.time() - entry.get("fetched_at", 0) < MIN_FETCH_INTERVAL \
+                    and time.time() < entry["expires_at"]:
+                # 刚刚获取过（有效期异常短），不重复请求
+                self._entry = entry
+                return entry["token"]
+            token, expires_in = self.fetch()
+            now = time.time()
+            entry = {"token": token, "fetched_at": now, "expires_at": now + float(expires_in)}
+            self._write(entry)
+            self._entry = entry
+            self.stats["fetches"] += 1
+            return token
+
+    def invalidate(self, token):
+        """
+        标记 token 失效（接口返回 token 无效 / 过期时调用）。
+        只有缓存里仍是这个 token 时才删除，别的进程已经换了新 token 时不受影响。
+        """
+        with self._lock, _file_lock(self.lock_path):
+            self.stats["invalidations"] += 1
+            if self._entry and self._entry.get("token") == token:
+                self._entry = None
+            entry = self._read()
+            if entry and entry.get("token") == token:
+                try:
+                    os.remove(self.path)
+                except FileNotFoundError:
+                    pass
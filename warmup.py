@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+后台预热 - 用户还在选择字段时，在后台线程里加载 OCR 模型、创建 AI 客户端
+点击确认后直接拿到已经准备好的提取器，第一个文件不用再等模型加载
+
+环境变量 WARMUP_OCR=0 时不预加载 OCR 模型（节省内存，需要时再加载）
+"""
+import os
+import threading
+import time
+
+DEFAULT_MODEL_NAME = 'moonshot-v1-8k'
+
+
+def _env_enabled(name, default="1"):
+    return os.environ.get(name, default).lower() not in ("0", "false", "no", "off")
+
+
+class _Slot:
+    """一个后台创建的对象：创建完成（或失败）后 ready 被置位"""
+
+    def __init__(self):
+        self.ready = threading.Event()
+        self.value = None
+        self.error = None
+        self.elapsed = None
+
+
+class Warmup:
+    """
+    后台预热导入和提取器。所有方法都可以在任意线程调用；
+    取提取器时如果预热还没完成会等待它完成，而不是再加载一份。
+    """
+
+    def __init__(self, model_name=None, ocr=None):
+        """
+        :param model_name: AI 模型名称，默认读取环境变量 MODEL_NAME。
+        :param ocr: 是否预加载 OCR 模型，默认读取环境变量 WARMUP_OCR。
+        """
+        self.model_name = model_name or os.environ.get("MODEL_NAME", DEFAULT_MODEL_NAME)
+        self.warm_ocr = _env_enabled("WARMUP_OCR") if ocr is None else ocr
+        self._ai = _Slot()
+        self._ocr = _Slot()
+        self._thread = None
+
+    def start(self):
+        """启动后台线程并立即返回自身"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="warmup", daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        # 先导入文本提取用的模块，加快第一个文件的处理；解析进程池的工作进程用 forkserver / spawn 启动，
+        # 不会继承这里的导入（forkserver 服务进程自己预先导入，见 parse_pool._FORKSERVER_PRELOAD）
+        try:
+            import pdfplumber  # noqa: F401
+            import rename_pipeline  # noqa: F401
+        except Exception as e:
+            print(f"⚠️ 预热导入失败: {e}")
+
+        self._fill(self._ai, self._create_ai)
+        if self.warm_ocr:
+            self._fill(self._ocr, self._create_ocr)
+        else:
+            self._ocr.ready.set()
+
+    def _create_ai(self):
+        from chat_ai_rename import InvoiceExtractor
+        return InvoiceExtractor(model_name=self.model_name)
+
+    @staticmethod
+    def _create_ocr():
+        from chat_ai_rename import ImageOcrExtractor
+        return ImageOcrExtractor()
+
+    @staticmethod
+    def _fill(slot, factory):
+        start = time.perf_counter()
+        try:
+            slot.value = factory()
+        except Exception as e:
+            slot.error = e
+            print(f"⚠️ 预热失败，将在使用时重新创建: {e}")
+        finally:
+            slot.elapsed = round(time.perf_counter() - start, 3)
+            slot.ready.set()
+
+    def ai_extractor(self, model_name=None):
+        """
+        返回预热好的 InvoiceExtractor；模型名称与预热时不同或预热失败时新建一个。
+        """
+        model_name = model_name or os.environ.get("MODEL_NAME", DEFAULT_MODEL_NAME)
+        if self._thread is not None and model_name == self.model_name:
+            self._ai.ready.wait()
+            if self._ai.value is not None:
+                return self._ai.value
+
+        from chat_ai_rename import InvoiceExtractor
+        return InvoiceExtractor(model_name=model_name)
+
+    def ocr_factory(self):
+        """
+        返回给 RenamePipeline 用的 OCR 工厂函数（每次运行取一个新的）。
+        第一个调用它的 OCR 线程拿到预热好的实例，其余线程各自新建，
+        PaddleOCR 实例不在线程之间共享（界面上一次只跑一个任务，预热实例在前后两次运行之间复用）。
+        """
+        handed_out = threading.Lock()
+
+        def factory():
+            if self._thread is not None and self.warm_ocr and handed_out.acquire(blocking=False):
+                self._ocr.ready.wait()
+                if self._ocr.value is not None:
+                    return self._ocr.value
+
+            from chat_ai_rename import ImageOcrExtractor
+            return ImageOcrExtractor()
+
+        return factory
+
+    def stats(self):
+        """各项预热耗时（秒），还没完成的为 None"""
+        return {"ai_sec": self._ai.elapsed, "ocr_sec": self._ocr.elapsed}